@@ -0,0 +1,187 @@
+"""
+Answer a file of questions in bulk and stream the results as JSON lines.
+
+Usage:
+    python -m app.batch questions.jsonl -o results.jsonl --batch-size 512
+
+Input is JSON lines (objects with a "question" key, or bare strings) or a CSV with a
+question column. Optional per-question "table_name" and "error_rate" fields are
+honoured; every other input field is copied to the output line. Each batch is
+embedded in one bulk request, searched with one multi-query FAISS call per table
+filter and conformally filtered with one vectorized mask per calibration group.
+Timings are per question, amortized over its batch.
+"""
+import sys
+import csv
+import json
+import time
+import argparse
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+from app.rag_pipeline import RagPipeline, add_query_status, CSV_PATH, SQLITE_PATH, VECTORSTORE_PATH
+from app.metadata_vectorstore import search_metadata_columnar, get_vectorstore
+from app.calibration.conformal import conformal_select_many, conformal_result
+from app.calibration.storage import CALIBRATION_PATH
+
+DEFAULT_BATCH_SIZE = 512
+
+
+def read_questions(path: str, question_column: str = "question") -> Iterator[Dict]:
+    """Stream question records from a .jsonl or .csv file ('-' reads JSON lines from stdin)"""
+    if path.lower().endswith('.csv'):
+        with open(path, newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                row['question'] = row.pop(question_column)
+                yield row
+        return
+
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield record if isinstance(record, dict) else {'question': record}
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+def _batches(records: Iterable[Dict], batch_size: int) -> Iterator[List[Dict]]:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _record_error_rate(record: Dict, default: float) -> float:
+    """The record's own error rate; missing, null or empty (a blank CSV cell) means `default`"""
+    value = record.get('error_rate')
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return default
+    return float(value)
+
+def answer_batch(
+    pipeline: RagPipeline,
+    records: List[Dict],
+    error_rate: float = 0.1,
+    k: int = 10
+) -> List[Dict]:
+    """Answer one batch of question records, returning one output record per input"""
+    start = time.perf_counter()
+    vectorstore = get_vectorstore(pipeline.vectorstore_path)
+    groups: Dict[Optional[str], List[int]] = {}
+    for i, record in enumerate(records):
+        groups.setdefault(record.get('table_name') or None, []).append(i)
+
+    retrieved = [None] * len(records)
+    for table_name, positions in groups.items():
+        chunks = search_metadata_columnar(
+            [records[i]['question'] for i in positions],
+            k=k,
+            confidence_threshold=pipeline.confidence_threshold,
+            vectorstore=vectorstore,
+            table_names=[table_name] if table_name else None,
+            mode=pipeline.retrieval_mode,
+            rrf_k=pipeline.rrf_k
+        )
+        for i, question_chunks in zip(positions, chunks):
+            retrieved[i] = question_chunks
+    search_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    error_rates = [_record_error_rate(record, error_rate) for record in records]
+    # One vectorized selection per distinct set of thresholds (table or question category)
+    by_thresholds: Dict[int, List[int]] = {}
+    thresholds = {}
+    for i, record in enumerate(records):
+        question_thresholds = pipeline.thresholds_for(record.get('table_name') or None, record['question'])
+        thresholds[id(question_thresholds)] = question_thresholds
+        by_thresholds.setdefault(id(question_thresholds), []).append(i)
+
+    results = [None] * len(records)
+    for key, positions in by_thresholds.items():
+        selected = conformal_select_many(
+            [retrieved[i] for i in positions],
+            [error_rates[i] for i in positions],
+            thresholds[key]
+        )
+        for i, question_selected in zip(positions, selected):
+            results[i] = add_query_status(conformal_result(question_selected, error_rates[i]))
+    filter_seconds = time.perf_counter() - start
+
+    timings = {
+        'search_ms': round(search_seconds * 1000 / len(records), 3),
+        'filter_ms': round(filter_seconds * 1000 / len(records), 3)
+    }
+    return [
+        {**record, **result, 'timings': timings}
+        for record, result in zip(records, results)
+    ]
+
+def run_batch(
+    pipeline: RagPipeline,
+    records: Iterable[Dict],
+    output: TextIO,
+    error_rate: float = 0.1,
+    k: int = 10,
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Dict:
+    """Answer all records, writing JSON lines as each batch completes; returns run totals"""
+    start = time.perf_counter()
+    total = 0
+    for batch in _batches(records, batch_size):
+        for result in answer_batch(pipeline, batch, error_rate=error_rate, k=k):
+            output.write(json.dumps(result) + "\n")
+        output.flush()
+        total += len(batch)
+    seconds = time.perf_counter() - start
+    return {
+        'questions': total,
+        'seconds': round(seconds, 3),
+        'questions_per_second': round(total / seconds, 1) if seconds > 0 else None
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('input', help=".jsonl or .csv file of questions, '-' for JSON lines on stdin")
+    parser.add_argument('-o', '--output', default='-', help="Output .jsonl file (default: stdout)")
+    parser.add_argument('--question-column', default='question', help="CSV column holding the question")
+    parser.add_argument('--error-rate', type=float, default=0.1)
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--csv-path', default=CSV_PATH)
+    parser.add_argument('--no-csv', action='store_true', help="Use the existing SQLite database without ingesting a CSV")
+    parser.add_argument('--csv-dir', default=None)
+    parser.add_argument('--sqlite-path', default=SQLITE_PATH)
+    parser.add_argument('--vectorstore-path', default=VECTORSTORE_PATH)
+    parser.add_argument('--calibration-path', default=CALIBRATION_PATH)
+    args = parser.parse_args()
+
+    pipeline = RagPipeline(
+        csv_path=None if args.no_csv else args.csv_path or None,
+        csv_dir=args.csv_dir,
+        sqlite_path=args.sqlite_path,
+        vectorstore_path=args.vectorstore_path,
+        calibration_path=args.calibration_path
+    ).load()
+
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    try:
+        totals = run_batch(
+            pipeline,
+            read_questions(args.input, args.question_column),
+            output,
+            error_rate=args.error_rate,
+            k=args.k,
+            batch_size=args.batch_size
+        )
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(json.dumps(totals), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
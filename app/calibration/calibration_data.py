@@ -1,53 +1,130 @@
-from typing import List, Dict
-import json
-import os
+from typing import List, Dict, Optional
 from datetime import datetime
+import logging
 import numpy as np
-from app.calibration.storage import CalibrationQuestionStorage
-from app.metadata_vectorstore import search_metadata_with_scores
+from langchain_community.vectorstores import FAISS
+from app.calibration.storage import CALIBRATION_PATH, CalibrationQuestionStorage, CalibrationScoreStore
+from app.metadata_vectorstore import (
+    VECTORSTORE_PATH,
+    candidate_threshold,
+    default_confidence_threshold,
+    get_vectorstore,
+    index_documents,
+    retrieval_mode,
+    search_index
+)
+from app.log import get_logger
 import streamlit as st
 
+logger = get_logger(__name__)
+
+# Neighbours retrieved per calibration question
+CALIBRATION_K = 20
+
+def score_calibration_questions(
+    questions: List[Dict],
+    vectorstore: Optional[FAISS] = None,
+    mode: Optional[str] = None,
+    confidence_threshold: Optional[float] = None,
+    verbose: bool = False
+) -> List[Dict]:
+    """
+    Score calibration questions against an index, without reading or writing storage.
+
+    All questions are embedded in one bulk request and searched with a single
+    multi-query FAISS call; matching neighbours are then selected with array ops.
+    Scores come from the given retrieval mode (dense or hybrid), which is recorded
+    on each record since thresholds only apply to the same mode.
+
+    Args:
+        questions: Question dicts with 'question', 'source_columns' and optional 'table_name'
+        vectorstore: Index to search, default the shared one
+        mode: Retrieval mode, default RETRIEVAL_MODE
+        confidence_threshold: Dense distance above which neighbours are not candidates,
+            default CONFIDENCE_THRESHOLD (the same cut-off queries use)
+        verbose: Log each record at INFO instead of DEBUG
+
+    Returns:
+        One record per (question, retrieved source column), in question order so the
+        score store keeps arrival order for sliding-window thresholds
+    """
+    calibration_records = []
+    if not questions:
+        return calibration_records
+    if vectorstore is None:
+        vectorstore = get_vectorstore()
+    documents = index_documents(vectorstore)
+    mode = retrieval_mode(mode)
+    if confidence_threshold is None:
+        confidence_threshold = default_confidence_threshold()
+    distances, ids = search_index(
+        [question_data['question'] for question_data in questions],
+        k=CALIBRATION_K,
+        vectorstore=vectorstore,
+        mode=mode
+    )
+
+    # Integer code per indexed (table, column) pair (-1 for table docs), plus a
+    # trailing -1 so that missing neighbours (id -1) map to "no column"
+    column_codes: Dict[tuple, int] = {}
+    codes_by_column: Dict[str, List[int]] = {}
+    doc_codes = []
+    for doc in documents:
+        if doc is not None and doc.metadata.get('type') == 'column':
+            key = (doc.metadata.get('table_name'), doc.metadata['column_name'])
+            if key not in column_codes:
+                column_codes[key] = len(column_codes)
+                codes_by_column.setdefault(key[1], []).append(column_codes[key])
+            doc_codes.append(column_codes[key])
+        else:
+            doc_codes.append(-1)
+    neighbour_codes = np.array(doc_codes + [-1])[ids]
+    in_range = (ids >= 0) & (distances <= candidate_threshold(confidence_threshold, mode))
+
+    timestamp = datetime.now().isoformat()
+    record_level = logging.INFO if verbose else logging.DEBUG
+    for i, question_data in enumerate(questions):
+        question = question_data['question']
+        table_name = question_data.get('table_name')
+        source_columns = list(dict.fromkeys(question_data['source_columns']))
+        if table_name:
+            source_codes = [column_codes[(table_name, col)] for col in source_columns if (table_name, col) in column_codes]
+        else:
+            # Questions stored before multi-table support match the column in any table
+            source_codes = [code for col in source_columns for code in codes_by_column.get(col, [])]
+        hits = np.flatnonzero(in_range[i] & np.isin(neighbour_codes[i], source_codes))
+
+        # For each source column that matches, create a separate calibration record
+        for j in hits:
+            doc = documents[ids[i, j]]
+            record = {
+                'question': question,
+                'question_id': question_data.get('id', -1),
+                'category': question_data.get('category'),
+                'chunk': doc.page_content,
+                'cosine_distance': float(distances[i, j]),
+                'metadata': doc.metadata,
+                'source_columns': source_columns,
+                'retrieval_mode': mode,
+                'timestamp': timestamp
+            }
+            calibration_records.append(record)
+
+            logger.log(record_level, "calibration record", extra={
+                'question': question[:50],
+                'column': doc.metadata['column_name'],
+                'cosine_distance': record['cosine_distance']
+            })
+
+    return calibration_records
+
+
 class CalibrationDataCollector:
-    def __init__(self, storage_path: str = "data/calibration"):
+    def __init__(self, storage_path: str = CALIBRATION_PATH, vectorstore_path: str = VECTORSTORE_PATH):
         self.storage_path = storage_path
-        self.calibration_file = os.path.join(storage_path, "questions.json")
-        self.question_storage = CalibrationQuestionStorage()
-        self._ensure_storage_exists()
-    
-    def _ensure_storage_exists(self) -> None:
-        os.makedirs(self.storage_path, exist_ok=True)
-        if not os.path.exists(self.calibration_file):
-            self._save_records([])
-    
-    def _save_records(self, records: List[Dict]) -> None:
-        """Save records to JSON file, converting numpy types to Python native types"""
-        def convert_numpy_types(obj):
-            if isinstance(obj, np.floating):
-                return float(obj)
-            return obj
-
-        # Convert numpy types in records
-        converted_records = []
-        for record in records:
-            converted_record = {
-                key: convert_numpy_types(value)
-                for key, value in record.items()
-            }
-            converted_records.append(converted_record)
-
-        with open(self.calibration_file, 'w') as f:
-            json.dump({
-                'last_updated': datetime.now().isoformat(),
-                'records': converted_records
-            }, f, indent=2)
-    
-    def _load_records(self) -> List[Dict]:
-        try:
-            with open(self.calibration_file, 'r') as f:
-                data = json.load(f)
-                return data.get('records', [])
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
+        self.vectorstore_path = vectorstore_path
+        self.question_storage = CalibrationQuestionStorage(storage_path)
+        self.score_store = CalibrationScoreStore(storage_path)
 
     def collect_calibration_data(
         self,
@@ -55,61 +132,41 @@ class CalibrationDataCollector:
     ) -> List[Dict]:
         """
         Collect calibration data by running stored questions through RAG and recording results.
-        
+
+        See score_calibration_questions for how questions are scored. The score store's
+        lock is held from reading the questions to storing the run, so feedback recorded
+        meanwhile is either scored here or appended to the new run, never lost or doubled.
+
         Args:
-            verbose: Whether to print verbose output
-        
+            verbose: Log each record at INFO instead of DEBUG
+
         Returns:
             List of calibration records
         """
-        calibration_records = []
-        stored_questions = self.question_storage.get_questions()
-        
-        for question_data in stored_questions:
-            question = question_data['question']
-            source_columns = set(question_data['source_columns'])
-            
-            # Get RAG results - this already includes correct cosine distances
-            rag_results = search_metadata_with_scores(question, k=20)
-            
-            if rag_results['matches']:
-                # For each source column that matches, create a separate calibration record
-                for match in rag_results['matches']:
-                    if (match['metadata']['type'] == 'column' and 
-                        match['metadata']['column_name'] in source_columns):
-                        
-                        # Create individual record for each column match
-                        record = {
-                            'question': question,
-                            'chunk': match['content'],
-                            'cosine_distance': float(match['cosine_distance']),  # Convert to native float
-                            'metadata': match['metadata'],
-                            'source_columns': list(source_columns),
-                            'timestamp': datetime.now().isoformat()
-                        }
-                        calibration_records.append(record)
-                        
-                        if verbose:
-                            print(f"Processed question: {question[:50]}...")
-                            print(f"Column: {match['metadata']['column_name']}")
-                            print(f"Cosine distance: {match['cosine_distance']:.4f}")
-                            print("---")
-
-        # Sort records by cosine distance
-        calibration_records.sort(key=lambda x: x['cosine_distance'])
-        
-        # Save records
-        self._save_records(calibration_records)
-        
-        if verbose:
-            print(f"Collected {len(calibration_records)} calibration records")
-            
+        mode = retrieval_mode()
+        with self.score_store.write_lock:
+            stored_questions = self.question_storage.get_questions()
+            calibration_records = score_calibration_questions(
+                stored_questions,
+                vectorstore=get_vectorstore(self.vectorstore_path),
+                mode=mode,
+                verbose=verbose
+            )
+
+            # Save the scores as a new run, replacing the previous one
+            self.score_store.new_run(calibration_records, mode)
+
+        logger.info("collected calibration records", extra={
+            'records': len(calibration_records),
+            'questions': len(stored_questions)
+        })
+
         return calibration_records
 
     def get_calibration_records(self) -> List[Dict]:
-        """Get stored calibration records"""
-        return self._load_records()
+        """Get stored calibration records (prefer score_store.load_scores() for thresholds)"""
+        return self.score_store.records()
 
     def clear_records(self) -> None:
         """Clear all stored calibration records"""
-        self._save_records([])
+        self.score_store.clear()
@@ -1,111 +1,348 @@
-from typing import List, Dict
+import math
+import logging
+from collections import deque
+from typing import List, Dict, Optional, Sequence, Union
 import numpy as np
+from app.metadata_vectorstore import RetrievedChunks
+from app.tracing import traced
+from app.log import get_logger
+
+logger = get_logger(__name__)
+
+# Slider resolution used for the precomputed UI threshold grid
+DEFAULT_GRID_STEP = 0.01
+
+
+class ConformalThresholds:
+    """
+    Sorted calibration scores with O(1)/O(log n) threshold and p-value lookups.
+
+    The threshold for error rate α is the finite-sample conformal quantile: the
+    k-th smallest calibration score with k = ceil((n + 1)(1 - α)). When k > n
+    no finite threshold gives the guarantee and every chunk is accepted; when
+    k < 1 nothing is.
+
+    `update()` adds scores online (e.g. from confirmed query outcomes) by insertion into
+    the sorted array. With a `window`, only the most recent `window` scores are kept, so
+    thresholds follow drift; eviction is in arrival order, which is the order of `scores`.
+    """
+
+    def __init__(
+        self,
+        scores,
+        grid_step: Optional[float] = DEFAULT_GRID_STEP,
+        window: Optional[int] = None
+    ):
+        scores = np.asarray(scores, dtype=np.float64)
+        if window:
+            scores = scores[-window:]
+        self.window = window
+        self.grid_step = grid_step
+        # Arrival order, needed to evict the oldest scores from a sliding window
+        self._arrivals = deque(scores.tolist()) if window else None
+        self.scores = np.empty(0, dtype=np.float64)
+        self.grid_error_rates = None
+        self.grid_thresholds = None
+        self._set_scores(np.sort(scores))
+
+    @staticmethod
+    def _thresholds_of(scores: np.ndarray, error_rates) -> np.ndarray:
+        n = len(scores)
+        error_rates = np.asarray(error_rates, dtype=np.float64)
+        ranks = np.ceil((n + 1) * (1 - error_rates) - 1e-9).astype(np.int64)
+        padded = np.concatenate(([-np.inf], scores, [np.inf]))
+        return padded[np.clip(ranks, 0, n + 1)]
+
+    def _set_scores(self, sorted_scores: np.ndarray) -> None:
+        # The grid is computed before anything is assigned, so concurrent readers see
+        # the old or the new scores, each with a matching grid for all but an instant
+        grid_error_rates = grid_thresholds = None
+        if self.grid_step and len(sorted_scores):
+            grid_error_rates = np.round(np.arange(0, 1 + self.grid_step / 2, self.grid_step), 10)
+            grid_thresholds = self._thresholds_of(sorted_scores, grid_error_rates)
+        self.grid_error_rates, self.grid_thresholds = grid_error_rates, grid_thresholds
+        self.scores = sorted_scores
+
+    def update(self, new_scores) -> None:
+        """Add scores, evicting the oldest beyond the window; O(n) per batch of new scores"""
+        new_scores = np.asarray(new_scores, dtype=np.float64).ravel()
+        if not len(new_scores):
+            return
+        added = np.sort(new_scores)
+        scores = np.insert(self.scores, np.searchsorted(self.scores, added), added)
+        if self._arrivals is not None:
+            self._arrivals.extend(new_scores.tolist())
+            evicted = np.sort([self._arrivals.popleft() for _ in range(max(0, len(self._arrivals) - self.window))])
+            if len(evicted):
+                # Equal evicted values take consecutive positions among their equals
+                repeats = np.arange(len(evicted)) - np.searchsorted(evicted, evicted, side='left')
+                scores = np.delete(scores, np.searchsorted(scores, evicted, side='left') + repeats)
+        self._set_scores(scores)
+
+    @classmethod
+    def from_records(cls, calibration_records: List[Dict], **kwargs) -> "ConformalThresholds":
+        scores = np.fromiter(
+            (record['cosine_distance'] for record in calibration_records),
+            dtype=np.float64,
+            count=len(calibration_records)
+        )
+        return cls(scores, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+    def thresholds(self, error_rates) -> np.ndarray:
+        """Vectorized threshold lookup for an array of error rates"""
+        return self._thresholds_of(self.scores, error_rates)
+
+    def threshold(self, error_rate: float) -> float:
+        """Distance threshold guaranteeing coverage of at least 1 - error_rate"""
+        if self.grid_error_rates is not None:
+            # Slider values land on the grid, so most lookups are a binary search
+            i = int(np.searchsorted(self.grid_error_rates, error_rate))
+            if i < len(self.grid_error_rates) and math.isclose(self.grid_error_rates[i], error_rate, abs_tol=1e-9):
+                return float(self.grid_thresholds[i])
+        return float(self.thresholds(error_rate))
+
+    def p_values(self, distances) -> np.ndarray:
+        """Conformal p-value per distance: share of calibration scores at least as large"""
+        n = len(self.scores)
+        at_least = n - np.searchsorted(self.scores, np.asarray(distances, dtype=np.float64), side='left')
+        return (at_least + 1) / (n + 1)
+
+
+class MondrianThresholds:
+    """
+    Class-conditional (Mondrian) conformal thresholds.
+
+    Calibration scores are split by group (a table, a question category, ...) and each
+    group gets its own sorted scores and precomputed threshold grid. Coverage then holds
+    within every group, so groups whose matches score tighter get tighter thresholds.
+    Groups with fewer than `min_group_size` scores are not served; callers fall back to
+    pooled thresholds for them until online updates grow them large enough.
+    """
+
+    def __init__(
+        self,
+        scores,
+        group_codes,
+        group_names: Sequence[str],
+        min_group_size: int = 1,
+        grid_step: Optional[float] = DEFAULT_GRID_STEP,
+        window: Optional[int] = None
+    ):
+        """
+        Args:
+            scores: Calibration scores, in arrival order
+            group_codes: Index into `group_names` per score, -1 for scores in no group
+            group_names: Name of each group
+            min_group_size: Fewest scores a group needs to get its own thresholds
+            window: Sliding window per group (most recent scores kept), None for all
+        """
+        scores = np.asarray(scores, dtype=np.float64)
+        codes = np.asarray(group_codes, dtype=np.int64)
+        # Stable, so each group's scores keep their arrival order
+        order = np.argsort(codes, kind='stable')
+        bounds = np.searchsorted(codes[order], np.arange(len(group_names) + 1))
+        self.min_group_size = max(1, min_group_size)
+        self.grid_step = grid_step
+        self.window = window
+        self.groups: Dict[str, ConformalThresholds] = {
+            name: ConformalThresholds(scores[order[bounds[code]:bounds[code + 1]]], grid_step=grid_step, window=window)
+            for code, name in enumerate(group_names)
+        }
+
+    def get(self, group) -> Optional[ConformalThresholds]:
+        thresholds = self.groups.get(group)
+        if thresholds is None or len(thresholds) < self.min_group_size:
+            return None
+        return thresholds
+
+    def update(self, group, new_scores) -> None:
+        """Add scores to one group (created on first use)"""
+        thresholds = self.groups.get(group)
+        if thresholds is None:
+            thresholds = ConformalThresholds([], grid_step=self.grid_step, window=self.window)
+            self.groups[group] = thresholds
+        thresholds.update(new_scores)
+
+    def sizes(self) -> Dict[str, int]:
+        """Score count of each group large enough to be served"""
+        return {
+            name: len(thresholds)
+            for name, thresholds in self.groups.items()
+            if len(thresholds) >= self.min_group_size
+        }
+
+    def __len__(self) -> int:
+        return len(self.sizes())
+
+
+def as_retrieved_chunks(retrieved_chunks: Union[Dict, RetrievedChunks]) -> RetrievedChunks:
+    """Accept either a columnar result or a search result dict with a 'matches' list"""
+    if isinstance(retrieved_chunks, RetrievedChunks):
+        return retrieved_chunks
+    return RetrievedChunks.from_matches(retrieved_chunks.get('matches') or [])
+
+@traced('conformal_filter')
+def conformal_select(
+    retrieved_chunks: Union[Dict, RetrievedChunks],
+    calibration_records: Optional[List[Dict]] = None,
+    error_rate: float = 0.1,
+    verbose: bool = False,
+    thresholds: Optional[ConformalThresholds] = None
+) -> RetrievedChunks:
+    """Columnar core of conformal_filter: one vectorized mask over all chunks"""
+    chunks = as_retrieved_chunks(retrieved_chunks)
+    if thresholds is None and calibration_records:
+        thresholds = ConformalThresholds.from_records(calibration_records, grid_step=None)
+    if not thresholds or not len(chunks):
+        return RetrievedChunks.empty()
+
+    # We want scores BELOW the finite-sample (1 - error_rate) conformal quantile,
+    # and only column-level matches are considered
+    threshold = thresholds.threshold(error_rate)
+    mask = (chunks.type_codes == RetrievedChunks.TYPE_CODES['column']) & (chunks.distances <= threshold)
+    selected = chunks.select(mask)
+
+    logger.log(logging.INFO if verbose else logging.DEBUG, "conformal selection", extra={
+        'threshold': round(float(threshold), 4),
+        'input_chunks': len(chunks),
+        'selected_chunks': len(selected),
+        'confidence_level': round((1 - error_rate) * 100, 1)
+    })
+
+    return selected
+
+@traced('conformal_filter')
+def conformal_select_many(
+    retrieved: List[RetrievedChunks],
+    error_rates: Union[float, Sequence[float]],
+    thresholds: ConformalThresholds
+) -> List[RetrievedChunks]:
+    """
+    conformal_select for many questions at once.
+
+    Thresholds for all error rates are looked up in one vectorized call, and a single
+    mask is applied over the concatenated distances of every question's chunks.
+
+    Args:
+        retrieved: Columnar results, one per question
+        error_rates: One error rate for all questions, or one per question
+        thresholds: Calibration thresholds shared by these questions
+    """
+    if not retrieved:
+        return []
+    if not thresholds:
+        return [RetrievedChunks.empty() for _ in retrieved]
+
+    lengths = np.fromiter((len(chunks) for chunks in retrieved), dtype=np.int64, count=len(retrieved))
+    per_question = np.broadcast_to(
+        thresholds.thresholds(np.asarray(error_rates, dtype=np.float64)),
+        (len(retrieved),)
+    )
+    distances = np.concatenate([chunks.distances for chunks in retrieved])
+    type_codes = np.concatenate([chunks.type_codes for chunks in retrieved])
+    mask = (type_codes == RetrievedChunks.TYPE_CODES['column']) & (distances <= np.repeat(per_question, lengths))
+    masks = np.split(mask, np.cumsum(lengths)[:-1])
+    return [chunks.select(chunk_mask) for chunks, chunk_mask in zip(retrieved, masks)]
 
 def conformal_filter(
-    retrieved_chunks: Dict,
-    calibration_records: List[Dict],
+    retrieved_chunks: Union[Dict, RetrievedChunks],
+    calibration_records: Optional[List[Dict]] = None,
     error_rate: float = 0.1,
-    verbose: bool = False
+    verbose: bool = False,
+    thresholds: Optional[ConformalThresholds] = None
 ) -> List[Dict]:
     """
     Filter retrieved chunks using conformal prediction to ensure a specified error rate.
     
     Args:
-        retrieved_chunks: Dictionary containing 'matches' list with chunks and their confidence scores
+        retrieved_chunks: Dictionary containing 'matches' list with chunks and their confidence scores,
+                          or a columnar RetrievedChunks
         calibration_records: List of calibration records with cosine distances
         error_rate: Desired error rate (between 0 and 1), default 0.1 (90% confidence)
         verbose: Whether to print debug information
+        thresholds: Precomputed ConformalThresholds; avoids rebuilding the score array per call
     
     Returns:
         List of filtered chunks that meet the confidence threshold
     """
-    if not calibration_records or not retrieved_chunks.get('matches'):
-        return []
+    return conformal_select(
+        retrieved_chunks,
+        calibration_records=calibration_records,
+        error_rate=error_rate,
+        verbose=verbose,
+        thresholds=thresholds
+    ).to_matches()
 
-    # Get calibration scores
-    calibration_scores = [record['cosine_distance'] for record in calibration_records]
-    print(calibration_scores)
-    # Calculate threshold based on desired error rate
-    # We use (1 - error_rate) percentile as we want scores BELOW the threshold
-    threshold = np.percentile(calibration_scores, (1 - error_rate) * 100)
-    print(threshold)
-    # Filter chunks based on threshold
-    filtered_chunks = []
-    for chunk in retrieved_chunks['matches']:
-        if chunk['metadata']['type'] == 'column':  # Only consider column-level matches
-            # Get chunk embedding and calculate cosine distance
-            #cosine_distance = 1 - chunk['confidence']  # Convert confidence to distance
-            print('distances',chunk['cosine_distance'])
-            if chunk['cosine_distance'] <= threshold:
-                filtered_chunks.append(chunk)
-    
-    if verbose:
-        print(f"Conformal prediction threshold (cosine distance): {threshold:.4f}")
-        print(f"Input chunks: {len(retrieved_chunks['matches'])}")
-        print(f"Filtered chunks: {len(filtered_chunks)}")
-        print(f"Target confidence level: {(1 - error_rate) * 100:.1f}%")
-    
-    
-    return filtered_chunks
+def conformal_result(selected: RetrievedChunks, error_rate: float) -> Dict:
+    """Output dict for conformally selected chunks: matches plus confidence summary"""
+    if len(selected):
+        confidence_scores = 1 - selected.distances
+        avg_confidence = confidence_scores.mean()
+        max_confidence = confidence_scores.max()
+        min_confidence = confidence_scores.min()
+    else:
+        avg_confidence = max_confidence = min_confidence = 0.0
+
+    return {
+        'matches': selected.to_matches(),
+        'confidence_summary': {
+            'average_confidence': round(float(avg_confidence), 3),
+            'max_confidence': round(float(max_confidence), 3),
+            'min_confidence': round(float(min_confidence), 3),
+            'sufficient_confidence': len(selected) > 0,
+            'num_chunks': len(selected)
+        },
+        'error_rate': error_rate,
+        'confidence_level': (1 - error_rate) * 100
+    }
 
 def do_conformal_rag(
     question: str,
-    retrieved_chunks: Dict,
-    calibration_records: List[Dict],
+    retrieved_chunks: Union[Dict, RetrievedChunks],
+    calibration_records: Optional[List[Dict]] = None,
     error_rate: float = 0.1,
-    verbose: bool = False
+    verbose: bool = False,
+    thresholds: Optional[ConformalThresholds] = None
 ) -> Dict:
     """
     Perform RAG with conformal prediction filtering.
     
     Args:
         question: User question
-        retrieved_chunks: Retrieved chunks from vector store
+        retrieved_chunks: Retrieved chunks from vector store (dict or RetrievedChunks)
         calibration_records: Calibration records for conformal prediction
         error_rate: Desired error rate
-        verbose: Whether to print debug information
+        verbose: Log the selection at INFO instead of DEBUG
+        thresholds: Precomputed ConformalThresholds
     
     Returns:
         Dictionary containing filtered results and metadata
     """
     # Apply conformal filtering
-    filtered_chunks = conformal_filter(
-        retrieved_chunks=retrieved_chunks,
+    selected = conformal_select(
+        retrieved_chunks,
         calibration_records=calibration_records,
         error_rate=error_rate,
-        verbose=verbose
+        verbose=verbose,
+        thresholds=thresholds
     )
-    
-    # Calculate confidence metrics for filtered results
-    if filtered_chunks:
-        confidence_scores = [(1 - chunk['cosine_distance']) for chunk in filtered_chunks]
-        avg_confidence = np.mean(confidence_scores)
-        max_confidence = np.max(confidence_scores)
-        min_confidence = np.min(confidence_scores)
-    else:
-        avg_confidence = max_confidence = min_confidence = 0.0
-    
-    if verbose:
-        print("\n=== Final Results ===")
-        print(f"Chunks retained: {len(filtered_chunks)}")
-        print(f"Average confidence: {avg_confidence:.3f}")
-        print(f"Confidence range: {min_confidence:.3f} - {max_confidence:.3f}")
-        
-        # Show column-level results
-        if filtered_chunks:
-            print("\nSelected Columns:")
-            for chunk in filtered_chunks:
-                print(f"- {chunk['metadata']['column_name']}: {1 - chunk['cosine_distance']:.3f} confidence")
-    
-    return {
-        'matches': filtered_chunks,
-        'confidence_summary': {
-            'average_confidence': round(float(avg_confidence), 3),
-            'max_confidence': round(float(max_confidence), 3),
-            'min_confidence': round(float(min_confidence), 3),
-            'sufficient_confidence': len(filtered_chunks) > 0,
-            'num_chunks': len(filtered_chunks)
-        },
-        'error_rate': error_rate,
-        'confidence_level': (1 - error_rate) * 100
-    }
+    result = conformal_result(selected, error_rate)
+
+    level = logging.INFO if verbose else logging.DEBUG
+    if logger.isEnabledFor(level):
+        summary = result['confidence_summary']
+        logger.log(level, "conformal results", extra={
+            'chunks_retained': len(result['matches']),
+            'average_confidence': summary['average_confidence'],
+            'min_confidence': summary['min_confidence'],
+            'max_confidence': summary['max_confidence'],
+            'selected_columns': {
+                chunk['metadata']['column_name']: round(1 - chunk['cosine_distance'], 3)
+                for chunk in result['matches']
+            }
+        })
+
+    return result
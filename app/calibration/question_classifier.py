@@ -0,0 +1,98 @@
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from app.lexical_index import tokenize
+
+CROSS_FIT_FOLDS = 5
+
+
+class QuestionClassifier:
+    """
+    Multinomial naive Bayes over question tokens, fit on labelled calibration questions.
+
+    Predicting a category costs one tokenization and a sum over a few columns of a
+    (categories x vocabulary) log-likelihood matrix, so it can run on every query.
+    """
+
+    def __init__(self, labels: List[str], vocabulary: dict, log_priors: np.ndarray, log_likelihoods: np.ndarray):
+        self.labels = labels
+        self.vocabulary = vocabulary
+        self.log_priors = log_priors
+        self.log_likelihoods = log_likelihoods
+
+    @classmethod
+    def fit(cls, questions: Sequence[str], labels: Sequence[str], alpha: float = 1.0) -> "QuestionClassifier":
+        """
+        Args:
+            questions: Question texts
+            labels: Category of each question
+            alpha: Additive (Laplace) smoothing of token counts
+        """
+        label_names = sorted(set(labels))
+        label_codes = {label: code for code, label in enumerate(label_names)}
+        vocabulary = {}
+        rows, cols = [], []
+        for question, label in zip(questions, labels):
+            for token in tokenize(question):
+                rows.append(label_codes[label])
+                cols.append(vocabulary.setdefault(token, len(vocabulary)))
+
+        counts = np.zeros((len(label_names), len(vocabulary)), dtype=np.float64)
+        np.add.at(counts, (np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)), 1.0)
+        smoothed = counts + alpha
+        log_likelihoods = np.log(smoothed / smoothed.sum(axis=1, keepdims=True))
+        label_counts = np.bincount([label_codes[label] for label in labels], minlength=len(label_names))
+        log_priors = np.log(label_counts / label_counts.sum())
+        return cls(label_names, vocabulary, log_priors, log_likelihoods)
+
+    def predict(self, question: str) -> Tuple[Optional[str], float]:
+        """Most likely category and its posterior probability"""
+        if not self.labels:
+            return None, 0.0
+        token_ids = [self.vocabulary[t] for t in tokenize(question) if t in self.vocabulary]
+        scores = self.log_priors + self.log_likelihoods[:, token_ids].sum(axis=1)
+        probabilities = np.exp(scores - scores.max())
+        probabilities /= probabilities.sum()
+        best = int(np.argmax(probabilities))
+        return self.labels[best], float(probabilities[best])
+
+    def predict_many(self, questions: Sequence[str]) -> List[Optional[str]]:
+        return [self.predict(question)[0] for question in questions]
+
+
+def cross_fit_predict(
+    questions: Sequence[str],
+    labels: Sequence[Optional[str]],
+    folds: Sequence[int]
+) -> Tuple[Optional[QuestionClassifier], List[Optional[str]]]:
+    """
+    Predict every question's category with a classifier that was not trained on it.
+
+    Labelled questions are predicted by a classifier fit on the labelled questions of
+    the other folds; unlabelled ones by the classifier fit on all labelled questions,
+    which is also returned for use on new questions. Grouping calibration scores by
+    in-sample predictions would put each question in the group it was trained towards
+    more often than a new question with the same true category would be.
+
+    Args:
+        questions: Question texts
+        labels: Category of each question, None if unlabelled
+        folds: Fold number of each question, e.g. its id modulo CROSS_FIT_FOLDS
+
+    Returns:
+        (classifier on all labelled questions or None if there are none, predictions);
+        a labelled question whose fold holds every labelled question is predicted None
+    """
+    labelled = [i for i, label in enumerate(labels) if label]
+    if not labelled:
+        return None, [None] * len(questions)
+    classifier = QuestionClassifier.fit([questions[i] for i in labelled], [labels[i] for i in labelled])
+    predictions = [classifier.predict(question)[0] if not label else None for question, label in zip(questions, labels)]
+    for fold in sorted({folds[i] for i in labelled}):
+        train = [i for i in labelled if folds[i] != fold]
+        if not train:
+            continue
+        fold_classifier = QuestionClassifier.fit([questions[i] for i in train], [labels[i] for i in train])
+        for i in labelled:
+            if folds[i] == fold:
+                predictions[i] = fold_classifier.predict(questions[i])[0]
+    return classifier, predictions
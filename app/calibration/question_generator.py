@@ -1,30 +1,69 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Optional
 from langchain_community.chat_models import ChatOpenAI
+from langchain_core.language_models.chat_models import BaseChatModel
 from langchain.schema import ChatMessage
 import json
 from app.prompts import QUESTION_GENERATOR_PROMPT, GeneratedQuestion, QUESTION_CATEGORY_PROMPTS
 from app.config import load_config
 from app.calibration.storage import CalibrationQuestionStorage
+from app.lexical_index import tokenize
+from app.tracing import span
+from app.log import get_logger
+
+logger = get_logger(__name__)
 
 
 class QuestionGenerationError(Exception):
     pass
 
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_DELAY = 1.0
+# Questions sharing at least this share of their word tokens count as duplicates
+NEAR_DUPLICATE_JACCARD = 0.8
+
+
+def build_question_llm(config: Optional[Dict] = None) -> ChatOpenAI:
+    """Create the chat client used for question generation (shared across calls)"""
+    config = config or load_config()
+    return ChatOpenAI(
+        temperature=0.8,
+        model_name=config['model_name']
+    )
+
+def _question_tokens(question: str) -> frozenset:
+    return frozenset(tokenize(question))
+
+def _is_near_duplicate(tokens: frozenset, seen: List[frozenset]) -> bool:
+    """Whether a question's tokens overlap an earlier question's by NEAR_DUPLICATE_JACCARD or more"""
+    return any(
+        len(tokens & other) >= NEAR_DUPLICATE_JACCARD * len(tokens | other)
+        for other in seen
+    )
+
+def _wave_categories(remaining: Dict[str, int], size: int) -> List[str]:
+    """Up to `size` outstanding requests, taking categories in turn so each wave mixes them"""
+    categories = []
+    for turn in range(max(remaining.values(), default=0)):
+        categories.extend(category for category, count in remaining.items() if count > turn)
+    return categories[:size]
+
 def generate_calibration_question(
     table_name: str,
     table_description: str,
     columns_info: List[Dict],
     previous_questions: List[str],
-    target_category: str
+    target_category: str,
+    llm: Optional[BaseChatModel] = None
 ) -> GeneratedQuestion:
     """
     Generate a single calibration question using LLM.
+
+    Pass `llm` to reuse an existing client; otherwise one is built from config.
     """
-    config = load_config()
-    llm = ChatOpenAI(
-        temperature=0.8,  
-        model_name=config['model_name']
-    )
+    if llm is None:
+        llm = build_question_llm()
     
     # Format columns info for prompt
     columns_str = "\n".join([
@@ -56,7 +95,8 @@ def generate_calibration_question(
     ]
     
     try:
-        response = llm(messages)
+        with span('llm', task='question_generation', category=target_category):
+            response = llm.invoke(messages)
         question_data = json.loads(response.content)
         # Set default empty string for reasoning if not provided
         processed_data = {
@@ -70,15 +110,41 @@ def generate_calibration_question(
     except Exception as e:
         raise QuestionGenerationError(f"Error generating question: {str(e)}")
 
+def _generate_with_retry(
+    max_retries: int,
+    retry_delay: float,
+    **kwargs
+) -> GeneratedQuestion:
+    """Call generate_calibration_question, backing off exponentially between failures"""
+    for attempt in range(max_retries + 1):
+        try:
+            return generate_calibration_question(**kwargs)
+        except QuestionGenerationError:
+            if attempt == max_retries:
+                raise
+            time.sleep(retry_delay * (2 ** attempt))
+
 def generate_question_set(
     table_name: str,
     table_description: str,
     columns_info: List[Dict],
     questions_per_category: Optional[Dict[str, int]] = None,
-    storage: Optional[CalibrationQuestionStorage] = None
+    storage: Optional[CalibrationQuestionStorage] = None,
+    max_concurrency: Optional[int] = None,
+    max_retries: int = DEFAULT_MAX_RETRIES,
+    retry_delay: float = DEFAULT_RETRY_DELAY,
+    previous_questions: Optional[List[str]] = None,
+    llm: Optional[BaseChatModel] = None
 ) -> List[GeneratedQuestion]:
     """
     Generate a set of calibration questions across all categories.
+
+    Questions are requested in waves of `max_concurrency` concurrent requests through a
+    thread pool sharing one LLM client, with categories taken in turn. Each wave uses
+    every question accepted so far as its "previous questions" context, so later waves
+    steer away from what earlier ones produced. Questions whose word tokens overlap an
+    earlier question's by NEAR_DUPLICATE_JACCARD or more are dropped and re-requested,
+    up to (max_retries + 1) requests per wanted question in total.
     
     Args:
         table_name: Name of the table
@@ -87,42 +153,75 @@ def generate_question_set(
         questions_per_category: Optional dict specifying number of questions per category.
                               If None, uses values from config.
         storage: Optional storage instance to persist questions
+        max_concurrency: Maximum in-flight LLM requests. If None, uses value from config.
+        max_retries: Retries per question on LLM/parse errors, with exponential backoff
+        retry_delay: Initial backoff delay in seconds
+        previous_questions: Existing questions to avoid duplicating
+        llm: Optional chat model to use instead of building one from config
     Returns:
         List of GeneratedQuestion objects
     """
-    if questions_per_category is None:
+    if questions_per_category is None or max_concurrency is None or llm is None:
         config = load_config()
-        questions_per_category = config['questions_per_category']
-    print(questions_per_category)
-    categories = [
-        "single_column",
-        "multi_column",
-        "table_purpose",
-        "business_logic"
-    ]
-    
+        if questions_per_category is None:
+            questions_per_category = config['questions_per_category']
+        if max_concurrency is None:
+            max_concurrency = config['generation_concurrency']
+        if llm is None:
+            llm = build_question_llm(config)
+    logger.debug("generating calibration questions", extra={
+        'table': table_name,
+        'questions_per_category': questions_per_category
+    })
+
     generated_questions = []
-    previous_questions = []
+    previous_questions = list(previous_questions or [])
+    seen = [_question_tokens(q) for q in previous_questions]
+    remaining = dict(questions_per_category)
+    # Duplicates and failures are re-requested until this many requests have been made
+    budget = (max_retries + 1) * sum(remaining.values())
+    wave_size = max(1, max_concurrency)
     i = 1
-    for category, num_questions in questions_per_category.items():
-        for _ in range(num_questions):
-            try:
-                question = generate_calibration_question(
+
+    with ThreadPoolExecutor(max_workers=wave_size) as executor:
+        while budget > 0 and any(remaining.values()):
+            context = list(previous_questions)
+            wave = _wave_categories(remaining, min(wave_size, budget))
+            budget -= len(wave)
+            futures = [
+                (category, executor.submit(
+                    _generate_with_retry,
+                    max_retries,
+                    retry_delay,
                     table_name=table_name,
                     table_description=table_description,
                     columns_info=columns_info,
-                    previous_questions=previous_questions,
-                    target_category=category
-                )
-                print(f'Question number {i}')
+                    previous_questions=context,
+                    target_category=category,
+                    llm=llm
+                ))
+                for category in wave
+            ]
+            for category, future in futures:
+                try:
+                    question = future.result()
+                except QuestionGenerationError as e:
+                    logger.warning("question generation failed", extra={
+                        'category': category,
+                        'error': str(e)
+                    })
+                    continue
+                tokens = _question_tokens(question.question)
+                if remaining[category] == 0 or _is_near_duplicate(tokens, seen):
+                    continue
+                seen.append(tokens)
+                logger.debug("generated question", extra={'number': i, 'category': category})
                 i += 1
+                remaining[category] -= 1
                 generated_questions.append(question)
                 previous_questions.append(question.question)
-            except QuestionGenerationError as e:
-                print(f"Failed to generate question for category {category}: {str(e)}")
-                continue
     
     if storage and generated_questions:
-        storage.store_questions(generated_questions)
+        storage.store_questions(generated_questions, table_name=table_name)
     
     return generated_questions
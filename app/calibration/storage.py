@@ -1,82 +1,534 @@
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Sequence, Tuple
 import json
 import os
+import fcntl
+import sqlite3
+import threading
 from datetime import datetime
+import numpy as np
 from app.prompts import GeneratedQuestion
+from app.log import get_logger
+
+logger = get_logger(__name__)
+
+CALIBRATION_PATH = os.path.join("data", "calibration")
+CALIBRATION_DB = "calibration.sqlite"
+SCORES_DIR = "scores"
+# Held (flock) by whoever writes or reads a whole run, across worker processes
+SCORES_LOCK_FILE = "scores.lock"
+# Per-record columns of a scoring run, each an append-only raw array file
+SCORE_COLUMNS = {
+    'distance': np.float64,
+    'question_id': np.int64,
+    'column_id': np.int32
+}
+# JSON files written by earlier versions, imported once and renamed with this suffix
+LEGACY_QUESTIONS_FILE = "questions.json"
+LEGACY_RECORDS_FILE = "records.json"
+MIGRATED_SUFFIX = ".migrated"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS questions (
+    id INTEGER PRIMARY KEY,
+    question TEXT NOT NULL,
+    category TEXT,
+    table_name TEXT,
+    source_columns TEXT NOT NULL,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS questions_table_name ON questions (table_name);
+CREATE TABLE IF NOT EXISTS scored_columns (
+    id INTEGER PRIMARY KEY,
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    UNIQUE (table_name, column_name)
+);
+CREATE TABLE IF NOT EXISTS calibration_runs (
+    id INTEGER PRIMARY KEY,
+    retrieval_mode TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+"""
+
+
+def _connect(storage_path: str) -> sqlite3.Connection:
+    os.makedirs(storage_path, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(storage_path, CALIBRATION_DB), check_same_thread=False)
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.executescript(_SCHEMA)
+    return conn
+
+class _InterprocessLock:
+    """
+    Reentrant lock shared by threads (RLock) and processes (flock on a lock file).
+
+    The file lock is taken by the outermost holder in a process and released with it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self) -> "_InterprocessLock":
+        self._lock.acquire()
+        try:
+            if self._depth == 0:
+                self._file = open(self.path, 'a')
+                fcntl.flock(self._file, fcntl.LOCK_EX)
+        except BaseException:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._lock.release()
+            raise
+        self._depth += 1
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            # Closing the file releases the flock
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+def _read_legacy_file(path: str, key: str) -> Optional[List[Dict]]:
+    """Entries under `key` in an old JSON store, or None if the file holds something else"""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    return data.get(key) if isinstance(data, dict) and key in data else None
+
 
 class CalibrationQuestionStorage:
-    def __init__(self, storage_path: str = "data/calibration"):
+    """
+    Calibration questions in SQLite; new questions are appended, never rewritten.
+
+    Questions from a `questions.json` written by earlier versions are imported once.
+    """
+
+    def __init__(self, storage_path: str = CALIBRATION_PATH):
         self.storage_path = storage_path
-        self.questions_file = os.path.join(storage_path, "questions.json")
-        self._ensure_storage_exists()
-        
-    def _ensure_storage_exists(self) -> None:
-        """Create storage directory if it doesn't exist"""
-        os.makedirs(self.storage_path, exist_ok=True)
-        if not os.path.exists(self.questions_file):
-            self._save_questions([])
-            
-    def _save_questions(self, questions: List[Dict]) -> None:
-        """Save questions to JSON file"""
-        with open(self.questions_file, 'w') as f:
-            json.dump({
-                'last_updated': datetime.now().isoformat(),
-                'questions': questions
-            }, f, indent=2)
-            
-    def _load_questions(self) -> List[Dict]:
-        """Load questions from JSON file"""
-        try:
-            with open(self.questions_file, 'r') as f:
-                data = json.load(f)
-                return data.get('questions', [])
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
-            
-    def store_questions(self, questions: List[GeneratedQuestion]) -> None:
-        """Store new calibration questions"""
-        existing_questions = self._load_questions()
-        
-        # Convert GeneratedQuestion objects to dictionaries
-        new_questions = [
+        self._lock = threading.Lock()
+        self._conn = _connect(storage_path)
+        self._migrate_legacy_questions()
+
+    def _migrate_legacy_questions(self) -> None:
+        legacy_file = os.path.join(self.storage_path, LEGACY_QUESTIONS_FILE)
+        questions = _read_legacy_file(legacy_file, 'questions')
+        if questions is None:
+            return
+        with self._lock:
+            imported = self._conn.execute("SELECT 1 FROM questions LIMIT 1").fetchone() is not None
+        if not imported:
+            self._insert(questions)
+        # A file that also holds scores is renamed once CalibrationScoreStore imports them
+        if _read_legacy_file(legacy_file, 'records') is None:
+            os.replace(legacy_file, legacy_file + MIGRATED_SUFFIX)
+
+    def _insert(self, questions: List[Dict]) -> None:
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO questions (question, category, table_name, source_columns, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        q['question'],
+                        q.get('category'),
+                        q.get('table_name'),
+                        json.dumps(q['source_columns']),
+                        q.get('created_at')
+                    )
+                    for q in questions
+                ]
+            )
+
+    def store_questions(
+        self,
+        questions: List[GeneratedQuestion],
+        table_name: Optional[str] = None
+    ) -> None:
+        """Store new calibration questions, optionally tagged with the table they were generated for"""
+        created_at = datetime.now().isoformat()
+        self._insert([
             {
                 'question': q.question,
                 'category': q.category,
                 'source_columns': q.source_columns,
-                'created_at': datetime.now().isoformat()
+                'table_name': table_name,
+                'created_at': created_at
             }
             for q in questions
-        ]
-        
-        # Combine existing and new questions
-        all_questions = existing_questions + new_questions
-        self._save_questions(all_questions)
-        
+        ])
+
+    def add_question(
+        self,
+        question: str,
+        source_columns: List[str],
+        category: Optional[str] = None,
+        table_name: Optional[str] = None
+    ) -> Dict:
+        """Store one question (e.g. a confirmed query outcome) and return it with its storage 'id'"""
+        stored = {
+            'question': question,
+            'category': category,
+            'table_name': table_name,
+            'source_columns': list(source_columns),
+            'created_at': datetime.now().isoformat()
+        }
+        with self._lock, self._conn:
+            stored['id'] = self._conn.execute(
+                "INSERT INTO questions (question, category, table_name, source_columns, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (question, category, table_name, json.dumps(stored['source_columns']), stored['created_at'])
+            ).lastrowid
+        return stored
+
     def get_questions(
         self,
         category: Optional[str] = None,
-        limit: Optional[int] = None
+        limit: Optional[int] = None,
+        table_name: Optional[str] = None
     ) -> List[Dict]:
         """
         Retrieve stored questions with optional filtering
-        
+
         Args:
             category: Filter by question category
             limit: Maximum number of questions to return
-            
+            table_name: Filter by the table the question was generated for
+
         Returns:
-            List of matching questions
+            List of matching questions, in insertion order, each with its storage 'id'
         """
-        questions = self._load_questions()
-        
+        sql = "SELECT id, question, category, table_name, source_columns, created_at FROM questions"
+        conditions, params = [], []
         if category:
-            questions = [q for q in questions if q['category'] == category]
-            
+            conditions.append("category = ?")
+            params.append(category)
+        if table_name:
+            conditions.append("table_name = ?")
+            params.append(table_name)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY id"
         if limit:
-            questions = questions[:limit]
-            
-        return questions
-        
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [
+            {
+                'id': question_id,
+                'question': question,
+                'category': question_category,
+                'table_name': question_table,
+                'source_columns': json.loads(source_columns),
+                'created_at': created_at
+            }
+            for question_id, question, question_category, question_table, source_columns, created_at in rows
+        ]
+
     def clear_questions(self) -> None:
         """Clear all stored questions"""
-        self._save_questions([])
\ No newline at end of file
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM questions")
+
+
+class CalibrationScoreStore:
+    """
+    Calibration scores as columnar, append-only arrays.
+
+    Each scoring run stores one raw file per column in SCORE_COLUMNS under `scores/`:
+    the nonconformity score (distance), the question's id in the questions table and
+    the id of the scored (table, column) pair in `scored_columns`. Appending writes
+    only the new rows; thresholds load just the distance file with one read. Only the
+    latest run is current: a full re-collection starts a new run and drops older ones.
+
+    Writes to a run, and reads of all its columns, hold `write_lock` so rows of
+    concurrent appends from several worker processes never interleave. Callers that
+    must read and then write consistently (e.g. score questions, then append) can hold
+    it around the whole sequence; it is reentrant.
+    """
+
+    def __init__(self, storage_path: str = CALIBRATION_PATH):
+        self.storage_path = storage_path
+        self.scores_path = os.path.join(storage_path, SCORES_DIR)
+        os.makedirs(self.scores_path, exist_ok=True)
+        self._lock = threading.Lock()
+        self.write_lock = _InterprocessLock(os.path.join(storage_path, SCORES_LOCK_FILE))
+        self._conn = _connect(storage_path)
+        self._column_ids: Dict[Tuple[str, str], int] = {}
+        self._migrate_legacy_records()
+
+    def _migrate_legacy_records(self) -> None:
+        """
+        Import JSON records (records.json, or a questions.json the old collector overwrote).
+
+        Questions of records that are not in the questions table yet are added to it, so
+        the next re-collection scores them again instead of replacing the run with nothing.
+        """
+        with self.write_lock:
+            if self.current_run() is not None:
+                return
+            for file_name in (LEGACY_RECORDS_FILE, LEGACY_QUESTIONS_FILE):
+                legacy_file = os.path.join(self.storage_path, file_name)
+                records = _read_legacy_file(legacy_file, 'records')
+                if records is None:
+                    continue
+                self._link_legacy_questions(records)
+                mode = records[0].get('retrieval_mode', 'dense') if records else 'dense'
+                self.new_run(records, mode)
+                os.replace(legacy_file, legacy_file + MIGRATED_SUFFIX)
+                return
+
+    def _link_legacy_questions(self, records: List[Dict]) -> None:
+        """Set each record's question_id, storing (question, source_columns, table) tuples not yet known"""
+        created_at = datetime.now().isoformat()
+        with self._lock, self._conn:
+            question_ids = {
+                question: question_id
+                for question_id, question in self._conn.execute("SELECT id, question FROM questions")
+            }
+            for record in records:
+                question = record.get('question')
+                if question is None:
+                    record['question_id'] = -1
+                    continue
+                if question not in question_ids:
+                    source_columns = record.get('source_columns') or [record['metadata']['column_name']]
+                    question_ids[question] = self._conn.execute(
+                        "INSERT INTO questions (question, category, table_name, source_columns, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (
+                            question,
+                            record.get('category'),
+                            record['metadata'].get('table_name'),
+                            json.dumps(source_columns),
+                            record.get('timestamp', created_at)
+                        )
+                    ).lastrowid
+                record['question_id'] = question_ids[question]
+
+    def _run_file(self, run_id: int, column: str) -> str:
+        return os.path.join(self.scores_path, f"run-{run_id}.{column}.bin")
+
+    def _scored_column_ids(self, keys: Sequence[Tuple[str, str]]) -> np.ndarray:
+        """Ids of (table, column) pairs, registering new ones"""
+        new_keys = list(dict.fromkeys(key for key in keys if key not in self._column_ids))
+        if new_keys:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO scored_columns (table_name, column_name) VALUES (?, ?)",
+                    new_keys
+                )
+                rows = self._conn.execute("SELECT id, table_name, column_name FROM scored_columns").fetchall()
+            self._column_ids = {(table_name, column_name): column_id for column_id, table_name, column_name in rows}
+        return np.fromiter((self._column_ids[key] for key in keys), dtype=SCORE_COLUMNS['column_id'], count=len(keys))
+
+    def _read_columns(self, run_id: int) -> Dict[str, np.ndarray]:
+        columns = {}
+        for column, dtype in SCORE_COLUMNS.items():
+            try:
+                columns[column] = np.fromfile(self._run_file(run_id, column), dtype=dtype)
+            except FileNotFoundError:
+                columns[column] = np.empty(0, dtype=dtype)
+        return columns
+
+    def _complete_rows(self, run_id: int) -> int:
+        """Rows present in every column file, trimming the tail a crashed writer left behind"""
+        sizes = {}
+        for column, dtype in SCORE_COLUMNS.items():
+            try:
+                sizes[column] = os.path.getsize(self._run_file(run_id, column)) // np.dtype(dtype).itemsize
+            except FileNotFoundError:
+                sizes[column] = 0
+        n = min(sizes.values())
+        for column, size in sizes.items():
+            if size != n:
+                logger.warning("trimming incomplete calibration rows", extra={
+                    'run': run_id, 'column': column, 'rows': size, 'complete_rows': n
+                })
+                with open(self._run_file(run_id, column), 'r+b') as f:
+                    f.truncate(n * np.dtype(SCORE_COLUMNS[column]).itemsize)
+        return n
+
+    def _append_rows(self, run_id: int, records: List[Dict]) -> None:
+        """Append rows to a run; the caller holds `write_lock`"""
+        self._complete_rows(run_id)
+        keys = [
+            (record['metadata'].get('table_name') or "", record['metadata']['column_name'])
+            for record in records
+        ]
+        columns = {
+            'question_id': np.fromiter(
+                (record.get('question_id', -1) for record in records),
+                dtype=SCORE_COLUMNS['question_id'],
+                count=len(records)
+            ),
+            'column_id': self._scored_column_ids(keys),
+            # Written last: rows are complete once their distance is on disk
+            'distance': np.fromiter(
+                (record['cosine_distance'] for record in records),
+                dtype=SCORE_COLUMNS['distance'],
+                count=len(records)
+            )
+        }
+        for column, values in columns.items():
+            with open(self._run_file(run_id, column), 'ab') as f:
+                f.write(values.tobytes())
+
+    def current_run(self) -> Optional[Dict]:
+        """The latest run ({'id', 'retrieval_mode', 'created_at'}), or None before any calibration"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, retrieval_mode, created_at FROM calibration_runs ORDER BY id DESC LIMIT 1"
+            ).fetchone()
+        if row is None:
+            return None
+        return {'id': row[0], 'retrieval_mode': row[1], 'created_at': row[2]}
+
+    def new_run(self, records: List[Dict], retrieval_mode: str) -> int:
+        """
+        Store a full set of scores as the current run, replacing earlier runs.
+
+        An empty set never replaces a run that has scores (e.g. a re-collection that
+        found no questions); the current run is kept and its id returned. Use `clear()`
+        to drop scores deliberately.
+        """
+        with self.write_lock:
+            run = self.current_run()
+            if not records and run is not None and len(self):
+                logger.warning("kept calibration run instead of replacing it with no scores", extra={
+                    'run': run['id'], 'scores': len(self)
+                })
+                return run['id']
+            return self._new_run(records, retrieval_mode)
+
+    def _new_run(self, records: List[Dict], retrieval_mode: str) -> int:
+        with self._lock, self._conn:
+            run_id = self._conn.execute(
+                "INSERT INTO calibration_runs (retrieval_mode, created_at) VALUES (?, ?)",
+                (retrieval_mode, datetime.now().isoformat())
+            ).lastrowid
+        for column in SCORE_COLUMNS:
+            open(self._run_file(run_id, column), 'wb').close()
+        if records:
+            self._append_rows(run_id, records)
+
+        with self._lock, self._conn:
+            old_runs = [row[0] for row in self._conn.execute(
+                "SELECT id FROM calibration_runs WHERE id < ?", (run_id,)
+            )]
+            self._conn.execute("DELETE FROM calibration_runs WHERE id < ?", (run_id,))
+        for old_run in old_runs:
+            for column in SCORE_COLUMNS:
+                try:
+                    os.remove(self._run_file(old_run, column))
+                except FileNotFoundError:
+                    pass
+        return run_id
+
+    def append(self, records: List[Dict], retrieval_mode: str = 'dense') -> int:
+        """Append scores to the current run (starting one in `retrieval_mode` if there is none)"""
+        with self.write_lock:
+            run = self.current_run()
+            if run is None:
+                return self._new_run(records, retrieval_mode)
+            if records:
+                self._append_rows(run['id'], records)
+            return run['id']
+
+    def load_columns(self) -> Dict[str, np.ndarray]:
+        """All columns of the current run as contiguous arrays (empty before any calibration)"""
+        with self.write_lock:
+            run = self.current_run()
+            if run is None:
+                return {column: np.empty(0, dtype=dtype) for column, dtype in SCORE_COLUMNS.items()}
+            columns = self._read_columns(run['id'])
+        lengths = {column: len(values) for column, values in columns.items()}
+        n = min(lengths.values())
+        if max(lengths.values()) != n:
+            # Only a writer that died mid-append leaves this; its partial rows are dropped
+            logger.warning("calibration columns differ in length", extra={'run': run['id'], 'rows': lengths})
+        return {column: values[:n] for column, values in columns.items()}
+
+    def load_scores(self) -> np.ndarray:
+        """Just the current run's scores, in append order, read from the distance file alone"""
+        run = self.current_run()
+        if run is None:
+            return np.empty(0, dtype=SCORE_COLUMNS['distance'])
+        # Distances are written last, so every score on disk belongs to a complete row;
+        # no lock needed, at worst an append in flight is not visible yet
+        try:
+            return np.fromfile(self._run_file(run['id'], 'distance'), dtype=SCORE_COLUMNS['distance'])
+        except FileNotFoundError:
+            # The run was replaced while we read it
+            return np.empty(0, dtype=SCORE_COLUMNS['distance'])
+
+    def scored_columns(self) -> Dict[int, Tuple[Optional[str], str]]:
+        """Column id -> (table name or None, column name)"""
+        with self._lock:
+            rows = self._conn.execute("SELECT id, table_name, column_name FROM scored_columns").fetchall()
+        return {column_id: (table_name or None, column_name) for column_id, table_name, column_name in rows}
+
+    def records(self) -> List[Dict]:
+        """The current run as record dicts (question text joined from the questions table)"""
+        run = self.current_run()
+        if run is None:
+            return []
+        columns = self.load_columns()
+        scored = self.scored_columns()
+        with self._lock:
+            questions = {
+                question_id: (question, category, json.loads(source_columns))
+                for question_id, question, category, source_columns in self._conn.execute(
+                    "SELECT id, question, category, source_columns FROM questions"
+                )
+            }
+        records = []
+        for distance, question_id, column_id in zip(
+            columns['distance'].tolist(), columns['question_id'].tolist(), columns['column_id'].tolist()
+        ):
+            table_name, column_name = scored[column_id]
+            question, category, source_columns = questions.get(question_id, (None, None, [column_name]))
+            records.append({
+                'question': question,
+                'question_id': question_id,
+                'category': category,
+                'cosine_distance': distance,
+                'metadata': {'type': 'column', 'table_name': table_name, 'column_name': column_name},
+                'source_columns': source_columns,
+                'retrieval_mode': run['retrieval_mode']
+            })
+        return records
+
+    def version(self) -> Optional[Tuple[int, int]]:
+        """Changes whenever a run starts or rows are appended, for cheap change detection"""
+        run = self.current_run()
+        if run is None:
+            return None
+        try:
+            return run['id'], os.path.getsize(self._run_file(run['id'], 'distance'))
+        except FileNotFoundError:
+            return run['id'], 0
+
+    def __len__(self) -> int:
+        run = self.current_run()
+        if run is None:
+            return 0
+        try:
+            size = os.path.getsize(self._run_file(run['id'], 'distance'))
+        except FileNotFoundError:
+            return 0
+        return size // np.dtype(SCORE_COLUMNS['distance']).itemsize
+
+    def clear(self) -> None:
+        """Drop all scores (questions are kept)"""
+        with self.write_lock:
+            self._new_run([], 'dense')
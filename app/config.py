@@ -4,9 +4,23 @@ from dotenv import load_dotenv
 class ConfigError(Exception):
     pass
 
-def load_config():
+# Dense L2 distance above which retrieved chunks are not candidates, per embedding backend:
+# normalized OpenAI embeddings sit close together, MiniLM and hash vectors spread much wider
+# (hash vectors of texts sharing no words are orthogonal, at distance 2)
+DEFAULT_CONFIDENCE_THRESHOLDS = {'openai': 0.45, 'local': 1.0, 'fake': 1.9}
+
+def _optional_int(name: str):
+    value = os.getenv(name)
+    return int(value) if value else None
+
+def _optional_float(name: str):
+    value = os.getenv(name)
+    return float(value) if value else None
+
+def load_config(require_api_key: bool = True):
     load_dotenv()
-    required_vars = ['OPENAI_API_KEY']
+    # Offline paths (e.g. a local embedding backend) can skip the API key check
+    required_vars = ['OPENAI_API_KEY'] if require_api_key else []
     missing_vars = [var for var in required_vars if not os.getenv(var)]
     
     if missing_vars:
@@ -31,8 +45,38 @@ def load_config():
         # Add remaining questions to business_logic category
         questions_per_category['business_logic'] += (total_questions - total_allocated)
     
+    embedding_backend = os.getenv('EMBEDDING_BACKEND', 'openai').lower()
+    confidence_threshold = _optional_float('CONFIDENCE_THRESHOLD')
+    if confidence_threshold is None:
+        confidence_threshold = DEFAULT_CONFIDENCE_THRESHOLDS.get(embedding_backend, DEFAULT_CONFIDENCE_THRESHOLDS['openai'])
+
     return {
         'openai_api_key': os.getenv('OPENAI_API_KEY'),
         'model_name': os.getenv('MODEL_NAME', 'gpt-3.5-turbo'),
-        'questions_per_category': questions_per_category
+        'questions_per_category': questions_per_category,
+        # Max in-flight LLM requests when generating calibration questions
+        'generation_concurrency': int(os.getenv('CALIBRATION_CONCURRENCY', '8')),
+        # Embedding backend: 'openai', 'local' (sentence-transformers) or 'fake' (hash-based)
+        'embedding_backend': embedding_backend,
+        'embedding_model': os.getenv('EMBEDDING_MODEL'),
+        'embedding_batch_size': int(os.getenv('EMBEDDING_BATCH_SIZE', '64')),
+        'embedding_workers': int(os.getenv('EMBEDDING_WORKERS', '4')),
+        'fake_embedding_dim': int(os.getenv('FAKE_EMBEDDING_DIM', '384')),
+        # Vector index: 'auto' (by corpus size), 'flat', 'ivf', 'hnsw' or 'ivfpq', plus recall knobs
+        'vector_index_type': os.getenv('VECTOR_INDEX_TYPE', 'auto').lower(),
+        'vector_index_nprobe': _optional_int('VECTOR_INDEX_NPROBE'),
+        'vector_index_ef_search': _optional_int('VECTOR_INDEX_EF_SEARCH'),
+        # Retrieval: 'dense' (FAISS only) or 'hybrid' (FAISS + BM25, reciprocal rank fusion)
+        'retrieval_mode': os.getenv('RETRIEVAL_MODE', 'dense').lower(),
+        'rrf_k': int(os.getenv('RRF_K', '60')),
+        # Candidate cut-off applied before conformal filtering, in calibration and queries
+        'confidence_threshold': confidence_threshold,
+        # Mondrian conformal groups for unfiltered queries: 'category' (predicted question
+        # category) or 'none' (pooled thresholds), and the scores a table or category group
+        # needs to be used
+        'conformal_grouping': os.getenv('CONFORMAL_GROUPING', 'category').lower(),
+        'conformal_min_group_size': int(os.getenv('CONFORMAL_MIN_GROUP_SIZE', '30')),
+        # Sliding window of most recent calibration scores (per group) that thresholds
+        # are computed over, so online feedback can track drift; unset keeps all scores
+        'calibration_window': _optional_int('CALIBRATION_WINDOW')
     }
@@ -1,46 +1,344 @@
 import os
+import re
+import json
+import hashlib
 import sqlite3
 import pandas as pd
-from typing import List, Dict
+from typing import List, Dict, Optional
+from app.schema_profiler import profile_table
+from app.tracing import traced
 
-def build_sqlite_table_from_csv(csv_path: str, sqlite_path: str = "data/data.sqlite") -> None:
+INGEST_STATE_TABLE = "_ingest_state"
+PROFILE_CACHE_TABLE = "_schema_profile"
+HASH_BLOCK_SIZE = 1 << 20
+DEFAULT_CHUNK_SIZE = 50_000
+SQLITE_PAGE_SIZE = 8192
+
+
+def fingerprint_file(path: str, prefix_size: Optional[int] = None) -> Dict:
+    """
+    Fingerprint a file by size, mtime and SHA-256 of its content.
+
+    Args:
+        path: File to fingerprint
+        prefix_size: If given, also hash the first `prefix_size` bytes in the same pass,
+                     so an append-only change can be detected without re-reading the file.
+
+    Returns:
+        Dictionary with size, mtime, sha256 and (optionally) prefix_sha256
+    """
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    prefix_digest = None
+    read = 0
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            if prefix_size is not None and prefix_digest is None and read + len(block) >= prefix_size:
+                # Snapshot the running hash exactly at the prefix boundary
+                digest.update(block[:prefix_size - read])
+                prefix_digest = digest.copy()
+                digest.update(block[prefix_size - read:])
+            else:
+                digest.update(block)
+            read += len(block)
+
+    fingerprint = {
+        'size': stat.st_size,
+        'mtime': stat.st_mtime,
+        'sha256': digest.hexdigest()
+    }
+    if prefix_size is not None:
+        fingerprint['prefix_sha256'] = prefix_digest.hexdigest() if prefix_digest else None
+    return fingerprint
+
+def _load_ingest_state(conn: sqlite3.Connection, table_name: str) -> Optional[Dict]:
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {INGEST_STATE_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            source_path TEXT,
+            size INTEGER,
+            mtime REAL,
+            sha256 TEXT,
+            row_count INTEGER
+        )
+    """)
+    row = conn.execute(
+        f"SELECT source_path, size, mtime, sha256, row_count FROM {INGEST_STATE_TABLE} WHERE table_name = ?",
+        (table_name,)
+    ).fetchone()
+    if row is None:
+        return None
+    return dict(zip(['source_path', 'size', 'mtime', 'sha256', 'row_count'], row))
+
+def _save_ingest_state(conn: sqlite3.Connection, table_name: str, state: Dict) -> None:
+    conn.execute(
+        f"INSERT OR REPLACE INTO {INGEST_STATE_TABLE} "
+        "(table_name, source_path, size, mtime, sha256, row_count) VALUES (?, ?, ?, ?, ?, ?)",
+        (table_name, state['source_path'], state['size'], state['mtime'], state['sha256'], state['row_count'])
+    )
+
+def _table_exists(conn: sqlite3.Connection, table_name: str) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()
+    return row is not None
+
+def _sqlite_type(dtype) -> str:
+    """Map a pandas dtype to the SQLite column type pandas' to_sql would have used."""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+def _connect_for_ingest(sqlite_path: str) -> sqlite3.Connection:
+    """Open a connection in manual-transaction mode with bulk-load pragmas."""
+    conn = sqlite3.connect(sqlite_path, isolation_level=None)
+    # page_size only applies to a fresh database, so it must precede WAL
+    conn.execute(f"PRAGMA page_size = {SQLITE_PAGE_SIZE}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA cache_size = -65536")
+    return conn
+
+def _write_chunks(
+    conn: sqlite3.Connection,
+    chunks,
+    table_name: str,
+    replace: bool
+) -> int:
+    """
+    Insert an iterator of DataFrame chunks with executemany.
+
+    Only one chunk is held in memory at a time. When `replace` is set the table is
+    dropped and recreated from the first chunk's dtypes.
+
+    Returns:
+        Number of rows written
+    """
+    row_count = 0
+    insert_sql = None
+    for chunk in chunks:
+        if insert_sql is None:
+            columns = [str(col) for col in chunk.columns]
+            quoted = ", ".join(f'"{col}"' for col in columns)
+            if replace:
+                conn.execute(f'DROP TABLE IF EXISTS "{table_name}"')
+                column_defs = ", ".join(
+                    f'"{col}" {_sqlite_type(dtype)}' for col, dtype in zip(columns, chunk.dtypes)
+                )
+                conn.execute(f'CREATE TABLE "{table_name}" ({column_defs})')
+            placeholders = ", ".join("?" for _ in columns)
+            insert_sql = f'INSERT INTO "{table_name}" ({quoted}) VALUES ({placeholders})'
+
+        # object dtype turns numpy scalars into Python natives; NaN becomes NULL
+        rows = chunk.astype(object).where(chunk.notna(), None)
+        conn.executemany(insert_sql, rows.itertuples(index=False, name=None))
+        row_count += len(chunk)
+    return row_count
+
+def _iter_appended_chunks(csv_path: str, offset: int, chunksize: int):
+    """Stream only the rows appended after `offset`, reusing the file's header."""
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    with open(csv_path, 'rb') as f:
+        f.seek(offset)
+        yield from pd.read_csv(f, header=None, names=columns, chunksize=chunksize)
+
+def _ends_with_newline(csv_path: str, offset: int) -> bool:
+    if offset == 0:
+        return False
+    with open(csv_path, 'rb') as f:
+        f.seek(offset - 1)
+        return f.read(1) == b'\n'
+
+@traced('ingestion')
+def build_sqlite_table_from_csv(
+    csv_path: str,
+    sqlite_path: str = "data/data.sqlite",
+    table_name: str = "data_table",
+    chunksize: int = DEFAULT_CHUNK_SIZE
+) -> Dict:
+    """
+    Load a CSV into SQLite, skipping work when the source has not changed.
+
+    The source fingerprint is stored in the `_ingest_state` table of the same database.
+    Unchanged files are skipped, files that only grew (old content is an exact prefix)
+    get just the new rows appended, and anything else triggers a full rebuild.
+
+    The CSV is streamed in `chunksize`-row chunks and written inside a single
+    transaction, so peak memory is bounded by the chunk size rather than the file size.
+
+    Returns:
+        The stored ingestion state, with an 'action' key of 'skipped', 'appended' or 'rebuilt'
+    """
     os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
-    df = pd.read_csv(csv_path)
+    conn = _connect_for_ingest(sqlite_path)
+    try:
+        conn.execute("BEGIN")
+        previous = _load_ingest_state(conn, table_name)
+        stat = os.stat(csv_path)
+        have_table = _table_exists(conn, table_name)
+
+        # Cheap check first: same size and mtime means we don't even hash
+        if (previous and have_table and previous['source_path'] == csv_path
+                and previous['size'] == stat.st_size and previous['mtime'] == stat.st_mtime):
+            conn.execute("ROLLBACK")
+            return {**previous, 'action': 'skipped'}
+
+        can_append = (
+            previous is not None and have_table
+            and previous['source_path'] == csv_path
+            and stat.st_size > previous['size']
+        )
+        fingerprint = fingerprint_file(csv_path, prefix_size=previous['size'] if can_append else None)
+        state = {
+            'source_path': csv_path,
+            'size': fingerprint['size'],
+            'mtime': fingerprint['mtime'],
+            'sha256': fingerprint['sha256']
+        }
+
+        if previous and have_table and previous['sha256'] == fingerprint['sha256']:
+            # Touched but not modified
+            state['row_count'] = previous['row_count']
+            action = 'skipped'
+        elif (can_append and fingerprint.get('prefix_sha256') == previous['sha256']
+                and _ends_with_newline(csv_path, previous['size'])):
+            chunks = _iter_appended_chunks(csv_path, previous['size'], chunksize)
+            state['row_count'] = previous['row_count'] + _write_chunks(conn, chunks, table_name, replace=False)
+            action = 'appended'
+        else:
+            chunks = pd.read_csv(csv_path, chunksize=chunksize)
+            state['row_count'] = _write_chunks(conn, chunks, table_name, replace=True)
+            action = 'rebuilt'
+
+        _save_ingest_state(conn, table_name, state)
+        conn.execute("COMMIT")
+        return {**state, 'action': action}
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def table_name_for_csv(csv_path: str) -> str:
+    """Derive a SQLite table name from a CSV file name, e.g. 'Top 10 CUs.csv' -> 'top_10_cus'"""
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    name = re.sub(r"\W+", "_", stem).strip("_").lower() or "table"
+    return f"t_{name}" if name[0].isdigit() else name
+
+def build_sqlite_tables_from_directory(
+    csv_dir: str,
+    sqlite_path: str = "data/data.sqlite",
+    chunksize: int = DEFAULT_CHUNK_SIZE
+) -> Dict[str, Dict]:
+    """
+    Ingest every CSV in a directory into its own table of one SQLite database.
+
+    Each file goes through build_sqlite_table_from_csv, so unchanged files are skipped.
+
+    Returns:
+        Mapping of table name to ingestion state
+    """
+    states = {}
+    for file_name in sorted(os.listdir(csv_dir)):
+        if not file_name.lower().endswith(".csv"):
+            continue
+        table_name = table_name_for_csv(file_name)
+        if table_name in states:
+            raise ValueError(f"CSV files in {csv_dir} map to the same table name '{table_name}'")
+        states[table_name] = build_sqlite_table_from_csv(
+            os.path.join(csv_dir, file_name), sqlite_path, table_name=table_name, chunksize=chunksize
+        )
+    return states
+
+def list_sqlite_tables(sqlite_path: str) -> List[str]:
+    """User tables in a database, excluding SQLite's and our own bookkeeping tables"""
     conn = sqlite3.connect(sqlite_path)
-    df.to_sql("data_table", conn, if_exists="replace", index=False)
-    conn.commit()
-    conn.close()
+    try:
+        rows = conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT LIKE 'sqlite_%' AND name NOT LIKE '\\_%' ESCAPE '\\' ORDER BY name"
+        ).fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows]
 
+def _table_fingerprint(conn: sqlite3.Connection, table_name: str) -> Optional[str]:
+    """Cheap change marker for tables we did not ingest ourselves"""
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,)
+    ).fetchone()
+    if row is None:
+        return None
+    try:
+        count, max_rowid = conn.execute(f'SELECT COUNT(*), MAX(rowid) FROM "{table_name}"').fetchone()
+    except sqlite3.OperationalError:
+        # WITHOUT ROWID tables
+        count, max_rowid = conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0], None
+    return hashlib.sha256(f"{row[0]}|{count}|{max_rowid}".encode('utf-8')).hexdigest()
 
-def extract_sqlite_schema(sqlite_path: str) -> dict:
+def _load_cached_profile(conn: sqlite3.Connection, table_name: str, sha256: str) -> Optional[Dict]:
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {PROFILE_CACHE_TABLE} (
+            table_name TEXT PRIMARY KEY,
+            sha256 TEXT,
+            profile TEXT
+        )
+    """)
+    row = conn.execute(
+        f"SELECT sha256, profile FROM {PROFILE_CACHE_TABLE} WHERE table_name = ?",
+        (table_name,)
+    ).fetchone()
+    if row is None or row[0] != sha256:
+        return None
+    return json.loads(row[1])
+
+@traced('schema_extraction')
+def extract_sqlite_schema(sqlite_path: str, table_name: str = "data_table") -> dict:
+    """
+    Extract a column profile for a table, reusing the cached profile when possible.
+
+    The profile is cached in the `_schema_profile` table keyed on the source fingerprint
+    written by build_sqlite_table_from_csv, so it is only recomputed after the data changes.
+    Tables that were not ingested from a CSV are keyed on their DDL, row count and max rowid.
+    """
     conn = sqlite3.connect(sqlite_path)
-    cursor = conn.cursor()
-    
-    # Get basic column info
-    cursor.execute("PRAGMA table_info(data_table)")
-    columns = cursor.fetchall()
-    
-    # Get sample values for each column
-    column_data = []
-    for col in columns:
-        col_name = col[1]
-        # Get 3 distinct sample values, excluding NULL/empty values
-        cursor.execute(f"""
-            SELECT DISTINCT "{col_name}" 
-            FROM data_table 
-            WHERE "{col_name}" IS NOT NULL AND "{col_name}" != ''
-            LIMIT 5
-        """)
-        sample_values = [str(row[0]) for row in cursor.fetchall()]
-        
-        column_data.append({
-            "name": col_name,
-            "type": col[2],
-            "sample_values": sample_values
-        })
-    
-    conn.close()
+    try:
+        state = _load_ingest_state(conn, table_name)
+        sha256 = state['sha256'] if state else _table_fingerprint(conn, table_name)
+        if sha256:
+            cached = _load_cached_profile(conn, table_name, sha256)
+            if cached is not None:
+                return cached
+
+        schema = profile_table(conn, table_name)
+        if sha256:
+            conn.execute(
+                f"INSERT OR REPLACE INTO {PROFILE_CACHE_TABLE} (table_name, sha256, profile) VALUES (?, ?, ?)",
+                (table_name, sha256, json.dumps(schema))
+            )
+            conn.commit()
+        return schema
+    finally:
+        conn.close()
+
+def extract_sqlite_schemas(
+    sqlite_path: str,
+    table_names: Optional[List[str]] = None
+) -> Dict[str, Dict]:
+    """Profiles for several tables (all user tables by default), keyed by table name"""
+    if table_names is None:
+        table_names = list_sqlite_tables(sqlite_path)
     return {
-        "table_name": "data_table",
-        "columns": column_data
+        table_name: extract_sqlite_schema(sqlite_path, table_name)
+        for table_name in table_names
     }
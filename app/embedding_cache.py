@@ -0,0 +1,182 @@
+import os
+import re
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from app.tracing import span
+
+EMBEDDING_CACHE_PATH = os.path.join("data", "embedding_cache.sqlite")
+DEFAULT_MEMORY_ITEMS = 10_000
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different spellings share a cache entry"""
+    return re.sub(r"\s+", " ", text).strip()
+
+def _model_name(embeddings: Embeddings) -> str:
+    return (
+        getattr(embeddings, 'model', None)
+        or getattr(embeddings, 'model_name', None)
+        or type(embeddings).__name__
+    )
+
+def _as_float32(vector: List[float]) -> List[float]:
+    """Round through float32 so fresh and cached vectors are identical (FAISS is float32 anyway)"""
+    return np.asarray(vector, dtype=np.float32).tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper with a two-tier cache keyed on (model name, normalized text).
+
+    Lookups go to an in-memory LRU first, then to an on-disk SQLite table; only
+    misses on both tiers reach the wrapped embeddings, in a single batched call.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        cache_path: Optional[str] = EMBEDDING_CACHE_PATH,
+        max_memory_items: int = DEFAULT_MEMORY_ITEMS
+    ):
+        self.embeddings = embeddings
+        self.model_name = _model_name(embeddings)
+        self.max_memory_items = max_memory_items
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0}
+        self._conn = self._open_disk_cache(cache_path) if cache_path else None
+
+    def _open_disk_cache(self, cache_path: str) -> sqlite3.Connection:
+        directory = os.path.dirname(cache_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(cache_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                dim INTEGER,
+                vector BLOB
+            )
+        """)
+        conn.commit()
+        return conn
+
+    def _key(self, text: str) -> str:
+        payload = f"{self.model_name}\x00{normalize_text(text)}".encode('utf-8')
+        return hashlib.sha256(payload).hexdigest()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[key] = self._memory[key]
+                    self._stats['memory_hits'] += 1
+
+            pending = [key for key in dict.fromkeys(keys) if key not in found]
+            if pending and self._conn is not None:
+                # Stay well under SQLite's bound-parameter limit
+                for start in range(0, len(pending), 500):
+                    batch = pending[start:start + 500]
+                    placeholders = ", ".join("?" for _ in batch)
+                    rows = self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                        batch
+                    ).fetchall()
+                    for key, blob in rows:
+                        vector = np.frombuffer(blob, dtype=np.float32).tolist()
+                        found[key] = vector
+                        self._remember(key, vector)
+                        self._stats['disk_hits'] += 1
+        return found
+
+    def _store(self, items: Dict[str, List[float]]) -> None:
+        with self._lock:
+            for key, vector in items.items():
+                self._remember(key, vector)
+            if self._conn is not None:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)",
+                    [
+                        (key, self.model_name, len(vector), np.asarray(vector, dtype=np.float32).tobytes())
+                        for key, vector in items.items()
+                    ]
+                )
+                self._conn.commit()
+
+    def _partition(self, texts: List[str]):
+        """Keys for `texts`, cached vectors found for them, and the distinct misses (key -> text)"""
+        keys = [self._key(text) for text in texts]
+        found = self._lookup(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        if missing:
+            with self._lock:
+                self._stats['misses'] += len(missing)
+        return keys, found, missing
+
+    def _fill(self, keys: List[str], found: Dict, missing: Dict, vectors) -> List[List[float]]:
+        computed = {key: _as_float32(vector) for key, vector in zip(missing.keys(), vectors)}
+        if computed:
+            self._store(computed)
+            found.update(computed)
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with span('embedding', texts=len(texts)) as record:
+            keys, found, missing = self._partition(texts)
+            record['misses'] = len(missing)
+            vectors = self.embeddings.embed_documents(list(missing.values())) if missing else []
+            return self._fill(keys, found, missing, vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        with span('embedding', texts=1) as record:
+            keys, found, missing = self._partition([text])
+            record['misses'] = len(missing)
+            vectors = [self.embeddings.embed_query(text)] if missing else []
+            return self._fill(keys, found, missing, vectors)[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Async embed_documents: cache lookups stay synchronous (memory or a local SQLite
+        read), only the request for misses is awaited
+        """
+        with span('embedding', texts=len(texts)) as record:
+            keys, found, missing = self._partition(texts)
+            record['misses'] = len(missing)
+            vectors = await self.embeddings.aembed_documents(list(missing.values())) if missing else []
+            return self._fill(keys, found, missing, vectors)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        with span('embedding', texts=1) as record:
+            keys, found, missing = self._partition([text])
+            record['misses'] = len(missing)
+            vectors = [await self.embeddings.aembed_query(text)] if missing else []
+            return self._fill(keys, found, missing, vectors)[0]
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters since this cache was created"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_items'] = len(self._memory)
+        return stats
+
+    def clear_memory(self) -> None:
+        with self._lock:
+            self._memory.clear()
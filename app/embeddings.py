@@ -0,0 +1,121 @@
+import re
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from app.config import load_config, ConfigError
+
+EMBEDDING_BACKENDS = ('openai', 'local', 'fake')
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Deterministic, offline embeddings for tests and benchmarks.
+
+    Word unigrams and bigrams are feature-hashed (signed, blake2b) into `dim` buckets and
+    L2-normalized, so texts sharing words land close together and the same text always
+    gets the same vector in every process.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+        self.model_name = f"hash-{dim}"
+
+    def _embed(self, text: str) -> List[float]:
+        tokens = re.findall(r"[a-z0-9]+", text.lower())
+        features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+            value = int.from_bytes(digest, 'little')
+            vector[value % self.dim] += 1.0 if (value >> 63) & 1 else -1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class LocalEmbeddings(Embeddings):
+    """
+    CPU sentence-transformers embeddings with no network access after the model is cached.
+
+    Documents are split into `batch_size` batches encoded on a thread pool (the model
+    releases the GIL inside torch). Vectors are L2-normalized so FAISS L2 distances
+    stay on the same scale as the normalized OpenAI embeddings.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "sentence-transformers/all-MiniLM-L6-v2",
+        batch_size: int = 64,
+        max_workers: int = 4,
+        device: str = "cpu"
+    ):
+        # Imported lazily: torch is heavy and only needed for this backend
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.model = SentenceTransformer(model_name, device=device)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if self._executor is None or len(batches) == 1:
+            encoded = [self._encode(batch) for batch in batches]
+        else:
+            encoded = list(self._executor.map(self._encode, batches))
+        return np.vstack(encoded).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0].tolist()
+
+
+def build_embeddings(config: Optional[Dict] = None) -> Embeddings:
+    """
+    Create the embeddings backend selected by EMBEDDING_BACKEND.
+
+    Note that an index must be queried with the backend (and model) it was built with;
+    switching backends requires rebuilding the index and recalibrating.
+    """
+    config = config or load_config(require_api_key=False)
+    backend = config['embedding_backend']
+
+    if backend == 'openai':
+        if not config.get('openai_api_key'):
+            raise ConfigError("OPENAI_API_KEY is required for the openai embedding backend")
+        from langchain_community.embeddings import OpenAIEmbeddings
+        if config.get('embedding_model'):
+            return OpenAIEmbeddings(model=config['embedding_model'])
+        return OpenAIEmbeddings()
+    if backend == 'local':
+        return LocalEmbeddings(
+            model_name=config.get('embedding_model') or "sentence-transformers/all-MiniLM-L6-v2",
+            batch_size=config['embedding_batch_size'],
+            max_workers=config['embedding_workers']
+        )
+    if backend == 'fake':
+        return HashEmbeddings(dim=config['fake_embedding_dim'])
+
+    raise ConfigError(
+        f"Unknown EMBEDDING_BACKEND '{backend}', expected one of: {', '.join(EMBEDDING_BACKENDS)}"
+    )
@@ -0,0 +1,169 @@
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain.schema import Document
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens, splitting identifiers on underscores and camelCase"""
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+def normalize_name(text: str) -> str:
+    """Canonical form of a column name or query, so 'total assets' matches TOTAL_ASSETS"""
+    return "_".join(tokenize(text))
+
+def _document_text(doc: Document) -> str:
+    """Searchable text of a metadata document: its description plus any sample values"""
+    sample_values = doc.metadata.get('sample_values') or []
+    return " ".join([doc.page_content, *map(str, sample_values)])
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over metadata documents, in the same row order as the FAISS index.
+
+    Postings are stored CSR-style (`indptr` into parallel `rows` / `tfs` arrays per term),
+    so the index saves to a single .npz without pickling and scores a query with array
+    ops over only the postings of its terms.
+    """
+
+    def __init__(
+        self,
+        terms: np.ndarray,
+        indptr: np.ndarray,
+        rows: np.ndarray,
+        tfs: np.ndarray,
+        doc_lengths: np.ndarray,
+        names: np.ndarray
+    ):
+        self.terms = terms
+        self.indptr = indptr
+        self.rows = rows
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.names = names
+        self.vocabulary = {term: i for i, term in enumerate(terms.tolist())}
+        num_docs = len(doc_lengths)
+        doc_freqs = np.diff(indptr)
+        self.idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5)).astype(np.float32)
+        average_length = float(doc_lengths.mean()) if num_docs else 1.0
+        self.length_norm = (
+            BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths / max(average_length, 1.0))
+        ).astype(np.float32)
+        rows_by_name: Dict[str, List[int]] = {}
+        for row, name in enumerate(names.tolist()):
+            if name:
+                rows_by_name.setdefault(name, []).append(row)
+        self.rows_by_name = {
+            name: np.array(name_rows, dtype=np.int64) for name, name_rows in rows_by_name.items()
+        }
+
+    @classmethod
+    def build(cls, documents: Sequence[Optional[Document]]) -> "LexicalIndex":
+        """Index documents (column names, descriptions and sample values); None rows match nothing"""
+        postings: Dict[str, Dict[int, int]] = {}
+        doc_lengths = []
+        names = []
+        for row, doc in enumerate(documents):
+            if doc is None:
+                doc_lengths.append(0)
+                names.append("")
+                continue
+            tokens = tokenize(_document_text(doc))
+            doc_lengths.append(len(tokens))
+            for token in tokens:
+                term_rows = postings.setdefault(token, {})
+                term_rows[row] = term_rows.get(row, 0) + 1
+            is_column = doc.metadata.get('type') == 'column'
+            names.append(normalize_name(doc.metadata['column_name']) if is_column else "")
+
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(postings[term]) for term in terms])
+        rows = np.fromiter(
+            (row for term in terms for row in postings[term]), dtype=np.int64, count=int(indptr[-1])
+        )
+        tfs = np.fromiter(
+            (tf for term in terms for tf in postings[term].values()), dtype=np.float32, count=int(indptr[-1])
+        )
+        return cls(
+            np.array(terms, dtype=str),
+            indptr,
+            rows,
+            tfs,
+            np.array(doc_lengths, dtype=np.float32),
+            np.array(names, dtype=str)
+        )
+
+    def save(self, path: str) -> None:
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                terms=self.terms,
+                indptr=self.indptr,
+                rows=self.rows,
+                tfs=self.tfs,
+                doc_lengths=self.doc_lengths,
+                names=self.names
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                data['terms'],
+                data['indptr'],
+                data['rows'],
+                data['tfs'],
+                data['doc_lengths'],
+                data['names']
+            )
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def search(
+        self,
+        query: str,
+        k: int = 10,
+        allowed_rows: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k BM25 matches for a query.
+
+        Returns:
+            (scores, rows) in descending score order; only rows sharing a term with the query
+        """
+        term_ids = [self.vocabulary[t] for t in dict.fromkeys(tokenize(query)) if t in self.vocabulary]
+        if not term_ids or k <= 0:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        rows = np.concatenate([self.rows[self.indptr[t]:self.indptr[t + 1]] for t in term_ids])
+        tfs = np.concatenate([self.tfs[self.indptr[t]:self.indptr[t + 1]] for t in term_ids])
+        idf = np.concatenate([
+            np.full(self.indptr[t + 1] - self.indptr[t], self.idf[t], dtype=np.float32) for t in term_ids
+        ])
+        contributions = idf * tfs * (BM25_K1 + 1) / (tfs + self.length_norm[rows])
+
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=contributions).astype(np.float32)
+        if allowed_rows is not None:
+            allowed = np.isin(candidates, allowed_rows)
+            candidates, scores = candidates[allowed], scores[allowed]
+
+        # Stable sort on score keeps row order among ties
+        order = np.argsort(-scores, kind='stable')[:k]
+        return scores[order], candidates[order]
+
+    def exact_matches(self, query: str, allowed_rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rows of columns whose name is exactly the query (ignoring case and separators)"""
+        rows = self.rows_by_name.get(normalize_name(query))
+        if rows is None:
+            return np.empty(0, dtype=np.int64)
+        if allowed_rows is not None:
+            rows = rows[np.isin(rows, allowed_rows)]
+        return rows
@@ -0,0 +1,138 @@
+"""
+Leveled, structured logging for the `app` package.
+
+Modules log through `logger = get_logger(__name__)` and pass structured fields as
+`extra`, e.g. `logger.debug("conformal selection", extra={'threshold': 0.31})`.
+Records are put on an in-memory queue by the calling thread and formatted and written
+by a background listener, so logging never blocks a request on stderr.
+
+Configured from the environment on first use:
+    LOG_LEVEL                 minimum level (default INFO; the query path logs at DEBUG)
+    LOG_FORMAT                'json' (one object per line, default) or 'text'
+    LOG_DEBUG_SAMPLE_RATE     share of DEBUG records kept (default 1.0)
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+ROOT_LOGGER = "app"
+LOG_FORMATS = ('json', 'text')
+# Attributes every LogRecord has; anything else on a record came from `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+_configure_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message and any `extra` fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **_extra_fields(record)
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with `extra` fields appended as key=value"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s - %(message)s', datefmt='%H:%M:%S')
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+class SamplingFilter(logging.Filter):
+    """Keep every record above DEBUG and a random `rate` share of DEBUG records"""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or self.rate >= 1.0 or random.random() < self.rate
+
+
+def configure_logging(
+    level: Optional[str] = None,
+    log_format: Optional[str] = None,
+    debug_sample_rate: Optional[float] = None,
+    stream=None
+) -> None:
+    """
+    (Re)configure the `app` logger: queue handler in front, stream writer on a listener thread.
+
+    Arguments default to the LOG_* environment variables.
+    """
+    global _listener
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    log_format = (log_format or os.getenv('LOG_FORMAT', 'json')).lower()
+    if log_format not in LOG_FORMATS:
+        raise ValueError(f"Unknown LOG_FORMAT '{log_format}', expected one of {LOG_FORMATS}")
+    if debug_sample_rate is None:
+        debug_sample_rate = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '1.0'))
+
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+
+        output = logging.StreamHandler(stream or sys.stderr)
+        output.setFormatter(JsonFormatter() if log_format == 'json' else TextFormatter())
+        records = queue.SimpleQueue()
+        handler = QueueHandler(records)
+        handler.addFilter(SamplingFilter(debug_sample_rate))
+
+        logger = logging.getLogger(ROOT_LOGGER)
+        for existing in list(logger.handlers):
+            logger.removeHandler(existing)
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+
+        _listener = QueueListener(records, output)
+        _listener.start()
+
+def flush_logging() -> None:
+    """Write out every queued record (the listener keeps running)"""
+    with _configure_lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener.start()
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger under the `app` hierarchy, configuring it from the environment on first use"""
+    if _listener is None:
+        configure_logging()
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER + "."):
+        # e.g. '__main__' when a module is run with `python -m`
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)
+
+@atexit.register
+def _stop_listener() -> None:
+    if _listener is not None:
+        _listener.stop()
@@ -1,65 +1,960 @@
 import os
-from typing import Dict, List, Optional
+import json
+import shutil
+import asyncio
+import tempfile
+import threading
+import weakref
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
 from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import OpenAIEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain.schema import Document
+from app.embedding_cache import CachedEmbeddings
+from app.embeddings import build_embeddings, HashEmbeddings
+from app.vector_index import (
+    add_rows,
+    build_faiss_index,
+    choose_index_type,
+    describe_index,
+    filtered_search,
+    reconstruct_rows,
+    remove_rows,
+    scans_filter_exactly,
+    tune_index,
+    updatable_index
+)
+from app.lexical_index import LexicalIndex
+from app.config import load_config
+from app.tracing import span
 import streamlit as st
 import numpy as np
+import faiss
 
 VECTORSTORE_PATH = os.path.join("data", "metadata_index")
-DEFAULT_CONFIDENCE_THRESHOLD = 0.45
+RETRIEVAL_MODES = ('dense', 'hybrid')
+# Hybrid distances are 1 - RRF / best possible RRF, always below this bound
+HYBRID_MAX_DISTANCE = 1.0
+INDEX_FILE = "index.faiss"
+DOCUMENTS_FILE = "documents.jsonl"
+INDEX_FILES = (INDEX_FILE, DOCUMENTS_FILE)
+LEXICAL_INDEX_FILE = "lexical.npz"
+# Names the generation subdirectory holding the current index files; replacing it
+# publishes a new index, documents and BM25 index in one rename
+MANIFEST_FILE = "manifest.json"
+GENERATION_PREFIX = "generation-"
+# Superseded generations kept for processes still loading them
+KEPT_GENERATIONS = 2
+LOAD_ATTEMPTS = 3
+# Pickled docstore written by LangChain's save_local, converted once on first load
+LEGACY_DOCSTORE_FILE = "index.pkl"
+# Zero-copy mmap of the stored vectors where this faiss build supports it
+INDEX_MMAP_FLAG = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+# update_vectorstore rebuilds the index once removed rows make up more than this share
+TOMBSTONE_REBUILD_FRACTION = 0.2
 
-def store_descriptions_in_vectorstore(documents: list[Document]) -> None:
-    os.makedirs(os.path.dirname(VECTORSTORE_PATH), exist_ok=True)
-    vectorstore = FAISS.from_documents(documents, OpenAIEmbeddings())
-    vectorstore.save_local(VECTORSTORE_PATH)
+# Process-wide cache of loaded indexes: path -> (file version, vectorstore)
+_vectorstore_cache: Dict[str, Tuple[Tuple, FAISS]] = {}
+_vectorstore_cache_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> CachedEmbeddings:
+    """
+    Shared, cache-backed embeddings client for the configured backend,
+    created once per process
+    """
+    embeddings = build_embeddings()
+    if isinstance(embeddings, HashEmbeddings):
+        # Hashing is cheaper than a cache lookup; keep test runs off the disk cache
+        return CachedEmbeddings(embeddings, cache_path=None)
+    return CachedEmbeddings(embeddings)
+
+def document_id(doc: Document) -> str:
+    """Stable id of a metadata document: 'table:{table}' or 'column:{table}:{column}'"""
+    if doc.metadata.get('type') == 'column':
+        return f"column:{doc.metadata.get('table_name')}:{doc.metadata['column_name']}"
+    return f"table:{doc.metadata.get('table_name')}"
+
+def _embed_documents(documents: Sequence[Document]) -> np.ndarray:
+    if not documents:
+        return np.empty((0, 0), dtype=np.float32)
+    return np.asarray(
+        get_embeddings().embed_documents([doc.page_content for doc in documents]),
+        dtype=np.float32
+    )
+
+def _replace_file(path: str, write) -> None:
+    """
+    Write to a temp file and rename over `path`, so processes that have the old file
+    memory-mapped keep reading a consistent copy
+    """
+    tmp_path = f"{path}.tmp"
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+def _current_generation(path: str) -> Optional[str]:
+    """Subdirectory named by the manifest, None for an index saved before generations"""
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)['generation']
+    except FileNotFoundError:
+        return None
+
+def _files_dir(path: str, generation: Optional[str]) -> str:
+    return os.path.join(path, generation) if generation else path
+
+def _remove_old_generations(path: str, current: str) -> None:
+    generations = sorted(
+        (entry for entry in os.scandir(path) if entry.is_dir() and entry.name.startswith(GENERATION_PREFIX)),
+        key=lambda entry: entry.stat().st_mtime_ns,
+        reverse=True
+    )
+    kept = 1
+    for entry in generations:
+        if entry.name == current:
+            continue
+        if kept < KEPT_GENERATIONS:
+            kept += 1
+            continue
+        # Files already memory-mapped stay readable after removal
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+def _write_documents(
+    path: str,
+    docstore_ids: Sequence[Optional[str]],
+    documents: Sequence[Optional[Document]]
+) -> None:
+    """One line per index row; removed rows are written as {"id": null} to keep row numbers"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for doc_id, doc in zip(docstore_ids, documents):
+            if doc_id is None:
+                f.write(json.dumps({'id': None}) + "\n")
+                continue
+            f.write(json.dumps({
+                'id': doc_id,
+                'page_content': doc.page_content,
+                'metadata': doc.metadata
+            }) + "\n")
+
+def _read_documents(path: str) -> Tuple[List[Optional[str]], List[Optional[Document]]]:
+    docstore_ids, documents = [], []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            row = json.loads(line)
+            docstore_ids.append(row['id'])
+            documents.append(
+                Document(page_content=row['page_content'], metadata=row['metadata'])
+                if row['id'] is not None else None
+            )
+    return docstore_ids, documents
+
+def _save_vectorstore(
+    documents: Sequence[Document],
+    vectors: np.ndarray,
+    path: str,
+    index_type: Optional[str] = None
+) -> None:
+    """
+    Build an index over already-embedded documents and save it under their stable ids.
+
+    Vectors go to a plain FAISS index file (memory-mapped on load), documents to
+    JSON lines and the BM25 index to .npz, so loading never unpickles anything.
+    """
+    index = build_faiss_index(vectors, index_type or load_config(require_api_key=False)['vector_index_type'])
+    _write_vectorstore(index, [document_id(doc) for doc in documents], documents, path)
+
+def _write_vectorstore(
+    index: faiss.Index,
+    docstore_ids: Sequence[Optional[str]],
+    documents: Sequence[Optional[Document]],
+    path: str
+) -> None:
+    """
+    Save an index with its documents (None for removed rows) and their BM25 index.
+
+    The files go to a new generation subdirectory that the manifest is then switched
+    to, so a loader never sees an index from one save with documents from another.
+    """
+    os.makedirs(path, exist_ok=True)
+    files_dir = tempfile.mkdtemp(prefix=GENERATION_PREFIX, dir=path)
+    os.chmod(files_dir, 0o755)
+    _write_documents(os.path.join(files_dir, DOCUMENTS_FILE), docstore_ids, documents)
+    LexicalIndex.build(documents).save(os.path.join(files_dir, LEXICAL_INDEX_FILE))
+    faiss.write_index(index, os.path.join(files_dir, INDEX_FILE))
+    generation = os.path.basename(files_dir)
+    _replace_file(
+        os.path.join(path, MANIFEST_FILE),
+        lambda tmp_path: _write_manifest(tmp_path, generation)
+    )
+    _remove_old_generations(path, generation)
+    clear_vectorstore_cache(path)
+
+def _write_manifest(path: str, generation: str) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'generation': generation}, f)
+
+def store_descriptions_in_vectorstore(
+    documents: list[Document],
+    path: str = VECTORSTORE_PATH,
+    index_type: Optional[str] = None
+) -> None:
+    """
+    Embed documents and save them as a FAISS store.
+
+    The index type comes from `index_type` or VECTOR_INDEX_TYPE (default 'auto', which
+    stays exact for small catalogs and switches to HNSW / IVF-PQ as they grow).
+    """
+    _save_vectorstore(documents, _embed_documents(documents), path, index_type)
+
+def update_vectorstore(
+    documents: Sequence[Document] = (),
+    delete_ids: Sequence[str] = (),
+    path: str = VECTORSTORE_PATH,
+    index_type: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Add, replace or delete individual documents of a saved index by stable id.
+
+    Documents whose id is already indexed with the same text keep their stored vector;
+    only new and changed descriptions are embedded. The index is changed in place: new
+    and changed documents are added as new rows, and the rows they replace or that are
+    deleted are removed (flat, IVF) or, where FAISS cannot remove them (HNSW, IVF-PQ),
+    kept as tombstones that searches filter out.
+
+    The index is rebuilt from its stored vectors instead once tombstones would make up
+    more than TOMBSTONE_REBUILD_FRACTION of the rows, or when the index type no longer
+    matches `index_type` / VECTOR_INDEX_TYPE (e.g. 'auto' after the catalog grew).
+
+    Args:
+        documents: Table/column documents to add or replace (see `document_id`)
+        delete_ids: Ids of documents to remove
+        path: Saved index directory
+
+    Returns:
+        Counts of added, updated, deleted and unchanged documents
+    """
+    _convert_legacy_index(path)
+    files_dir = _files_dir(path, _current_generation(path))
+    _, existing = _read_documents(os.path.join(files_dir, DOCUMENTS_FILE))
+    # Stable ids, also for rows of a converted LangChain index (stored under uuids)
+    docstore_ids = [document_id(doc) if doc is not None else None for doc in existing]
+
+    upserts = {document_id(doc): doc for doc in documents}
+    deleted = set(delete_ids) - set(upserts)
+    position = {doc_id: i for i, doc_id in enumerate(docstore_ids) if doc_id is not None}
+    changed = [
+        doc for doc_id, doc in upserts.items()
+        if doc_id not in position or existing[position[doc_id]].page_content != doc.page_content
+    ]
+    changed_ids = {document_id(doc) for doc in changed}
+    counts = {
+        'added': sum(1 for doc_id in changed_ids if doc_id not in position),
+        'updated': sum(1 for doc_id in changed_ids if doc_id in position),
+        'deleted': sum(1 for doc_id in deleted if doc_id in position),
+        'unchanged': len(upserts) - len(changed_ids)
+    }
+    if not changed and not counts['deleted'] and not upserts:
+        return counts
+
+    # Not memory-mapped: the index is changed in place and written back
+    index = faiss.read_index(os.path.join(files_dir, INDEX_FILE))
+    removed = [position[doc_id] for doc_id in deleted | changed_ids if doc_id in position]
+    for row in removed:
+        docstore_ids[row], existing[row] = None, None
+    # Unchanged upserts keep their vector but take the new metadata (e.g. sample values)
+    for doc_id, doc in upserts.items():
+        if doc_id in position and doc_id not in changed_ids:
+            existing[position[doc_id]] = doc
+    new_vectors = _embed_documents(changed)
+
+    kept = [row for row, doc_id in enumerate(docstore_ids) if doc_id is not None]
+    num_rows = len(docstore_ids) + len(changed)
+    tombstones = num_rows - len(kept) - len(changed)
+    index_type = index_type or load_config(require_api_key=False)['vector_index_type']
+    if index_type == 'auto':
+        index_type = choose_index_type(len(kept) + len(changed))
+    if index_type != describe_index(index)['type'] or tombstones > TOMBSTONE_REBUILD_FRACTION * num_rows:
+        vectors = reconstruct_rows(index, np.array(kept, dtype=np.int64))
+        if len(new_vectors):
+            vectors = np.vstack([vectors, new_vectors]) if len(vectors) else new_vectors
+        _save_vectorstore([existing[row] for row in kept] + changed, vectors, path, index_type)
+        return counts
+
+    index = updatable_index(index)
+    if removed:
+        remove_rows(index, np.array(removed, dtype=np.int64))
+    if changed:
+        add_rows(index, new_vectors, np.arange(len(docstore_ids), num_rows))
+    _write_vectorstore(
+        index,
+        docstore_ids + [document_id(doc) for doc in changed],
+        existing + changed,
+        path
+    )
+    return counts
+
+def build_table_documents(
+    table_name: str,
+    metadata: Dict,
+    columns_info: Optional[List[Dict]] = None
+) -> List[Document]:
+    """
+    Table-level and column-level documents for one table's inferred metadata.
+
+    When the profiled `columns_info` is given, each column's sample values are kept in
+    its metadata for the lexical index.
+    """
+    sample_values = {col['name']: col.get('sample_values', []) for col in columns_info or []}
+    documents = [Document(
+        page_content=f"{table_name}: {metadata['table_description']}",
+        metadata={"type": "table", "table_name": table_name}
+    )]
+    for col in metadata["columns"]:
+        column_metadata = {
+            "type": "column",
+            "table_name": table_name,
+            "column_name": col["column_name"]
+        }
+        if col["column_name"] in sample_values:
+            column_metadata["sample_values"] = sample_values[col["column_name"]]
+        documents.append(Document(
+            page_content=f"{col['column_name']} ({col['data_type']}): {col['column_description']}",
+            metadata=column_metadata
+        ))
+    return documents
+
+def _convert_legacy_index(path: str) -> None:
+    """
+    One-time conversion of a LangChain save_local() index (pickled docstore) to the
+    JSON lines format. This is the only place a pickle is loaded, and only for an
+    index directory this application wrote.
+    """
+    if (
+        _current_generation(path)
+        or os.path.exists(os.path.join(path, DOCUMENTS_FILE))
+        or not os.path.exists(os.path.join(path, LEGACY_DOCSTORE_FILE))
+    ):
+        return
+    legacy = FAISS.load_local(path, get_embeddings(), allow_dangerous_deserialization=True)
+    docstore_ids = [legacy.index_to_docstore_id[i] for i in range(legacy.index.ntotal)]
+    _replace_file(
+        os.path.join(path, DOCUMENTS_FILE),
+        lambda tmp_path: _write_documents(
+            tmp_path,
+            docstore_ids,
+            [legacy.docstore.search(doc_id) for doc_id in docstore_ids]
+        )
+    )
+
+def load_vectorstore(path: str = VECTORSTORE_PATH) -> FAISS:
+    """
+    Load a saved index: vectors memory-mapped read-only, documents from JSON lines.
+
+    Mapped pages are shared between worker processes through the page cache. The
+    returned store cannot be added to in place; use update_vectorstore(). Rows removed
+    by an update have no docstore entry.
+
+    Files are read from the generation the manifest names. If that generation is
+    removed by later saves before it has been read, the load is retried on the new one.
+    """
+    _convert_legacy_index(path)
+    for attempt in range(LOAD_ATTEMPTS):
+        generation = _current_generation(path)
+        try:
+            return _load_files(_files_dir(path, generation))
+        except FileNotFoundError:
+            if attempt == LOAD_ATTEMPTS - 1 or _current_generation(path) == generation:
+                raise
+
+def _load_files(files_dir: str) -> FAISS:
+    index = faiss.read_index(os.path.join(files_dir, INDEX_FILE), INDEX_MMAP_FLAG | faiss.IO_FLAG_READ_ONLY)
+    docstore_ids, documents = _read_documents(os.path.join(files_dir, DOCUMENTS_FILE))
+    rows = [row for row, doc_id in enumerate(docstore_ids) if doc_id is not None]
+    vectorstore = FAISS(
+        get_embeddings(),
+        index,
+        InMemoryDocstore({docstore_ids[row]: documents[row] for row in rows}),
+        {row: docstore_ids[row] for row in rows}
+    )
+    lexical_path = os.path.join(files_dir, LEXICAL_INDEX_FILE)
+    if os.path.exists(lexical_path):
+        _lexical_indexes[vectorstore] = LexicalIndex.load(lexical_path)
+    config = load_config(require_api_key=False)
+    tune_index(
+        vectorstore.index,
+        nprobe=config['vector_index_nprobe'],
+        ef_search=config['vector_index_ef_search']
+    )
+    return vectorstore
+
+def _index_version(path: str) -> Tuple:
+    """
+    The current generation, or for an index saved before generations the (mtime_ns, size)
+    of each index file; changes whenever the index is re-saved
+    """
+    generation = _current_generation(path)
+    if generation:
+        return (generation,)
+    version = []
+    for name in INDEX_FILES:
+        stat = os.stat(os.path.join(path, name))
+        version.append((stat.st_mtime_ns, stat.st_size))
+    return tuple(version)
+
+def get_vectorstore(path: str = VECTORSTORE_PATH) -> FAISS:
+    """
+    Return the loaded index for `path`, loading it only on first use or after the
+    files on disk have changed.
+    """
+    _convert_legacy_index(path)
+    version = _index_version(path)
+    cached = _vectorstore_cache.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
+    with _vectorstore_cache_lock:
+        # Another thread may have loaded it while we waited
+        cached = _vectorstore_cache.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        vectorstore = load_vectorstore(path)
+        _vectorstore_cache[path] = (version, vectorstore)
+        return vectorstore
+
+def clear_vectorstore_cache(path: Optional[str] = None) -> None:
+    """Drop one cached index, or all of them when no path is given"""
+    with _vectorstore_cache_lock:
+        if path is None:
+            _vectorstore_cache.clear()
+        else:
+            _vectorstore_cache.pop(path, None)
+
+class RetrievedChunks:
+    """
+    Columnar retrieval result: parallel arrays of distances, type codes and ids.
+
+    `ids` index into `documents`, which holds either LangChain Documents (FAISS rows)
+    or match dicts. Filtering and summaries work on the arrays; match dicts are only
+    built by `to_matches()` for the final output.
+    """
+
+    TYPE_CODES = {'table': 0, 'column': 1}
+
+    def __init__(self, distances, type_codes, ids, documents):
+        self.distances = np.asarray(distances, dtype=np.float64)
+        self.type_codes = np.asarray(type_codes, dtype=np.int8)
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.documents = documents
+
+    @classmethod
+    def empty(cls) -> "RetrievedChunks":
+        return cls([], [], [], [])
+
+    @classmethod
+    def from_matches(cls, matches: List[Dict]) -> "RetrievedChunks":
+        """Wrap match dicts as returned by search_metadata_with_scores"""
+        return cls(
+            [match['cosine_distance'] for match in matches],
+            [cls.type_code(match['metadata']) for match in matches],
+            np.arange(len(matches)),
+            matches
+        )
+
+    @classmethod
+    def type_code(cls, metadata: Dict) -> int:
+        return cls.TYPE_CODES.get(metadata.get('type'), -1)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def select(self, mask) -> "RetrievedChunks":
+        return RetrievedChunks(
+            self.distances[mask], self.type_codes[mask], self.ids[mask], self.documents
+        )
+
+    def columns(self) -> "RetrievedChunks":
+        return self.select(self.type_codes == self.TYPE_CODES['column'])
+
+    def _match(self, position: int, distance: float) -> Dict:
+        doc = self.documents[position]
+        if isinstance(doc, Document):
+            return {
+                'content': doc.page_content,
+                'metadata': doc.metadata,
+                'cosine_distance': distance
+            }
+        return {**doc, 'cosine_distance': distance}
+
+    def to_matches(self) -> List[Dict]:
+        return [
+            self._match(position, distance)
+            for position, distance in zip(self.ids.tolist(), self.distances.tolist())
+        ]
+
+    def confidence_summary(self, threshold: float) -> Dict:
+        return _summarize_distances(self.distances, threshold)
+
+
+def _summarize_distances(distances: np.ndarray, threshold: float) -> Dict:
+    if not len(distances):
+        return {
+            'average_confidence': 0.0,
+            'max_confidence': 0.0,
+            'min_confidence': 0.0,
+            'sufficient_confidence': False
+        }
+    max_distance = float(distances.max())
+    return {
+        'average_confidence': round(float(distances.mean()), 3),
+        'max_confidence': round(max_distance, 3),
+        'min_confidence': round(float(distances.min()), 3),
+        'sufficient_confidence': max_distance >= threshold
+    }
 
 def get_confidence_summary(
             scored_matches: List[Dict],
             threshold: float
     ) -> Dict:
-        if not scored_matches:
-            return {
-                'average_confidence': 0.0,
-                'max_confidence': 0.0,
-                'min_confidence': 0.0,
-                'sufficient_confidence': False
-            }
-        
-        scores = [match['cosine_distance'] for match in scored_matches]
-        return {
-            'average_confidence': round(np.mean(scores), 3),
-            'max_confidence': round(max(scores),3),
-            'min_confidence': round(min(scores),3),
-            'sufficient_confidence': max(scores) >= threshold
+        scores = np.array([match['cosine_distance'] for match in scored_matches], dtype=np.float64)
+        return _summarize_distances(scores, threshold)
+
+class _TableFilter:
+    """Rows a table filter admits, with what `filtered_search` needs to search only them"""
+
+    def __init__(self, index: faiss.Index, ids: np.ndarray):
+        self.ids = ids
+        self.selector = faiss.IDSelectorBatch(ids)
+        # Small filters are scanned exactly over their own vectors, read out of the index once
+        self.vectors = reconstruct_rows(index, ids) if scans_filter_exactly(index, len(ids)) else None
+
+    def search(self, index: faiss.Index, vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        return filtered_search(index, vectors, k, self.ids, self.vectors, self.selector)
+
+# Table filters kept per index view; the oldest is dropped past this many
+MAX_CACHED_TABLE_FILTERS = 256
+
+class _IndexView:
+    """Row-ordered documents plus per-row arrays derived from them, built once per index state"""
+
+    def __init__(self, vectorstore: FAISS):
+        self.ntotal = vectorstore.index.ntotal
+        row_ids = vectorstore.index_to_docstore_id
+        # Removed rows are None: still in the index for HNSW / IVF-PQ, gaps in the ids otherwise
+        num_rows = max(self.ntotal, max(row_ids, default=-1) + 1)
+        self.documents = [
+            vectorstore.docstore.search(row_ids[i]) if i in row_ids else None
+            for i in range(num_rows)
+        ]
+        # Trailing -1 so that missing neighbours (id -1) map to "no type"
+        self.type_codes = np.array(
+            [RetrievedChunks.type_code(doc.metadata) if doc is not None else -1 for doc in self.documents] + [-1],
+            dtype=np.int8
+        )
+        table_rows: Dict[str, List[int]] = {}
+        for i, doc in enumerate(self.documents):
+            if doc is not None:
+                table_rows.setdefault(doc.metadata.get('table_name'), []).append(i)
+        self.table_rows = {
+            table: np.array(rows, dtype=np.int64) for table, rows in table_rows.items()
         }
+        self.live_rows = np.array(sorted(row_ids), dtype=np.int64)
+        self.num_documents = len(self.live_rows)
+        self._index = vectorstore.index
+        self._filters: Dict[Tuple[str, ...], Optional[_TableFilter]] = {}
+        self._live_filter: Optional[_TableFilter] = None
 
-def search_metadata_with_scores(query: str, k: int = 10, confidence_threshold: float = DEFAULT_CONFIDENCE_THRESHOLD) -> Dict:
-    vectorstore = FAISS.load_local(
-        VECTORSTORE_PATH,
-        OpenAIEmbeddings(),
-        allow_dangerous_deserialization=True
-    )
-    docs_and_scores = vectorstore.similarity_search_with_score(query, k=k)
-    scored_matches = []
-    #st.write(docs_and_scores)
-    for doc, score in docs_and_scores:
-        if score <= confidence_threshold:
-            scored_matches.append(
-                {
-                    'content': doc.page_content,
-                    'metadata': doc.metadata,
-                    'cosine_distance': round(score,3)
-                }
-            )
-    scored_matches.sort(key = lambda x: x['cosine_distance'])
+    @property
+    def live_filter(self) -> Optional[_TableFilter]:
+        """Filter hiding removed rows that are still in the index, None if there are none"""
+        if self.num_documents == self.ntotal:
+            return None
+        if self._live_filter is None:
+            self._live_filter = _TableFilter(self._index, self.live_rows)
+        return self._live_filter
+
+    def allowed_rows(self, table_names: Sequence[str]) -> np.ndarray:
+        """Row ids of the given tables' documents"""
+        rows = [self.table_rows[t] for t in sorted(set(table_names)) if t in self.table_rows]
+        return np.concatenate(rows) if rows else np.empty(0, dtype=np.int64)
+
+    def table_filter(self, table_names: Sequence[str]) -> Optional[_TableFilter]:
+        """Search filter restricted to the given tables, None if they have no rows"""
+        key = tuple(sorted(set(table_names)))
+        if key not in self._filters:
+            ids = self.allowed_rows(key)
+            if len(self._filters) >= MAX_CACHED_TABLE_FILTERS:
+                self._filters.pop(next(iter(self._filters)), None)
+            self._filters[key] = _TableFilter(self._index, ids) if len(ids) else None
+        return self._filters[key]
+
+# Per-index view, rebuilt when the number of rows changes
+_index_views: "weakref.WeakKeyDictionary[FAISS, _IndexView]" = weakref.WeakKeyDictionary()
+
+def _index_view(vectorstore: FAISS) -> _IndexView:
+    view = _index_views.get(vectorstore)
+    if view is None or view.ntotal != vectorstore.index.ntotal:
+        view = _IndexView(vectorstore)
+        _index_views[vectorstore] = view
+    return view
+
+def index_documents(vectorstore: FAISS) -> List[Optional[Document]]:
+    """Documents in FAISS row order, so search ids can index straight into the list; None for removed rows"""
+    return _index_view(vectorstore).documents
+
+def index_tables(vectorstore: FAISS) -> List[str]:
+    """Names of the tables described in an index"""
+    return sorted(t for t in _index_view(vectorstore).table_rows if t is not None)
+
+# BM25 index per loaded store, read from disk by load_vectorstore
+_lexical_indexes: "weakref.WeakKeyDictionary[FAISS, LexicalIndex]" = weakref.WeakKeyDictionary()
+
+def lexical_index(vectorstore: FAISS) -> LexicalIndex:
+    """The store's BM25 index, built from its documents if none was saved with it"""
+    lexical = _lexical_indexes.get(vectorstore)
+    if lexical is None or len(lexical) != len(index_documents(vectorstore)):
+        lexical = LexicalIndex.build(index_documents(vectorstore))
+        _lexical_indexes[vectorstore] = lexical
+    return lexical
+
+def retrieval_mode(mode: Optional[str] = None) -> str:
+    """`mode`, or RETRIEVAL_MODE from the config ('dense' or 'hybrid')"""
+    mode = mode or load_config(require_api_key=False)['retrieval_mode']
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}', expected one of: {', '.join(RETRIEVAL_MODES)}")
+    return mode
+
+def default_confidence_threshold() -> float:
+    """CONFIDENCE_THRESHOLD from the config, defaulting per embedding backend"""
+    return load_config(require_api_key=False)['confidence_threshold']
+
+def candidate_threshold(confidence_threshold: float, mode: Optional[str] = None) -> float:
+    """Distance cut-off applied before conformal filtering; hybrid scores use their own scale"""
+    return confidence_threshold if retrieval_mode(mode) == 'dense' else HYBRID_MAX_DISTANCE
 
-    confidence_summary = get_confidence_summary(scored_matches, confidence_threshold)
+def _chunks_from_rows(
+    distances: np.ndarray,
+    ids: np.ndarray,
+    vectorstore: FAISS,
+    confidence_threshold: float
+) -> List[RetrievedChunks]:
+    """Turn FAISS (distances, ids) rows into thresholded columnar results"""
+    view = _index_view(vectorstore)
+    keep = (ids >= 0) & (distances <= confidence_threshold)
+    # FAISS already returns neighbours in ascending distance order
+    return [
+        RetrievedChunks(row_distances[row_keep], view.type_codes[row_ids[row_keep]], row_ids[row_keep], view.documents)
+        for row_distances, row_ids, row_keep in zip(distances, ids, keep)
+    ]
+
+def _query_embeddings(vectorstore: Optional[FAISS]):
+    return (vectorstore.embeddings if vectorstore is not None else None) or get_embeddings()
+
+def _as_query_matrix(vectors, vectorstore: Optional[FAISS]) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectorstore is not None and vectorstore._normalize_L2:
+        faiss.normalize_L2(vectors)
+    return vectors
+
+def embed_queries(queries: List[str], vectorstore: Optional[FAISS] = None) -> np.ndarray:
+    """Embed many queries in one bulk request, as a float32 matrix ready for FAISS"""
+    embeddings = _query_embeddings(vectorstore)
+    if len(queries) == 1:
+        return _as_query_matrix([embeddings.embed_query(queries[0])], vectorstore)
+    return _as_query_matrix(embeddings.embed_documents(queries), vectorstore)
+
+async def aembed_queries(queries: List[str], vectorstore: Optional[FAISS] = None) -> np.ndarray:
+    """Async embed_queries; the event loop is free while the embedding request is in flight"""
+    embeddings = _query_embeddings(vectorstore)
+    if len(queries) == 1:
+        return _as_query_matrix([await embeddings.aembed_query(queries[0])], vectorstore)
+    return _as_query_matrix(await embeddings.aembed_documents(queries), vectorstore)
+
+def _search_plan(
+    vectorstore: FAISS,
+    k: int,
+    table_names: Optional[Sequence[str]]
+) -> Tuple[Optional[_TableFilter], int]:
+    """The table (or removed-row) filter to search under, and k capped at the rows it admits"""
+    view = _index_view(vectorstore)
+    if table_names is None:
+        return view.live_filter, min(k, view.num_documents)
+    table_filter = view.table_filter(table_names)
+    return table_filter, min(k, len(table_filter.ids) if table_filter is not None else 0)
+
+def _empty_search(num_queries: int) -> Tuple[np.ndarray, np.ndarray]:
+    empty = np.empty((num_queries, 0))
+    return empty.astype(np.float64), empty.astype(np.int64)
+
+def _search_vectors(
+    vectors: np.ndarray,
+    k: int,
+    vectorstore: FAISS,
+    table_filter: Optional[_TableFilter]
+) -> Tuple[np.ndarray, np.ndarray]:
+    with span('index_search', queries=len(vectors), k=k):
+        if table_filter is None:
+            distances, ids = vectorstore.index.search(vectors, k)
+        else:
+            distances, ids = table_filter.search(vectorstore.index, vectors, k)
+    return np.round(distances.astype(np.float64), 3), ids
+
+def search_index_batch(
+    queries: List[str],
+    k: int = 10,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Run a single multi-query FAISS search, optionally restricted to some tables.
+
+    Returns:
+        (distances, ids) arrays of shape (len(queries), k); distances are rounded to
+        3 decimals like search_metadata_with_scores, missing neighbours have id -1
+    """
+    if vectorstore is None:
+        vectorstore = get_vectorstore()
+    table_filter, k = _search_plan(vectorstore, k, table_names)
+    if k == 0:
+        return _empty_search(len(queries))
+    vectors = embed_queries(queries, vectorstore)
+    return _search_vectors(vectors, k, vectorstore, table_filter)
+
+async def asearch_index_batch(
+    queries: List[str],
+    k: int = 10,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Async search_index_batch: awaits the embedding call, runs the FAISS search in a worker thread"""
+    if vectorstore is None:
+        vectorstore = get_vectorstore()
+    table_filter, k = _search_plan(vectorstore, k, table_names)
+    if k == 0:
+        return _empty_search(len(queries))
+    vectors = await aembed_queries(queries, vectorstore)
+    # FAISS releases the GIL, so concurrent searches overlap in the default executor
+    return await asyncio.to_thread(_search_vectors, vectors, k, vectorstore, table_filter)
+
+class _HybridSearch:
+    """
+    State of one hybrid search: exact column-name hits are resolved up front, the
+    remaining queries are fused once their dense rankings are available.
+    """
+
+    def __init__(
+        self,
+        queries: List[str],
+        k: int,
+        vectorstore: FAISS,
+        table_names: Optional[Sequence[str]],
+        rrf_k: Optional[int]
+    ):
+        self.queries = queries
+        self.k = k
+        self.rrf_k = rrf_k if rrf_k is not None else load_config(require_api_key=False)['rrf_k']
+        self.lexical = lexical_index(vectorstore)
+        self.allowed_rows = None
+        if table_names is not None:
+            self.allowed_rows = _index_view(vectorstore).allowed_rows(table_names)
+
+        self.distances = np.full((len(queries), k), np.inf)
+        self.ids = np.full((len(queries), k), -1, dtype=np.int64)
+        self.pending = []
+        for i, query in enumerate(queries):
+            rows = self.lexical.exact_matches(query, self.allowed_rows)[:k]
+            if len(rows):
+                self.ids[i, :len(rows)] = rows
+                self.distances[i, :len(rows)] = 0.0
+            else:
+                self.pending.append(i)
+
+    @property
+    def pending_queries(self) -> List[str]:
+        return [self.queries[i] for i in self.pending]
+
+    def fuse(self, dense_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Fill pending rows from their dense rankings (aligned with `pending`) and BM25"""
+        with span('lexical_fusion', queries=len(self.pending)):
+            return self._fuse(dense_ids)
+
+    def _fuse(self, dense_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        best_score = 2.0 / (self.rrf_k + 1)
+        for dense_row, i in zip(dense_ids, self.pending):
+            _, lexical_rows = self.lexical.search(self.queries[i], self.k, self.allowed_rows)
+            fused: Dict[int, float] = {}
+            for ranking in (dense_row[dense_row >= 0], lexical_rows):
+                for rank, row in enumerate(ranking.tolist()):
+                    fused[row] = fused.get(row, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+            top = sorted(fused.items(), key=lambda item: -item[1])[:self.k]
+            if top:
+                rows, scores = zip(*top)
+                self.ids[i, :len(rows)] = rows
+                self.distances[i, :len(rows)] = np.round(1.0 - np.array(scores) / best_score, 3)
+        return self.distances, self.ids
+
+def search_index_hybrid(
+    queries: List[str],
+    k: int = 10,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None,
+    rrf_k: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Dense + BM25 search fused by reciprocal rank fusion.
+
+    Each document scores sum(1 / (rrf_k + rank)) over the dense and lexical rankings;
+    the returned distance is 1 - score / (best possible score), in [0, 1), so lower is
+    better as with L2 distances and conformal thresholds can be calibrated on it.
+    Queries that are exactly a column name return those columns at distance 0 and
+    are never embedded.
+
+    Returns:
+        (distances, ids) arrays of shape (len(queries), k), rounded to 3 decimals;
+        missing neighbours have id -1 and distance inf
+    """
+    if vectorstore is None:
+        vectorstore = get_vectorstore()
+    search = _HybridSearch(queries, k, vectorstore, table_names, rrf_k)
+    if not search.pending:
+        return search.distances, search.ids
+    _, dense_ids = search_index_batch(search.pending_queries, k, vectorstore, table_names)
+    return search.fuse(dense_ids)
+
+async def asearch_index_hybrid(
+    queries: List[str],
+    k: int = 10,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None,
+    rrf_k: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Async search_index_hybrid"""
+    if vectorstore is None:
+        vectorstore = get_vectorstore()
+    search = _HybridSearch(queries, k, vectorstore, table_names, rrf_k)
+    if not search.pending:
+        return search.distances, search.ids
+    _, dense_ids = await asearch_index_batch(search.pending_queries, k, vectorstore, table_names)
+    return await asyncio.to_thread(search.fuse, dense_ids)
+
+def search_index(
+    queries: List[str],
+    k: int = 10,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None,
+    mode: Optional[str] = None,
+    rrf_k: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """(distances, ids) from dense or hybrid search, per `mode` or RETRIEVAL_MODE"""
+    if retrieval_mode(mode) == 'hybrid':
+        return search_index_hybrid(queries, k, vectorstore, table_names, rrf_k)
+    return search_index_batch(queries, k, vectorstore, table_names)
+
+async def asearch_index(
+    queries: List[str],
+    k: int = 10,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None,
+    mode: Optional[str] = None,
+    rrf_k: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Async search_index"""
+    if retrieval_mode(mode) == 'hybrid':
+        return await asearch_index_hybrid(queries, k, vectorstore, table_names, rrf_k)
+    return await asearch_index_batch(queries, k, vectorstore, table_names)
+
+def search_metadata_columnar(
+    queries: List[str],
+    k: int = 10,
+    confidence_threshold: Optional[float] = None,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None,
+    mode: Optional[str] = None,
+    rrf_k: Optional[int] = None
+) -> List[RetrievedChunks]:
+    """
+    Search one or many queries, returning a columnar result per query.
+
+    Dense neighbours farther than `confidence_threshold` (default CONFIDENCE_THRESHOLD)
+    are dropped. Settings left as None are read from the config on every call, which
+    costs more than the search itself; long-lived callers resolve them once and pass
+    them in.
+    """
+    if not queries:
+        return []
+    if vectorstore is None:
+        vectorstore = get_vectorstore()
+    if confidence_threshold is None:
+        confidence_threshold = default_confidence_threshold()
+    mode = retrieval_mode(mode)
+    distances, ids = search_index(queries, k, vectorstore, table_names, mode, rrf_k)
+    return _chunks_from_rows(distances, ids, vectorstore, candidate_threshold(confidence_threshold, mode))
+
+async def asearch_metadata_columnar(
+    queries: List[str],
+    k: int = 10,
+    confidence_threshold: Optional[float] = None,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None,
+    mode: Optional[str] = None,
+    rrf_k: Optional[int] = None
+) -> List[RetrievedChunks]:
+    """Async search_metadata_columnar, for serving many questions from one event loop"""
+    if not queries:
+        return []
+    if vectorstore is None:
+        vectorstore = get_vectorstore()
+    if confidence_threshold is None:
+        confidence_threshold = default_confidence_threshold()
+    mode = retrieval_mode(mode)
+    distances, ids = await asearch_index(queries, k, vectorstore, table_names, mode, rrf_k)
+    return _chunks_from_rows(distances, ids, vectorstore, candidate_threshold(confidence_threshold, mode))
+
+def _to_result(chunks: RetrievedChunks, confidence_threshold: float) -> Dict:
+    confidence_summary = chunks.confidence_summary(confidence_threshold)
     return {
-        'matches': scored_matches,
+        'matches': chunks.to_matches(),
         'confidence_summary': confidence_summary,
-        'needs_clarification': not confidence_summary
-        ['sufficient_confidence']
+        'needs_clarification': not confidence_summary['sufficient_confidence']
     }
-    
-    
\ No newline at end of file
+
+def search_metadata_with_scores(
+    query: str,
+    k: int = 10,
+    confidence_threshold: Optional[float] = None,
+    vectorstore: Optional[FAISS] = None,
+    table_name: Optional[str] = None
+) -> Dict:
+    table_names = [table_name] if table_name else None
+    if confidence_threshold is None:
+        confidence_threshold = default_confidence_threshold()
+    chunks = search_metadata_columnar([query], k, confidence_threshold, vectorstore, table_names)[0]
+    return _to_result(chunks, confidence_threshold)
+
+def search_metadata_batch(
+    queries: List[str],
+    k: int = 10,
+    confidence_threshold: Optional[float] = None,
+    vectorstore: Optional[FAISS] = None,
+    table_names: Optional[Sequence[str]] = None
+) -> List[Dict]:
+    """Batched equivalent of search_metadata_with_scores, one result dict per query"""
+    if confidence_threshold is None:
+        confidence_threshold = default_confidence_threshold()
+    return [
+        _to_result(chunks, confidence_threshold)
+        for chunks in search_metadata_columnar(queries, k, confidence_threshold, vectorstore, table_names)
+    ]
+
+async def asearch_metadata_with_scores(
+    query: str,
+    k: int = 10,
+    confidence_threshold: Optional[float] = None,
+    vectorstore: Optional[FAISS] = None,
+    table_name: Optional[str] = None
+) -> Dict:
+    """Async search_metadata_with_scores"""
+    table_names = [table_name] if table_name else None
+    if confidence_threshold is None:
+        confidence_threshold = default_confidence_threshold()
+    chunks = (await asearch_metadata_columnar([query], k, confidence_threshold, vectorstore, table_names))[0]
+    return _to_result(chunks, confidence_threshold)
@@ -1,13 +1,33 @@
 import os
-from typing import Dict
-from langchain.schema import Document
-from app.data_loader import build_sqlite_table_from_csv, extract_sqlite_schema
+import asyncio
+import threading
+import numpy as np
+from typing import Dict, List, Optional
+from app.data_loader import (
+    build_sqlite_table_from_csv,
+    build_sqlite_tables_from_directory,
+    extract_sqlite_schemas
+)
 from app.schema_inferencer import infer_table_metadata_from_columns
-from app.metadata_vectorstore import store_descriptions_in_vectorstore, search_metadata_with_scores 
+from app.metadata_vectorstore import (
+    build_table_documents,
+    store_descriptions_in_vectorstore,
+    update_vectorstore,
+    search_metadata_columnar,
+    asearch_metadata_columnar,
+    RetrievedChunks,
+    get_vectorstore,
+    index_documents,
+    retrieval_mode
+)
 from app.calibration import generate_question_set
-from app.calibration.storage import CalibrationQuestionStorage
-from app.calibration.calibration_data import CalibrationDataCollector
-from app.calibration.conformal import do_conformal_rag
+from app.calibration.storage import CALIBRATION_PATH
+from app.calibration.calibration_data import CalibrationDataCollector, score_calibration_questions
+from app.calibration.conformal import do_conformal_rag, ConformalThresholds, MondrianThresholds
+from app.calibration.question_classifier import CROSS_FIT_FOLDS, QuestionClassifier, cross_fit_predict
+from app.config import load_config
+from app.tracing import traced
+from app.log import get_logger
 import streamlit as st
 from app.utils.pretty_printer import log_rag_response
 
@@ -15,83 +35,488 @@ CSV_PATH = os.path.join("data", "Top10_CreditUnions1.csv")
 SQLITE_PATH = os.path.join("data", "creditunion.sqlite")
 VECTORSTORE_PATH = os.path.join("data", "metadata_index")
 
-def run_rag_pipeline(
-    user_question: str,
-    error_rate: float = 0.1,
-    verbose: bool = False
-) -> Dict:
-    # 1. Create SQLite table from CSV
-    build_sqlite_table_from_csv(CSV_PATH, SQLITE_PATH)
-
-    # 2. Extract schema from SQLite
-    schema = extract_sqlite_schema(SQLITE_PATH)
-    print('schema here',schema)
-    # 3. If metadata index doesn't exist, generate it via LLM and generate calibration questions
-    if not os.path.exists(VECTORSTORE_PATH):
-        metadata = infer_table_metadata_from_columns(
-            schema["table_name"], schema["columns"]
+logger = get_logger(__name__)
+
+
+class RagPipeline:
+    """
+    Long-lived RAG pipeline.
+
+    Ingestion, schema extraction, index building/loading and calibration loading
+    happen once in `load()`; `query()` only runs retrieval and conformal filtering
+    against the resident state.
+
+    Data sources, in order of precedence:
+        csv_dir: every CSV in the directory is loaded as its own table
+        csv_path: a single CSV loaded as `data_table`
+        neither: the tables already present in the SQLite database at sqlite_path
+    All tables are described in one metadata index and calibrated together, with
+    per-table thresholds available for table-filtered queries.
+
+    Confirmed query outcomes can be fed back with `record_feedback()`, which scores
+    them, appends the scores to the current calibration run and updates thresholds in
+    place; with CALIBRATION_WINDOW set, only the most recent scores count.
+    """
+
+    def __init__(
+        self,
+        csv_path: Optional[str] = CSV_PATH,
+        sqlite_path: str = SQLITE_PATH,
+        vectorstore_path: str = VECTORSTORE_PATH,
+        csv_dir: Optional[str] = None,
+        calibration_path: str = CALIBRATION_PATH
+    ):
+        self.csv_path = csv_path
+        self.csv_dir = csv_dir
+        self.sqlite_path = sqlite_path
+        self.vectorstore_path = vectorstore_path
+        self.calibration_path = calibration_path
+        self._calibration: Optional[CalibrationDataCollector] = None
+        self.ingest_state: Dict[str, Dict] = {}
+        self.schemas: Dict[str, Dict] = {}
+        self.calibration_mode: Optional[str] = None
+        # Search settings, resolved from the config once in `load()` rather than per query
+        self.retrieval_mode: Optional[str] = None
+        self.rrf_k: Optional[int] = None
+        self.confidence_threshold: Optional[float] = None
+        self.thresholds = ConformalThresholds([])
+        self.table_thresholds = MondrianThresholds([], [], [])
+        self.category_thresholds = MondrianThresholds([], [], [])
+        self.question_classifier: Optional[QuestionClassifier] = None
+        # Version of the stored scores the thresholds reflect (see CalibrationScoreStore.version)
+        self.calibration_version = None
+        # Serializes threshold rebuilds and in-place feedback updates within the process
+        self._calibration_lock = threading.RLock()
+        self._loaded = False
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def calibration(self) -> CalibrationDataCollector:
+        """Calibration questions and scores for this pipeline's index, opened on first use"""
+        if self._calibration is None:
+            self._calibration = CalibrationDataCollector(self.calibration_path, self.vectorstore_path)
+        return self._calibration
+
+    @property
+    def schema(self) -> Optional[Dict]:
+        """The schema when the pipeline serves exactly one table"""
+        if len(self.schemas) == 1:
+            return next(iter(self.schemas.values()))
+        return None
+
+    def load(self) -> "RagPipeline":
+        """Run all setup work and keep the results resident."""
+        config = load_config(require_api_key=False)
+        self.retrieval_mode = retrieval_mode(config['retrieval_mode'])
+        self.rrf_k = config['rrf_k']
+        self.confidence_threshold = config['confidence_threshold']
+
+        # 1. Create SQLite tables from CSVs (skipped when a CSV is unchanged)
+        if self.csv_dir:
+            self.ingest_state = build_sqlite_tables_from_directory(self.csv_dir, self.sqlite_path)
+        elif self.csv_path:
+            self.ingest_state = {
+                "data_table": build_sqlite_table_from_csv(self.csv_path, self.sqlite_path)
+            }
+
+        # 2. Extract schemas from SQLite (all user tables when reading an existing database)
+        self.schemas = extract_sqlite_schemas(self.sqlite_path, list(self.ingest_state) or None)
+        logger.debug("extracted schemas", extra={
+            'columns_per_table': {name: len(schema['columns']) for name, schema in self.schemas.items()}
+        })
+
+        # 3. If metadata index doesn't exist, generate it via LLM and generate calibration questions;
+        #    otherwise bring it in line with schema changes since it was built
+        if not os.path.exists(self.vectorstore_path):
+            self._build_index_and_calibrate()
+        else:
+            self.refresh_index()
+
+        # 4. Warm the shared index cache and load calibration records once
+        get_vectorstore(self.vectorstore_path)
+        self.reload_calibration()
+        # Scores from another retrieval mode are not comparable; re-collect (no LLM calls)
+        if len(self.thresholds) and self.calibration_mode != self.retrieval_mode:
+            self.calibration.collect_calibration_data()
+            self.reload_calibration()
+
+        self._loaded = True
+        return self
+
+    def calibration_changed(self) -> bool:
+        """Whether stored scores changed (another process recalibrated or appended) since loaded"""
+        return self.calibration.score_store.version() != self.calibration_version
+
+    def reload_calibration(self) -> None:
+        """Re-read calibration scores, e.g. after a recalibration run."""
+        with self._calibration_lock:
+            self._reload_calibration()
+
+    def _reload_calibration(self) -> None:
+        store = self.calibration.score_store
+        # One consistent snapshot of the run, its scores and questions
+        with store.write_lock:
+            version = store.version()
+            run = store.current_run()
+            columns = store.load_columns()
+            scored_columns = store.scored_columns()
+            questions = self.calibration.question_storage.get_questions()
+        self.calibration_mode = run['retrieval_mode'] if run else None
+        distances = columns['distance']
+        config = load_config(require_api_key=False)
+        window = config['calibration_window']
+        self.thresholds = ConformalThresholds(distances, window=window)
+
+        # Table of each score via a column id -> table code lookup
+        table_names = sorted({table_name for table_name, _ in scored_columns.values() if table_name})
+        table_codes = {table_name: code for code, table_name in enumerate(table_names)}
+        lookup = np.full(max(scored_columns, default=0) + 1, -1, dtype=np.int64)
+        for column_id, (table_name, _) in scored_columns.items():
+            lookup[column_id] = table_codes.get(table_name, -1)
+        self.table_thresholds = MondrianThresholds(
+            distances,
+            lookup[columns['column_id']],
+            table_names,
+            # Too few scores give an infinite threshold that accepts every chunk
+            min_group_size=config['conformal_min_group_size'],
+            window=window
         )
+        self._fit_category_thresholds(distances, columns['question_id'], questions)
+        self.calibration_version = version
 
-        documents = []
-        print(type(metadata))
-        print(metadata)
-        # Table-level doc
-        documents.append(Document(
-            page_content=f"{schema['table_name']}: {metadata['table_description']}",
-            metadata={"type": "table", "table_name": schema["table_name"]}
-        ))
+    def _fit_category_thresholds(
+        self,
+        distances: np.ndarray,
+        question_ids: np.ndarray,
+        questions: List[Dict]
+    ) -> None:
+        """
+        Train the question classifier on the calibration questions and split scores by category.
+
+        Scores are grouped by a predicted category for their question, not by its stored
+        label, so calibration and queries are grouped by the same kind of function. The
+        predictions are cross-fitted (see `cross_fit_predict`, folds by question id): a
+        labelled question is grouped by a classifier that never saw it, as a query would
+        be. Questions without a label (recorded feedback) are grouped by the classifier
+        trained on all labelled questions, which is also the one used for queries.
+        """
+        config = load_config(require_api_key=False)
+        self.question_classifier = None
+        self.category_thresholds = MondrianThresholds([], [], [])
+        if config['conformal_grouping'] != 'category' or not len(distances) or not questions:
+            return
+        ids = np.array([q['id'] for q in questions], dtype=np.int64)
+        classifier, predictions = cross_fit_predict(
+            [q['question'] for q in questions],
+            [q.get('category') for q in questions],
+            ids % CROSS_FIT_FOLDS
+        )
+        if classifier is None:
+            return
 
-        # Column-level docs
-        for col in metadata["columns"]:
-            documents.append(Document(
-                page_content=f"{col['column_name']} ({col['data_type']}): {col['column_description']}",
-                metadata={
-                    "type": "column",
-                    "table_name": schema["table_name"],
-                    "column_name": col["column_name"]
-                }
-            ))
-
-        store_descriptions_in_vectorstore(documents)
-
-        # Generate and store calibration questions
-        storage = CalibrationQuestionStorage()
-        generate_question_set(
-            table_name=schema["table_name"],
-            table_description=metadata["table_description"],
-            columns_info=schema["columns"],
-            storage=storage
+        label_codes = {label: code for code, label in enumerate(classifier.labels)}
+        codes_by_id = np.full(int(max(ids.max(), question_ids.max(initial=0))) + 1, -1, dtype=np.int64)
+        codes_by_id[ids] = [label_codes.get(label, -1) for label in predictions]
+        score_codes = np.where(question_ids >= 0, codes_by_id[np.maximum(question_ids, 0)], -1)
+        self.question_classifier = classifier
+        self.category_thresholds = MondrianThresholds(
+            distances,
+            score_codes,
+            classifier.labels,
+            min_group_size=config['conformal_min_group_size'],
+            window=config['calibration_window']
         )
 
+    def record_feedback(
+        self,
+        user_question: str,
+        source_columns: List[str],
+        table_name: Optional[str] = None
+    ) -> int:
+        """
+        Add a confirmed query outcome to the calibration set without recalibrating.
+
+        The question is stored (without a category), scored against the resident index
+        like any calibration question, and its scores are appended to the current run
+        and inserted into the pooled, table and predicted-category thresholds.
+
+        All of it holds the score store's interprocess lock, so feedback cannot land in a
+        run that a concurrent re-collection is replacing. Thresholds are first reloaded
+        if other processes changed the stored scores since they were built.
+
+        Args:
+            user_question: The question that was asked
+            source_columns: Columns confirmed as relevant to it
+            table_name: Table the columns belong to, None to match them in any table
+
+        Returns:
+            Number of calibration scores added
+        """
+        if not self._loaded:
+            self.load()
+
+        store = self.calibration.score_store
+        with self._calibration_lock, store.write_lock:
+            if self.calibration_changed():
+                self._reload_calibration()
+            question = self.calibration.question_storage.add_question(
+                user_question,
+                source_columns,
+                table_name=table_name
+            )
+            records = score_calibration_questions(
+                [question],
+                vectorstore=get_vectorstore(self.vectorstore_path),
+                mode=self.retrieval_mode,
+                confidence_threshold=self.confidence_threshold
+            )
+            store.append(records, self.retrieval_mode)
+            if self.calibration_mode is None:
+                self.calibration_mode = self.retrieval_mode
+            self.calibration_version = store.version()
+            if not records:
+                return 0
+
+            distances = np.array([record['cosine_distance'] for record in records])
+            self.thresholds.update(distances)
+            record_tables = np.array([record['metadata'].get('table_name') or "" for record in records])
+            for record_table in set(record_tables.tolist()) - {""}:
+                self.table_thresholds.update(record_table, distances[record_tables == record_table])
+            if self.question_classifier is not None:
+                category, _ = self.question_classifier.predict(user_question)
+                self.category_thresholds.update(category, distances)
+
+        logger.debug("recorded calibration feedback", extra={
+            'question': user_question[:50],
+            'scores': len(records),
+            'calibration_scores': len(self.thresholds)
+        })
+        return len(records)
+
+    def _build_index_and_calibrate(self) -> None:
+        documents = []
+        descriptions = {}
+        for table_name, schema in self.schemas.items():
+            metadata = infer_table_metadata_from_columns(table_name, schema["columns"])
+            logger.debug("inferred table metadata", extra={'table': table_name, 'metadata': metadata})
+            descriptions[table_name] = metadata["table_description"]
+            documents.extend(build_table_documents(table_name, metadata, schema["columns"]))
+
+        store_descriptions_in_vectorstore(documents, self.vectorstore_path)
+
+        # Generate and store calibration questions per table
+        for table_name, schema in self.schemas.items():
+            generate_question_set(
+                table_name=table_name,
+                table_description=descriptions[table_name],
+                columns_info=schema["columns"],
+                storage=self.calibration.question_storage
+            )
+
         # Collect calibration data
-        collector = CalibrationDataCollector()
-        calibration_records = collector.collect_calibration_data(verbose=True)
-        print(f"Collected {len(calibration_records)} calibration records")
-
-    # Get calibration records
-    collector = CalibrationDataCollector()
-    calibration_records = collector.get_calibration_records()
-
-    # Get initial search results
-    search_results = search_metadata_with_scores(user_question)
-    #Sst.write("check these",search_results)
-    #st.write("check these",calibration_records)
-    # Apply conformal prediction
-    conformal_results = do_conformal_rag(
-        question=user_question,
-        retrieved_chunks=search_results,
-        calibration_records=calibration_records,
-        error_rate=error_rate,
-        verbose=verbose
-    )
-    
+        self.calibration.collect_calibration_data()
+
+    def refresh_index(self) -> Dict[str, int]:
+        """
+        Update the existing index for schema drift instead of rebuilding it.
+
+        Metadata is inferred only for new tables and for columns added (or renamed) in
+        known tables; documents of dropped columns and tables are deleted, and unchanged
+        descriptions keep their stored vectors. Calibration questions are generated for
+        new tables only, then calibration data is re-collected against the updated index.
+
+        Returns:
+            Counts of added, updated, deleted and unchanged documents
+        """
+        indexed_columns: Dict[str, set] = {}
+        for doc in index_documents(get_vectorstore(self.vectorstore_path)):
+            if doc is None:
+                continue
+            columns = indexed_columns.setdefault(doc.metadata.get('table_name'), set())
+            if doc.metadata.get('type') == 'column':
+                columns.add(doc.metadata['column_name'])
+
+        documents = []
+        delete_ids = []
+        new_tables = {}
+        for table_name, schema in self.schemas.items():
+            if table_name not in indexed_columns:
+                metadata = infer_table_metadata_from_columns(table_name, schema["columns"])
+                new_tables[table_name] = metadata["table_description"]
+                documents.extend(build_table_documents(table_name, metadata, schema["columns"]))
+                continue
+
+            current = {col["name"] for col in schema["columns"]}
+            added = [col for col in schema["columns"] if col["name"] not in indexed_columns[table_name]]
+            if added:
+                metadata = infer_table_metadata_from_columns(table_name, added)
+                # Keep the existing table description; only the new column documents are used
+                documents.extend(build_table_documents(table_name, metadata, added)[1:])
+            delete_ids.extend(
+                f"column:{table_name}:{column}"
+                for column in indexed_columns[table_name] - current
+            )
+
+        for table_name, columns in indexed_columns.items():
+            if table_name not in self.schemas:
+                delete_ids.append(f"table:{table_name}")
+                delete_ids.extend(f"column:{table_name}:{column}" for column in columns)
+
+        counts = {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 0}
+        if documents or delete_ids:
+            counts = update_vectorstore(documents, delete_ids, self.vectorstore_path)
+        if not (counts['added'] or counts['updated'] or counts['deleted']):
+            return counts
+        logger.info("updated metadata index", extra=counts)
+
+        for table_name, table_description in new_tables.items():
+            generate_question_set(
+                table_name=table_name,
+                table_description=table_description,
+                columns_info=self.schemas[table_name]["columns"],
+                storage=self.calibration.question_storage
+            )
+        self.calibration.collect_calibration_data()
+        return counts
+
+    def thresholds_for(
+        self,
+        table_name: Optional[str] = None,
+        user_question: Optional[str] = None
+    ) -> ConformalThresholds:
+        """
+        Thresholds for one query: the table's own when that group is large enough, else those
+        of the question's predicted category when that group is large enough, else the
+        thresholds pooled over all calibration scores.
+        """
+        if table_name and self.table_thresholds.get(table_name):
+            return self.table_thresholds.get(table_name)
+        if user_question and self.question_classifier is not None:
+            category, _ = self.question_classifier.predict(user_question)
+            if self.category_thresholds.get(category):
+                return self.category_thresholds.get(category)
+        return self.thresholds
+
+    @traced('query')
+    def query(
+        self,
+        user_question: str,
+        error_rate: float = 0.1,
+        verbose: bool = False,
+        table_name: Optional[str] = None
+    ) -> Dict:
+        """
+        Answer a question using the resident index and calibration data.
+
+        When `table_name` is given, retrieval is restricted to that table and its own
+        calibration thresholds are used if it has any.
+        """
+        if not self._loaded:
+            self.load()
+
+        # Get initial search results; the cached index is reloaded only if rebuilt on disk
+        search_results = search_metadata_columnar(
+            [user_question],
+            confidence_threshold=self.confidence_threshold,
+            vectorstore=get_vectorstore(self.vectorstore_path),
+            table_names=[table_name] if table_name else None,
+            mode=self.retrieval_mode,
+            rrf_k=self.rrf_k
+        )[0]
+        return self._answer(user_question, search_results, error_rate, verbose, table_name)
+
+    @traced('query')
+    async def aquery(
+        self,
+        user_question: str,
+        error_rate: float = 0.1,
+        verbose: bool = False,
+        table_name: Optional[str] = None
+    ) -> Dict:
+        """
+        Async `query`, for serving many concurrent questions from one event loop.
+
+        The embedding request is awaited and the FAISS search runs in a worker thread;
+        the index, schemas and thresholds are shared between requests (thresholds are
+        only changed in place by `record_feedback`).
+        """
+        if not self._loaded:
+            await asyncio.to_thread(self.load)
+
+        search_results = (await asearch_metadata_columnar(
+            [user_question],
+            confidence_threshold=self.confidence_threshold,
+            vectorstore=get_vectorstore(self.vectorstore_path),
+            table_names=[table_name] if table_name else None,
+            mode=self.retrieval_mode,
+            rrf_k=self.rrf_k
+        ))[0]
+        return self._answer(user_question, search_results, error_rate, verbose, table_name)
+
+    def _answer(
+        self,
+        user_question: str,
+        search_results: RetrievedChunks,
+        error_rate: float,
+        verbose: bool,
+        table_name: Optional[str]
+    ) -> Dict:
+        # Apply conformal prediction
+        conformal_results = add_query_status(do_conformal_rag(
+            question=user_question,
+            retrieved_chunks=search_results,
+            error_rate=error_rate,
+            verbose=verbose,
+            thresholds=self.thresholds_for(table_name, user_question)
+        ))
+
+        # Log the results to terminal
+        log_rag_response(conformal_results)
+
+        return conformal_results
+
+
+def add_query_status(conformal_results: Dict) -> Dict:
+    """Set the status (and message, when nothing matched) on a conformal result"""
     if not conformal_results['matches']:
         conformal_results['status'] = "No relevant metadata found"
         conformal_results['message'] = "No columns matched with sufficient confidence"
     else:
         conformal_results['status'] = "Success"
-    
-    # Log the results to terminal
-    log_rag_response(conformal_results)
-    
     return conformal_results
+
+
+_default_pipeline: Optional[RagPipeline] = None
+
+def get_pipeline() -> RagPipeline:
+    """Return the process-wide pipeline, loading it on first use."""
+    global _default_pipeline
+    if _default_pipeline is None:
+        _default_pipeline = RagPipeline().load()
+    return _default_pipeline
+
+def run_rag_pipeline(
+    user_question: str,
+    error_rate: float = 0.1,
+    verbose: bool = False
+) -> Dict:
+    return get_pipeline().query(
+        user_question,
+        error_rate=error_rate,
+        verbose=verbose
+    )
+
+async def arun_rag_pipeline(
+    user_question: str,
+    error_rate: float = 0.1,
+    verbose: bool = False
+) -> Dict:
+    pipeline = await asyncio.to_thread(get_pipeline)
+    return await pipeline.aquery(
+        user_question,
+        error_rate=error_rate,
+        verbose=verbose
+    )
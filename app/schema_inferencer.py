@@ -2,6 +2,8 @@ from typing import List, Dict
 from langchain_community.chat_models import ChatOpenAI
 from langchain.schema import ChatMessage
 from app.prompts import METADATA_PROMPT
+from app.tracing import span
+from app.log import get_logger
 import json
 import streamlit as st
 import re
@@ -9,9 +11,23 @@ import pdb
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = get_logger(__name__)
+
+def _format_column_stats(col: Dict) -> str:
+    """Render optional profiler stats (nulls, distinct estimate, range) for the prompt"""
+    stats = []
+    if col.get('null_count') is not None:
+        stats.append(f"nulls: {col['null_count']}")
+    if col.get('distinct_count') is not None:
+        stats.append(f"~{col['distinct_count']} distinct")
+    if col.get('min') is not None and col.get('max') is not None:
+        stats.append(f"range: {col['min']} to {col['max']}")
+    return f"\n  Stats: {', '.join(stats)}" if stats else ""
+
 def infer_table_metadata_from_columns(table_name: str, columns: List[Dict[str, str]]) -> Dict:
     column_list_str = "\n".join(
         f"- {col['name']}: {col['type']}\n  Sample values: {', '.join(col['sample_values'])}"
+        + _format_column_stats(col)
         for col in columns
     )
     #print("this is the metadata prompt:" , METADATA_PROMPT)
@@ -21,13 +37,14 @@ def infer_table_metadata_from_columns(table_name: str, columns: List[Dict[str, s
         ChatMessage(role="system", content="You are a helpful assistant."),
         ChatMessage(role="user", content=prompt)
     ]
-    response = llm(messages)
+    with span('llm', task='metadata_inference', table=table_name, columns=len(columns)):
+        response = llm(messages)
     content = response.content
     #st.write(content)
     try:
         json_block = re.findall(r"```json(.*?)```", content, re.DOTALL)[0].strip()
         cleaned = re.sub(r",\s*([}\]])", r"\1", json_block)
-        print("here is the content",content)
+        logger.debug("metadata inference response", extra={'table': table_name, 'content': content})
         return json.loads(cleaned)
     except Exception as e:
         raise RuntimeError(f"❌ Failed to parse LLM response: {e}\n\n--- Raw content ---\n{content}")
@@ -0,0 +1,119 @@
+import math
+import sqlite3
+from collections import Counter
+from typing import List, Dict, Optional
+
+DEFAULT_SAMPLE_ROWS = 10_000
+MAX_SAMPLE_VALUES = 5
+# SQLite caps the number of result columns (SQLITE_MAX_COLUMN defaults to 2000),
+# and every profiled column needs three aggregates
+COLUMNS_PER_AGGREGATE_PASS = 500
+
+
+def estimate_distinct_count(values: List, total_count: int) -> int:
+    """
+    Estimate the number of distinct values in a column from a sample.
+
+    Uses the GEE estimator (Charikar et al.): singletons in the sample are scaled by
+    sqrt(N / n), values seen more than once are counted as-is.
+
+    Args:
+        values: Non-null sample values
+        total_count: Number of non-null values in the full column
+    """
+    if not values:
+        return 0
+    sample_size = len(values)
+    frequencies = Counter(Counter(values).values())
+    singletons = frequencies.get(1, 0)
+    repeated = sum(count for freq, count in frequencies.items() if freq > 1)
+    if sample_size >= total_count:
+        return singletons + repeated
+    estimate = math.sqrt(total_count / sample_size) * singletons + repeated
+    return int(min(round(estimate), total_count))
+
+def _aggregate_stats(
+    cursor: sqlite3.Cursor,
+    table_name: str,
+    column_names: List[str]
+) -> Dict[str, Dict]:
+    """Null counts and min/max for many columns with one scan per batch of columns."""
+    stats = {}
+    for start in range(0, len(column_names), COLUMNS_PER_AGGREGATE_PASS):
+        batch = column_names[start:start + COLUMNS_PER_AGGREGATE_PASS]
+        select = ", ".join(
+            f'COUNT("{col}"), MIN("{col}"), MAX("{col}")' for col in batch
+        )
+        cursor.execute(f'SELECT COUNT(*), {select} FROM "{table_name}"')
+        row = cursor.fetchone()
+        total = row[0]
+        for i, col in enumerate(batch):
+            non_null, min_value, max_value = row[1 + 3 * i: 4 + 3 * i]
+            stats[col] = {
+                'row_count': total,
+                'null_count': total - non_null,
+                'min': min_value,
+                'max': max_value
+            }
+    return stats
+
+def profile_table(
+    conn: sqlite3.Connection,
+    table_name: str,
+    sample_rows: int = DEFAULT_SAMPLE_ROWS
+) -> Dict:
+    """
+    Profile every column of a table in a bounded number of passes.
+
+    One aggregate scan (per batch of up to COLUMNS_PER_AGGREGATE_PASS columns) yields
+    null counts and min/max; one read of the first `sample_rows` rows yields sample
+    values and distinct-count estimates for all columns at once.
+
+    Returns:
+        Dictionary with table_name, row_count and per-column profiles
+    """
+    cursor = conn.cursor()
+    cursor.execute(f'PRAGMA table_info("{table_name}")')
+    columns = cursor.fetchall()
+    column_names = [col[1] for col in columns]
+
+    stats = _aggregate_stats(cursor, table_name, column_names) if column_names else {}
+    row_count = next(iter(stats.values()))['row_count'] if stats else 0
+
+    # Transpose a row sample into per-column value lists
+    cursor.execute(f'SELECT * FROM "{table_name}" LIMIT ?', (sample_rows,))
+    sampled: List[List] = [[] for _ in column_names]
+    for row in cursor:
+        for i, value in enumerate(row):
+            if value is not None and value != '':
+                sampled[i].append(value)
+
+    column_data = []
+    for col, values in zip(columns, sampled):
+        col_name = col[1]
+        col_stats = stats[col_name]
+        sample_values: List[str] = []
+        for value in dict.fromkeys(values):
+            sample_values.append(str(value))
+            if len(sample_values) == MAX_SAMPLE_VALUES:
+                break
+        column_data.append({
+            "name": col_name,
+            "type": col[2],
+            "sample_values": sample_values,
+            "null_count": col_stats['null_count'],
+            "distinct_count": estimate_distinct_count(
+                values, row_count - col_stats['null_count']
+            ),
+            "min": _to_text(col_stats['min']),
+            "max": _to_text(col_stats['max'])
+        })
+
+    return {
+        "table_name": table_name,
+        "row_count": row_count,
+        "columns": column_data
+    }
+
+def _to_text(value) -> Optional[str]:
+    return None if value is None else str(value)
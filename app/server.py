@@ -0,0 +1,262 @@
+"""
+HTTP query service for the metadata retriever.
+
+Usage:
+    python -m app.server --port 8000 --workers 4
+
+Endpoints:
+    POST /query      {"question": ..., "error_rate": 0.1, "table_name": null, "trace": false}
+    POST /calibrate  re-collect calibration data against the current index (no LLM calls)
+    POST /feedback   {"question": ..., "source_columns": [...], "table_name": null}
+                     add a confirmed query outcome to the calibration scores online
+    GET  /health     index and calibration status of the answering worker
+    GET  /metrics    request counters, endpoint and per-stage latencies of the answering
+                     worker; ?format=prometheus for the Prometheus text format
+
+Each worker process loads the pipeline once and keeps it resident; the FAISS index is
+memory-mapped, so workers share its pages. Workers share one port via SO_REUSEPORT.
+"""
+import os
+import time
+import asyncio
+import argparse
+import multiprocessing
+from collections import deque
+from typing import Dict, Optional
+from aiohttp import web
+from app.rag_pipeline import RagPipeline, CSV_PATH, SQLITE_PATH, VECTORSTORE_PATH
+from app.calibration.storage import CALIBRATION_PATH
+from app.metadata_vectorstore import get_embeddings, get_vectorstore, index_tables
+from app.tracing import trace, stage_metrics, prometheus_text
+from app.log import get_logger
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8000
+# Latency samples kept per endpoint for /metrics percentiles
+LATENCY_WINDOW = 1000
+
+logger = get_logger(__name__)
+
+PIPELINE_KEY = web.AppKey("pipeline", RagPipeline)
+STATS_KEY = web.AppKey("stats", dict)
+STARTED_AT_KEY = web.AppKey("started_at", float)
+
+
+class _EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def summary(self) -> Dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99)
+        }
+
+
+@web.middleware
+async def _track_requests(request: web.Request, handler):
+    stats = request.app[STATS_KEY].setdefault(request.path, _EndpointStats())
+    stats.requests += 1
+    start = time.perf_counter()
+    try:
+        return await handler(request)
+    except web.HTTPException as e:
+        if e.status >= 400:
+            stats.errors += 1
+        raise
+    except Exception as e:
+        stats.errors += 1
+        logger.exception("request failed", extra={'path': request.path})
+        return web.json_response({'error': str(e)}, status=500)
+    finally:
+        stats.latencies.append(time.perf_counter() - start)
+
+async def _json_body(request: web.Request) -> Dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Request body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(text="Request body must be a JSON object")
+    return body
+
+async def query(request: web.Request) -> web.Response:
+    body = await _json_body(request)
+    question = body.get('question')
+    if not isinstance(question, str) or not question.strip():
+        raise web.HTTPBadRequest(text="'question' must be a non-empty string")
+    try:
+        error_rate = float(body.get('error_rate', 0.1))
+    except (TypeError, ValueError):
+        raise web.HTTPBadRequest(text="'error_rate' must be a number")
+    if not 0 < error_rate < 1:
+        raise web.HTTPBadRequest(text="'error_rate' must be between 0 and 1")
+    table_name = body.get('table_name')
+    if table_name is not None and not isinstance(table_name, str):
+        raise web.HTTPBadRequest(text="'table_name' must be a string or null")
+
+    pipeline = request.app[PIPELINE_KEY]
+    with trace() as record:
+        result = await pipeline.aquery(
+            question,
+            error_rate=error_rate,
+            table_name=table_name
+        )
+    if body.get('trace'):
+        result['trace'] = record
+    return web.json_response(result)
+
+async def calibrate(request: web.Request) -> web.Response:
+    """Re-collect calibration records; other workers pick them up on their next request"""
+    pipeline = request.app[PIPELINE_KEY]
+    records = await asyncio.to_thread(pipeline.calibration.collect_calibration_data)
+    await asyncio.to_thread(pipeline.reload_calibration)
+    return web.json_response({'status': 'ok', 'calibration_records': len(records)})
+
+async def feedback(request: web.Request) -> web.Response:
+    """Append a confirmed outcome's scores; other workers pick them up on their next request"""
+    body = await _json_body(request)
+    question = body.get('question')
+    if not isinstance(question, str) or not question.strip():
+        raise web.HTTPBadRequest(text="'question' must be a non-empty string")
+    source_columns = body.get('source_columns')
+    if (
+        not isinstance(source_columns, list)
+        or not source_columns
+        or not all(isinstance(column, str) and column for column in source_columns)
+    ):
+        raise web.HTTPBadRequest(text="'source_columns' must be a non-empty list of column names")
+    table_name = body.get('table_name')
+    if table_name is not None and not isinstance(table_name, str):
+        raise web.HTTPBadRequest(text="'table_name' must be a string or null")
+
+    pipeline = request.app[PIPELINE_KEY]
+    added = await asyncio.to_thread(pipeline.record_feedback, question, source_columns, table_name)
+    return web.json_response({
+        'status': 'ok',
+        'calibration_records_added': added,
+        'calibration_records': len(pipeline.thresholds)
+    })
+
+async def health(request: web.Request) -> web.Response:
+    pipeline = request.app[PIPELINE_KEY]
+    vectorstore = get_vectorstore(pipeline.vectorstore_path)
+    return web.json_response({
+        'status': 'ok',
+        'pid': os.getpid(),
+        'tables': index_tables(vectorstore),
+        'documents': len(vectorstore.index_to_docstore_id),
+        'calibration_records': len(pipeline.thresholds),
+        'calibration_mode': pipeline.calibration_mode,
+        'calibration_groups': pipeline.category_thresholds.sizes()
+    })
+
+async def metrics(request: web.Request) -> web.Response:
+    if request.query.get('format') == 'prometheus':
+        return web.Response(text=prometheus_text(), content_type='text/plain')
+    return web.json_response({
+        'pid': os.getpid(),
+        'uptime_seconds': round(time.monotonic() - request.app[STARTED_AT_KEY], 3),
+        'endpoints': {path: stats.summary() for path, stats in request.app[STATS_KEY].items()},
+        'stages': stage_metrics(),
+        'embedding_cache': get_embeddings().stats()
+    })
+
+@web.middleware
+async def _reload_calibration(request: web.Request, handler):
+    """Reload thresholds when another worker (or process) has re-collected or appended scores"""
+    pipeline = request.app[PIPELINE_KEY]
+    if pipeline.calibration_changed():
+        await asyncio.to_thread(pipeline.reload_calibration)
+    return await handler(request)
+
+def create_app(pipeline: RagPipeline) -> web.Application:
+    """Application serving an already loaded pipeline"""
+    app = web.Application(middlewares=[_track_requests, _reload_calibration])
+    app[PIPELINE_KEY] = pipeline
+    app[STATS_KEY] = {}
+    app[STARTED_AT_KEY] = time.monotonic()
+    app.add_routes([
+        web.post('/query', query),
+        web.post('/calibrate', calibrate),
+        web.post('/feedback', feedback),
+        web.get('/health', health),
+        web.get('/metrics', metrics)
+    ])
+    return app
+
+def _run_worker(host: str, port: int, pipeline_options: Dict, reuse_port: bool) -> None:
+    pipeline = RagPipeline(**pipeline_options).load()
+    web.run_app(create_app(pipeline), host=host, port=port, reuse_port=reuse_port, print=None)
+
+def serve(
+    host: str = DEFAULT_HOST,
+    port: int = DEFAULT_PORT,
+    workers: int = 1,
+    **pipeline_options
+) -> None:
+    """
+    Serve the pipeline with `workers` processes.
+
+    Setup that may build the index or run calibration happens once in this process
+    before any worker starts; workers then only load the ready state from disk.
+    """
+    pipeline = RagPipeline(**pipeline_options).load()
+    if workers <= 1:
+        web.run_app(create_app(pipeline), host=host, port=port)
+        return
+
+    # Spawned, not forked: the parent holds SQLite connections and thread pools
+    context = multiprocessing.get_context('spawn')
+    processes = [
+        context.Process(target=_run_worker, args=(host, port, pipeline_options, True), daemon=True)
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    logger.info("serving", extra={'url': f"http://{host}:{port}", 'workers': workers})
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Metadata retriever HTTP service")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--csv-path', default=CSV_PATH)
+    parser.add_argument('--no-csv', action='store_true', help="Serve the existing SQLite database without ingesting a CSV")
+    parser.add_argument('--csv-dir', default=None)
+    parser.add_argument('--sqlite-path', default=SQLITE_PATH)
+    parser.add_argument('--vectorstore-path', default=VECTORSTORE_PATH)
+    parser.add_argument('--calibration-path', default=CALIBRATION_PATH)
+    args = parser.parse_args()
+    serve(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        csv_path=None if args.no_csv else args.csv_path or None,
+        csv_dir=args.csv_dir,
+        sqlite_path=args.sqlite_path,
+        vectorstore_path=args.vectorstore_path,
+        calibration_path=args.calibration_path
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Stage timers with process-wide latency histograms and optional per-request traces.
+
+Usage:
+    with span('index_search', queries=len(queries)):
+        ...
+
+    @traced('llm')
+    def describe_table(...): ...
+
+    with trace() as record:          # collect the spans of one request
+        pipeline.query(question)
+    record['spans']                  # [{'name': 'embedding', 'ms': 1.2, ...}, ...]
+
+Every span feeds its stage's counters and histogram, exported with `stage_metrics()`
+(JSON) or `prometheus_text()`. Spans join the active trace through a context variable,
+so they are collected across awaits and `asyncio.to_thread` calls of the same request.
+"""
+import time
+import uuid
+import asyncio
+import functools
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+
+# Histogram bucket upper bounds in seconds (Prometheus `le` labels)
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Recent samples kept per stage for percentiles
+LATENCY_WINDOW = 1000
+
+_current_trace: ContextVar[Optional[Dict]] = ContextVar('current_trace', default=None)
+_current_span: ContextVar[Optional[str]] = ContextVar('current_span', default=None)
+
+
+class _StageMetrics:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.bucket_counts = [0] * (len(STAGE_BUCKETS) + 1)
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def observe(self, seconds: float, error: bool) -> None:
+        self.count += 1
+        self.errors += error
+        self.total_seconds += seconds
+        self.bucket_counts[bisect_left(STAGE_BUCKETS, seconds)] += 1
+        self.latencies.append(seconds)
+
+    def summary(self) -> Dict:
+        latencies = sorted(self.latencies)
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 3)
+
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_ms': round(self.total_seconds * 1000, 3),
+            'mean_ms': round(self.total_seconds * 1000 / self.count, 3) if self.count else None,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'p99_ms': percentile(0.99)
+        }
+
+
+_lock = threading.Lock()
+_stages: Dict[str, _StageMetrics] = {}
+
+
+def record_stage(name: str, seconds: float, error: bool = False) -> None:
+    """Add one timing to a stage's metrics (spans do this on exit)"""
+    with _lock:
+        stage = _stages.get(name)
+        if stage is None:
+            stage = _stages[name] = _StageMetrics()
+        stage.observe(seconds, error)
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Dict]:
+    """
+    Time a block as one occurrence of stage `name`.
+
+    Yields the span record, so attributes known only at the end can be added to it.
+    The record is appended to the active trace, if any, with its parent span's name.
+    """
+    record = {'name': name, 'parent': _current_span.get(), **attributes}
+    token = _current_span.set(name)
+    error = False
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        error = True
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        _current_span.reset(token)
+        record_stage(name, seconds, error)
+        active = _current_trace.get()
+        if active is not None:
+            record['start_ms'] = round((start - active['_start']) * 1000, 3)
+            record['ms'] = round(seconds * 1000, 3)
+            if error:
+                record['error'] = True
+            active['spans'].append(record)
+
+def traced(name: str):
+    """Decorator running each call of a function (sync or async) in a span"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+@contextmanager
+def trace(trace_id: Optional[str] = None, **attributes) -> Iterator[Dict]:
+    """
+    Collect every span finished inside the block into one trace record.
+
+    The record holds 'trace_id', 'spans' (in completion order) and, once the block
+    exits, 'total_ms'.
+    """
+    record = {'trace_id': trace_id or uuid.uuid4().hex, **attributes, 'spans': []}
+    record['_start'] = time.perf_counter()
+    token = _current_trace.set(record)
+    try:
+        yield record
+    finally:
+        _current_trace.reset(token)
+        record['total_ms'] = round((time.perf_counter() - record.pop('_start')) * 1000, 3)
+
+def stage_metrics() -> Dict[str, Dict]:
+    """Counters and latency percentiles per stage since startup (or the last reset)"""
+    with _lock:
+        return {name: stage.summary() for name, stage in sorted(_stages.items())}
+
+def prometheus_text(prefix: str = "rag") -> str:
+    """Stage metrics in the Prometheus text exposition format"""
+    metric = f"{prefix}_stage_duration_seconds"
+    lines = [
+        f"# HELP {metric} Time spent per pipeline stage.",
+        f"# TYPE {metric} histogram"
+    ]
+    error_lines = [
+        f"# HELP {prefix}_stage_errors_total Stage calls that raised.",
+        f"# TYPE {prefix}_stage_errors_total counter"
+    ]
+    with _lock:
+        for name, stage in sorted(_stages.items()):
+            cumulative = 0
+            for bound, count in zip(STAGE_BUCKETS, stage.bucket_counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_bucket{{stage="{name}",le="+Inf"}} {stage.count}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {stage.total_seconds:.6f}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {stage.count}')
+            error_lines.append(f'{prefix}_stage_errors_total{{stage="{name}"}} {stage.errors}')
+    return "\n".join(lines + error_lines) + "\n"
+
+def reset_stage_metrics() -> None:
+    with _lock:
+        _stages.clear()
@@ -0,0 +1,362 @@
+import math
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+import faiss
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+
+# Corpus sizes at which 'auto' switches index type
+AUTO_HNSW_MIN_VECTORS = 20_000
+AUTO_IVFPQ_MIN_VECTORS = 1_000_000
+
+DEFAULT_HNSW_M = 32
+DEFAULT_EF_CONSTRUCTION = 80
+DEFAULT_EF_SEARCH = 64
+DEFAULT_NPROBE = 16
+DEFAULT_REFINE_K_FACTOR = 4
+# faiss k-means wants ~39 training points per centroid
+MIN_POINTS_PER_CENTROID = 39
+# Filtered searches admitting at most this many rows scan them exactly: a graph or IVF
+# walk under a selective filter ends before it reaches enough admitted rows, and below
+# this size brute force is what 'auto' would pick anyway
+EXACT_FILTER_MAX_ROWS = AUTO_HNSW_MIN_VECTORS
+
+
+def choose_index_type(num_vectors: int) -> str:
+    """Pick an index type for a corpus size: exact while cheap, then graph, then compressed"""
+    if num_vectors < AUTO_HNSW_MIN_VECTORS:
+        return 'flat'
+    if num_vectors < AUTO_IVFPQ_MIN_VECTORS:
+        return 'hnsw'
+    return 'ivfpq'
+
+def _default_nlist(num_vectors: int) -> int:
+    nlist = int(4 * math.sqrt(num_vectors))
+    return max(1, min(nlist, num_vectors // MIN_POINTS_PER_CENTROID))
+
+def _default_pq_m(dim: int) -> int:
+    """Largest common sub-quantizer count dividing the dimension, keeping >= 4 dims per sub-vector"""
+    for m in (96, 64, 48, 32, 24, 16, 8, 4, 2, 1):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
+
+def build_faiss_index(
+    vectors: np.ndarray,
+    index_type: str = 'auto',
+    nlist: Optional[int] = None,
+    nprobe: int = DEFAULT_NPROBE,
+    hnsw_m: int = DEFAULT_HNSW_M,
+    ef_construction: int = DEFAULT_EF_CONSTRUCTION,
+    ef_search: int = DEFAULT_EF_SEARCH,
+    pq_m: Optional[int] = None,
+    refine_k_factor: int = DEFAULT_REFINE_K_FACTOR
+) -> faiss.Index:
+    """
+    Build, train and fill an L2 FAISS index over `vectors`.
+
+    All index types use the same squared-L2 metric as the flat index LangChain builds,
+    so calibrated distance thresholds stay valid. IVF-PQ is wrapped in IndexRefineFlat,
+    which re-ranks PQ candidates with exact distances; only the candidate set is
+    approximate, never the returned distances.
+
+    Args:
+        vectors: float32 matrix of shape (n, d)
+        index_type: 'flat', 'ivf', 'hnsw', 'ivfpq', or 'auto' (by corpus size)
+        nlist: IVF cell count, default ~4*sqrt(n) capped by available training points
+        nprobe: IVF cells visited per query
+        hnsw_m: HNSW graph degree
+        ef_construction: HNSW build-time beam width
+        ef_search: HNSW query-time beam width
+        pq_m: PQ sub-quantizers, default chosen from the dimension
+        refine_k_factor: candidates re-ranked per result for IVF-PQ
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    num_vectors, dim = vectors.shape
+    if index_type == 'auto':
+        index_type = choose_index_type(num_vectors)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of: {', '.join(INDEX_TYPES)}")
+
+    if index_type == 'flat':
+        index = faiss.IndexFlatL2(dim)
+    elif index_type == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, hnsw_m)
+        index.hnsw.efConstruction = ef_construction
+        index.hnsw.efSearch = ef_search
+    elif index_type == 'ivf':
+        nlist = nlist or _default_nlist(num_vectors)
+        index = faiss.IndexIVFFlat(faiss.IndexFlatL2(dim), dim, nlist)
+        index.nprobe = min(nprobe, nlist)
+    else:
+        nlist = nlist or _default_nlist(num_vectors)
+        pq_m = pq_m or _default_pq_m(dim)
+        # 8-bit codes need 256 * 39 training points; use fewer bits on small corpora
+        nbits = 8 if num_vectors >= 256 * MIN_POINTS_PER_CENTROID else 4
+        base = faiss.IndexIVFPQ(faiss.IndexFlatL2(dim), dim, nlist, pq_m, nbits)
+        base.nprobe = min(nprobe, nlist)
+        index = faiss.IndexRefineFlat(base)
+        index.k_factor = refine_k_factor
+
+    if not index.is_trained:
+        index.train(vectors)
+    if num_vectors:
+        index.add(vectors)
+    return index
+
+def describe_index(index: faiss.Index) -> Dict:
+    """Index type and current recall knobs, for logging and reports"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        base = faiss.downcast_index(index.base_index)
+        return {'type': 'ivfpq', 'nlist': base.nlist, 'nprobe': base.nprobe, 'k_factor': index.k_factor}
+    if isinstance(index, faiss.IndexHNSW):
+        return {'type': 'hnsw', 'ef_search': index.hnsw.efSearch}
+    if isinstance(index, faiss.IndexIVF):
+        return {'type': 'ivf', 'nlist': index.nlist, 'nprobe': index.nprobe}
+    return {'type': 'flat'}
+
+def tune_index(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    refine_k_factor: Optional[int] = None
+) -> faiss.Index:
+    """Set query-time recall parameters on a loaded index; options that don't apply are ignored"""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        if refine_k_factor:
+            index.k_factor = refine_k_factor
+        tune_index(index.base_index, nprobe=nprobe, ef_search=ef_search)
+    elif isinstance(index, faiss.IndexHNSW):
+        if ef_search:
+            index.hnsw.efSearch = ef_search
+    elif isinstance(index, faiss.IndexIVF):
+        if nprobe:
+            index.nprobe = min(nprobe, index.nlist)
+    return index
+
+def search_parameters(
+    index: faiss.Index,
+    selector: Optional[faiss.IDSelector],
+    selectivity: float = 1.0
+) -> Optional[faiss.SearchParameters]:
+    """
+    Search parameters carrying an id selector, typed for the index.
+
+    Passing params overrides the index's own nprobe/efSearch, so the current values
+    are copied in, widened by 1 / `selectivity` (the share of rows the selector
+    admits) so that a filtered walk still visits about as many admitted rows.
+    """
+    if selector is None:
+        return None
+    widen = 1.0 / min(1.0, max(selectivity, 1e-9))
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexRefine):
+        return faiss.IndexRefineSearchParameters(
+            k_factor=index.k_factor,
+            base_index_params=search_parameters(index.base_index, selector, selectivity)
+        )
+    if isinstance(index, faiss.IndexHNSW):
+        ef_search = min(max(index.ntotal, 1), math.ceil(index.hnsw.efSearch * widen))
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=max(ef_search, index.hnsw.efSearch))
+    if isinstance(index, faiss.IndexIVF):
+        return faiss.SearchParametersIVF(sel=selector, nprobe=min(index.nlist, math.ceil(index.nprobe * widen)))
+    return faiss.SearchParameters(sel=selector)
+
+def _addressable(index: faiss.IndexIVF) -> faiss.IndexIVF:
+    # IVF lists are not addressable by id until a direct map exists; a hashtable map
+    # also covers the gaps that removals leave in the ids
+    if index.direct_map.type == faiss.DirectMap.NoMap:
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)
+    return index
+
+def reconstruct_rows(index: faiss.Index, ids: np.ndarray) -> np.ndarray:
+    """Stored vectors of the given rows, exact for every index type built here"""
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        _addressable(base)
+    return index.reconstruct_batch(np.ascontiguousarray(ids, dtype=np.int64))
+
+def updatable_index(index: faiss.Index) -> faiss.Index:
+    """
+    `index` in a form that `add_rows` / `remove_rows` can change in place.
+
+    Flat indexes are wrapped in IndexIDMap2 and IVF lists get a hashtable direct map, so
+    both can drop rows and take new ones under any id. HNSW and IVF-PQ are returned as
+    they are: they can only append, and removed rows stay in them (see `removes_rows`).
+    """
+    base = faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexFlat):
+        wrapped = faiss.IndexIDMap2(faiss.IndexFlatL2(base.d))
+        if base.ntotal:
+            wrapped.add_with_ids(base.reconstruct_n(0, base.ntotal), np.arange(base.ntotal, dtype=np.int64))
+        return wrapped
+    if isinstance(base, faiss.IndexIVF):
+        _addressable(base)
+    # `base` is a non-owning view; hand back the owning object
+    return index
+
+def removes_rows(index: faiss.Index) -> bool:
+    """Whether `remove_rows` drops rows from this index, rather than leaving them to be filtered out"""
+    return isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIVF))
+
+def add_rows(index: faiss.Index, vectors: np.ndarray, ids: np.ndarray) -> None:
+    """
+    Add vectors under the given row ids. Append-only indexes (HNSW, IVF-PQ) number rows
+    themselves, so their ids must continue from `index.ntotal`.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    base = faiss.downcast_index(index)
+    if removes_rows(base):
+        base.add_with_ids(vectors, ids)
+        return
+    if not np.array_equal(ids, np.arange(index.ntotal, index.ntotal + len(ids))):
+        raise ValueError(f"{describe_index(index)['type']} index can only append rows from id {index.ntotal}")
+    base.add(vectors)
+
+def remove_rows(index: faiss.Index, ids: np.ndarray) -> bool:
+    """Drop rows where the index supports it; returns False when they stay in the index"""
+    if not removes_rows(index):
+        return False
+    faiss.downcast_index(index).remove_ids(np.ascontiguousarray(ids, dtype=np.int64))
+    return True
+
+def _searched_index(index: faiss.Index) -> faiss.Index:
+    index = faiss.downcast_index(index)
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+
+def scans_filter_exactly(index: faiss.Index, num_rows: int) -> bool:
+    """Whether a search restricted to `num_rows` rows brute-forces them instead of filtering a walk"""
+    return num_rows <= EXACT_FILTER_MAX_ROWS and not isinstance(_searched_index(index), faiss.IndexFlat)
+
+def filtered_search(
+    index: faiss.Index,
+    queries: np.ndarray,
+    k: int,
+    ids: np.ndarray,
+    vectors: Optional[np.ndarray] = None,
+    selector: Optional[faiss.IDSelector] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    k-NN search restricted to the rows `ids`.
+
+    Small subsets (see `scans_filter_exactly`) are searched exactly over their stored
+    vectors (`vectors`, reconstructed if not given); larger ones through an id selector
+    with efSearch/nprobe widened by the filter's selectivity. Flat indexes always use
+    the selector, which is already exact. `ids` must all be present in the index.
+
+    Returns:
+        (distances, ids) of shape (len(queries), min(k, len(ids))), ids as index rows
+    """
+    ids = np.asarray(ids, dtype=np.int64)
+    k = min(k, len(ids))
+    if scans_filter_exactly(index, len(ids)):
+        if vectors is None:
+            vectors = reconstruct_rows(index, ids)
+        distances, positions = faiss.knn(queries, vectors, k)
+        return distances, np.where(positions >= 0, ids[np.maximum(positions, 0)], -1)
+    if selector is None:
+        selector = faiss.IDSelectorBatch(ids)
+    params = search_parameters(index, selector, len(ids) / max(index.ntotal, 1))
+    return index.search(queries, k, params=params)
+
+def index_recall_report(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    index_types: Sequence[str] = INDEX_TYPES,
+    filter_fraction: Optional[float] = None,
+    **index_params
+) -> List[Dict]:
+    """
+    Compare index types against exact search on the same data.
+
+    For each index type reports build time, per-query latency percentiles (single-query
+    calls, as on the request path), recall@k against the flat index and the largest
+    absolute difference in returned distances for neighbours both indexes found
+    (which must stay ~0 for calibrated thresholds to remain meaningful).
+
+    With `filter_fraction`, each query is also run through `filtered_search` restricted
+    to a contiguous block of that share of the rows (as a table filter restricts to one
+    table's columns), adding filtered latency and recall against exact search over the
+    block.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    exact = build_faiss_index(vectors, 'flat')
+    exact_distances, exact_ids = exact.search(queries, k)
+
+    blocks = []
+    if filter_fraction is not None:
+        block_size = min(len(vectors), max(k, round(len(vectors) * filter_fraction)))
+        for i in range(len(queries)):
+            start = (i * block_size) % (len(vectors) - block_size + 1)
+            block = np.arange(start, start + block_size, dtype=np.int64)
+            block_distances, positions = faiss.knn(queries[i:i + 1], vectors[block], k)
+            blocks.append((block, block_distances, block[positions]))
+
+    report = []
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_faiss_index(vectors, index_type, **index_params)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        found_distances = np.empty_like(exact_distances)
+        found_ids = np.empty_like(exact_ids)
+        for i in range(len(queries)):
+            start = time.perf_counter()
+            found_distances[i:i + 1], found_ids[i:i + 1] = index.search(queries[i:i + 1], k)
+            latencies.append(time.perf_counter() - start)
+
+        hits, max_distance_error = _count_hits(exact_distances, exact_ids, found_distances, found_ids)
+
+        latencies_us = np.array(latencies) * 1e6
+        entry = {
+            **describe_index(index),
+            'num_vectors': len(vectors),
+            'build_seconds': round(build_seconds, 3),
+            'p50_us': round(float(np.percentile(latencies_us, 50)), 1),
+            'p99_us': round(float(np.percentile(latencies_us, 99)), 1),
+            f'recall@{k}': round(hits / exact_ids.size, 4),
+            'max_distance_error': round(max_distance_error, 6)
+        }
+
+        if blocks:
+            filtered_latencies = []
+            filtered_hits = 0
+            for i, (block, block_distances, block_ids) in enumerate(blocks):
+                start = time.perf_counter()
+                distances, ids = filtered_search(index, queries[i:i + 1], k, block)
+                filtered_latencies.append(time.perf_counter() - start)
+                filtered_hits += _count_hits(block_distances, block_ids, distances, ids)[0]
+            filtered_us = np.array(filtered_latencies) * 1e6
+            entry.update({
+                'filter_rows': len(blocks[0][0]),
+                'filtered_p50_us': round(float(np.percentile(filtered_us, 50)), 1),
+                'filtered_p99_us': round(float(np.percentile(filtered_us, 99)), 1),
+                f'filtered_recall@{k}': round(filtered_hits / (len(blocks) * k), 4)
+            })
+        report.append(entry)
+    return report
+
+
+def _count_hits(
+    exact_distances: np.ndarray,
+    exact_ids: np.ndarray,
+    found_distances: np.ndarray,
+    found_ids: np.ndarray
+) -> Tuple[int, float]:
+    """Neighbours found that exact search also returned, and the largest distance disagreement among them"""
+    hits = 0
+    max_distance_error = 0.0
+    for row in range(len(exact_ids)):
+        exact_row = dict(zip(exact_ids[row].tolist(), exact_distances[row].tolist()))
+        for doc_id, distance in zip(found_ids[row].tolist(), found_distances[row].tolist()):
+            if doc_id in exact_row:
+                hits += 1
+                max_distance_error = max(max_distance_error, abs(distance - exact_row[doc_id]))
+    return hits, max_distance_error
@@ -0,0 +1,90 @@
+"""
+Compare per-question latency of the old rebuild-everything path against a warm RagPipeline.
+
+"cold" answers every question in a fresh Python process that loads the CSV into an
+empty SQLite database, reads the index and calibration data from disk and runs one
+query: the per-question work of the original run_rag_pipeline, with no in-process
+state carried over. It is timed inside the child, after imports, and the on-disk
+embedding cache is shared with the warm run. "warm" loads once and only calls query().
+
+Usage:
+    python -m benchmarks.pipeline_latency --questions "total assets" "number of members"
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+import numpy as np
+from app.rag_pipeline import RagPipeline
+
+
+def _summarize(latencies: List[float]) -> Dict:
+    arr = np.array(latencies) * 1000
+    return {
+        'n': len(latencies),
+        'mean_ms': round(float(arr.mean()), 2),
+        'p50_ms': round(float(np.percentile(arr, 50)), 2),
+        'p95_ms': round(float(np.percentile(arr, 95)), 2)
+    }
+
+def cold_query_seconds(question: str, error_rate: float) -> float:
+    """Answer one question from nothing but the files on disk, re-ingesting the CSV"""
+    with tempfile.TemporaryDirectory() as workdir:
+        start = time.perf_counter()
+        RagPipeline(sqlite_path=os.path.join(workdir, "db.sqlite")).query(question, error_rate=error_rate)
+        return time.perf_counter() - start
+
+def bench_cold(questions: List[str], error_rate: float) -> Dict:
+    latencies = []
+    for question in questions:
+        result = subprocess.run(
+            [sys.executable, "-m", "benchmarks.pipeline_latency",
+             "--cold-question", question, "--error-rate", str(error_rate)],
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        latencies.append(float(result.stdout.strip().splitlines()[-1]))
+    return _summarize(latencies)
+
+def bench_warm(questions: List[str], error_rate: float) -> Dict:
+    start = time.perf_counter()
+    pipeline = RagPipeline().load()
+    load_seconds = time.perf_counter() - start
+
+    latencies = []
+    for question in questions:
+        start = time.perf_counter()
+        pipeline.query(question, error_rate=error_rate)
+        latencies.append(time.perf_counter() - start)
+    summary = _summarize(latencies)
+    summary['load_ms'] = round(load_seconds * 1000, 2)
+    return summary
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--questions', nargs='+')
+    parser.add_argument('--error-rate', type=float, default=0.1)
+    parser.add_argument('--cold-question', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.cold_question is not None:
+        # One cold iteration, run by bench_cold in a fresh process
+        print(cold_query_seconds(args.cold_question, args.error_rate))
+        return
+    if not args.questions:
+        parser.error("--questions is required")
+
+    results = {
+        'cold': bench_cold(args.questions, args.error_rate),
+        'warm': bench_warm(args.questions, args.error_rate)
+    }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+"""
+End-to-end retrieval benchmark on synthetic wide tables with the offline hash embedder.
+
+Measures ingestion, schema extraction and index build time, single-question latency
+percentiles, batch throughput, peak memory, and how well conformal filtering covers
+the ground-truth source columns of held-out questions. No API key or LLM is needed:
+column descriptions and questions are generated from the column names.
+
+Usage:
+    python -m benchmarks.retrieval_suite --tables 2 --columns 300 --rows 20000 -o results.json
+"""
+import os
+
+# Must be set before the embeddings client is first created
+os.environ.setdefault('EMBEDDING_BACKEND', 'fake')
+
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import faiss
+from app.data_loader import build_sqlite_table_from_csv, extract_sqlite_schema
+from app.metadata_vectorstore import (
+    build_table_documents,
+    store_descriptions_in_vectorstore,
+    get_vectorstore,
+    search_metadata_columnar,
+    default_confidence_threshold,
+    retrieval_mode
+)
+from app.vector_index import describe_index
+from app.calibration.calibration_data import score_calibration_questions
+from app.calibration.conformal import ConformalThresholds, conformal_select, conformal_select_many
+from app.tracing import stage_metrics, reset_stage_metrics
+
+QUALIFIERS = [
+    'total', 'average', 'used vehicle', 'new vehicle', 'real estate', 'commercial',
+    'consumer', 'credit card', 'member business', 'annual', 'quarterly', 'delinquent'
+]
+MEASURES = [
+    'assets', 'loans', 'deposits', 'members', 'income', 'expenses', 'shares', 'branches',
+    'employees', 'charge offs', 'net worth', 'reserves', 'investments', 'borrowings'
+]
+QUESTION_TEMPLATES = [
+    "what is the {phrase}",
+    "show me {phrase} for each credit union",
+    "how large are the {phrase}",
+    "which unions report the highest {phrase}"
+]
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1)
+
+def _percentiles(seconds: List[float]) -> Dict:
+    ms = np.array(seconds) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3)
+    }
+
+def synthetic_columns(num_columns: int) -> List[Tuple[str, str]]:
+    """(column name, descriptive phrase) pairs, e.g. ('USED_VEHICLE_LOANS_2', 'used vehicle loans 2')"""
+    columns = []
+    for i in range(num_columns):
+        qualifier = QUALIFIERS[i % len(QUALIFIERS)]
+        measure = MEASURES[(i // len(QUALIFIERS)) % len(MEASURES)]
+        period = i // (len(QUALIFIERS) * len(MEASURES))
+        phrase = f"{qualifier} {measure}" + (f" {period + 2000}" if period else "")
+        columns.append((phrase.upper().replace(' ', '_'), phrase))
+    return columns
+
+def write_wide_csv(path: str, columns: List[Tuple[str, str]], num_rows: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    values = rng.integers(0, 1_000_000, size=(num_rows, len(columns)))
+    with open(path, 'w') as f:
+        f.write("CU_NAME," + ",".join(name for name, _ in columns) + "\n")
+        for row_number, row in enumerate(values):
+            f.write(f"UNION {row_number}," + ",".join(map(str, row.tolist())) + "\n")
+
+def synthetic_metadata(table_name: str, columns: List[Tuple[str, str]]) -> Dict:
+    """What the LLM inference step would return, derived from column names"""
+    return {
+        'table_description': f"{table_name.replace('_', ' ')}: credit union financial figures",
+        'columns': [
+            {'column_name': 'CU_NAME', 'data_type': 'TEXT', 'column_description': 'name of the credit union'}
+        ] + [
+            {'column_name': name, 'data_type': 'INTEGER', 'column_description': f"{phrase} reported by the credit union"}
+            for name, phrase in columns
+        ]
+    }
+
+def synthetic_questions(table_name: str, columns: List[Tuple[str, str]], per_column: int, rng: random.Random) -> List[Dict]:
+    questions = []
+    for name, phrase in columns:
+        for template in rng.sample(QUESTION_TEMPLATES, per_column):
+            questions.append({
+                'question': template.format(phrase=phrase),
+                'source_columns': [name],
+                'table_name': table_name
+            })
+    return questions
+
+def coverage_report(
+    chunks: List,
+    questions: List[Dict],
+    thresholds: ConformalThresholds,
+    error_rate: float
+) -> Dict:
+    """Share of ground-truth columns kept by conformal filtering, and the kept set sizes"""
+    selected = conformal_select_many(chunks, error_rate, thresholds)
+    covered = 0
+    retrieved = 0
+    set_sizes = []
+    for question, question_chunks, question_selected in zip(questions, chunks, selected):
+        truth = {(question['table_name'], column) for column in question['source_columns']}
+        kept = {(m['metadata']['table_name'], m['metadata']['column_name']) for m in question_selected.to_matches()}
+        in_top_k = {
+            (m['metadata']['table_name'], m['metadata'].get('column_name'))
+            for m in question_chunks.to_matches()
+        }
+        covered += len(truth & kept)
+        retrieved += len(truth & in_top_k)
+        set_sizes.append(len(kept))
+    total = sum(len(q['source_columns']) for q in questions)
+    return {
+        'error_rate': error_rate,
+        'threshold': round(thresholds.threshold(error_rate), 4),
+        'target_coverage': round(1 - error_rate, 3),
+        # Conformal coverage holds for columns that reach the top k at all
+        'coverage_of_retrieved': round(covered / retrieved, 4) if retrieved else None,
+        'recall': round(covered / total, 4) if total else None,
+        'mean_set_size': round(float(np.mean(set_sizes)), 2) if set_sizes else 0.0
+    }
+
+def run_suite(
+    num_tables: int = 2,
+    num_columns: int = 300,
+    num_rows: int = 20_000,
+    questions_per_column: int = 2,
+    k: int = 10,
+    error_rates: Tuple[float, ...] = (0.05, 0.1, 0.2),
+    latency_queries: int = 500,
+    index_type: str = 'auto',
+    confidence_threshold: Optional[float] = None,
+    seed: int = 0,
+    workdir: str = None
+) -> Dict:
+    rng = random.Random(seed)
+    if confidence_threshold is None:
+        confidence_threshold = default_confidence_threshold()
+    workdir = workdir or tempfile.mkdtemp(prefix="retrieval_suite_")
+    sqlite_path = os.path.join(workdir, "bench.sqlite")
+    vectorstore_path = os.path.join(workdir, "metadata_index")
+    columns = synthetic_columns(num_columns)
+    table_names = [f"wide_table_{i}" for i in range(num_tables)]
+    stages = {}
+    reset_stage_metrics()
+
+    # Ingestion
+    csv_paths = {}
+    for i, table_name in enumerate(table_names):
+        csv_paths[table_name] = os.path.join(workdir, f"{table_name}.csv")
+        write_wide_csv(csv_paths[table_name], columns, num_rows, seed + i)
+    start = time.perf_counter()
+    for table_name in table_names:
+        build_sqlite_table_from_csv(csv_paths[table_name], sqlite_path, table_name)
+    stages['ingestion'] = {
+        'seconds': round(time.perf_counter() - start, 3),
+        'csv_mb': round(sum(os.path.getsize(p) for p in csv_paths.values()) / 1e6, 1),
+        'max_rss_mb': _max_rss_mb()
+    }
+
+    # Schema extraction (cold profile, then the cached path)
+    start = time.perf_counter()
+    schemas = {table_name: extract_sqlite_schema(sqlite_path, table_name) for table_name in table_names}
+    cold_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    for table_name in table_names:
+        extract_sqlite_schema(sqlite_path, table_name)
+    stages['schema_extraction'] = {
+        'seconds': round(cold_seconds, 3),
+        'cached_seconds': round(time.perf_counter() - start, 3),
+        'max_rss_mb': _max_rss_mb()
+    }
+
+    # Index build
+    documents = []
+    for table_name in table_names:
+        documents.extend(build_table_documents(
+            table_name,
+            synthetic_metadata(table_name, columns),
+            schemas[table_name]['columns']
+        ))
+    start = time.perf_counter()
+    store_descriptions_in_vectorstore(documents, vectorstore_path, index_type=index_type)
+    build_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    vectorstore = get_vectorstore(vectorstore_path)
+    stages['index_build'] = {
+        'seconds': round(build_seconds, 3),
+        'load_seconds': round(time.perf_counter() - start, 4),
+        'documents': len(documents),
+        'index': describe_index(vectorstore.index),
+        'max_rss_mb': _max_rss_mb()
+    }
+
+    # Calibration on half of the synthetic questions, evaluation on the other half
+    questions = [
+        question
+        for table_name in table_names
+        for question in synthetic_questions(table_name, columns, questions_per_column, rng)
+    ]
+    rng.shuffle(questions)
+    calibration_questions = questions[:len(questions) // 2]
+    test_questions = questions[len(questions) // 2:]
+    start = time.perf_counter()
+    thresholds = ConformalThresholds.from_records(
+        score_calibration_questions(
+            calibration_questions,
+            vectorstore=vectorstore,
+            confidence_threshold=confidence_threshold
+        )
+    )
+    stages['calibration'] = {
+        'seconds': round(time.perf_counter() - start, 3),
+        'questions': len(calibration_questions),
+        'records': len(thresholds)
+    }
+
+    # Single-question latency: search plus conformal filtering, as on the request path
+    latency_sample = [q['question'] for q in test_questions[:latency_queries]]
+    latencies = []
+    for question in latency_sample:
+        start = time.perf_counter()
+        chunks = search_metadata_columnar(
+            [question], k=k, confidence_threshold=confidence_threshold, vectorstore=vectorstore
+        )[0]
+        conformal_select(chunks, error_rate=0.1, thresholds=thresholds)
+        latencies.append(time.perf_counter() - start)
+    stages['query_latency'] = {'queries': len(latencies), **_percentiles(latencies)}
+
+    # Batch throughput over all held-out questions
+    start = time.perf_counter()
+    test_chunks = search_metadata_columnar(
+        [q['question'] for q in test_questions],
+        k=k,
+        confidence_threshold=confidence_threshold,
+        vectorstore=vectorstore
+    )
+    conformal_select_many(test_chunks, 0.1, thresholds)
+    batch_seconds = time.perf_counter() - start
+    stages['batch_throughput'] = {
+        'questions': len(test_questions),
+        'seconds': round(batch_seconds, 3),
+        'questions_per_second': round(len(test_questions) / batch_seconds, 1)
+    }
+
+    return {
+        'config': {
+            'tables': num_tables,
+            'columns_per_table': num_columns + 1,
+            'rows_per_table': num_rows,
+            'questions_per_column': questions_per_column,
+            'k': k,
+            'index_type': index_type,
+            'confidence_threshold': confidence_threshold,
+            'retrieval_mode': retrieval_mode(),
+            'embedding_backend': os.environ['EMBEDDING_BACKEND'],
+            'seed': seed
+        },
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'faiss': faiss.__version__,
+            'platform': platform.platform()
+        },
+        'stages': stages,
+        'quality': [coverage_report(test_chunks, test_questions, thresholds, rate) for rate in error_rates],
+        # Span timings of every stage run above, including embedding and FAISS calls
+        'stage_metrics': stage_metrics(),
+        'max_rss_mb': _max_rss_mb()
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--tables', type=int, default=2)
+    parser.add_argument('--columns', type=int, default=300)
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--questions-per-column', type=int, default=2, choices=range(1, len(QUESTION_TEMPLATES) + 1))
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--error-rates', type=float, nargs='+', default=[0.05, 0.1, 0.2])
+    parser.add_argument('--latency-queries', type=int, default=500)
+    parser.add_argument('--index-type', default='auto')
+    parser.add_argument('--confidence-threshold', type=float, default=None,
+                        help="Candidate distance cut-off (default: the backend's CONFIDENCE_THRESHOLD)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-o', '--output', default='-', help="JSON report path (default: stdout)")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated CSVs, database and index")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="retrieval_suite_")
+    try:
+        report = run_suite(
+            num_tables=args.tables,
+            num_columns=args.columns,
+            num_rows=args.rows,
+            questions_per_column=args.questions_per_column,
+            k=args.k,
+            error_rates=tuple(args.error_rates),
+            latency_queries=args.latency_queries,
+            index_type=args.index_type,
+            confidence_threshold=args.confidence_threshold,
+            seed=args.seed,
+            workdir=workdir
+        )
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.keep:
+        report['workdir'] = workdir
+    text = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,13 @@
-from app.rag_pipeline import run_rag_pipeline
+from app.rag_pipeline import RagPipeline
 
 
 if __name__ == "__main__":
     print("\nWelcome to Improved RAG Reasoning Lab 🧠")
-    question = input("\nAsk a question about your data: ")
-    response = run_rag_pipeline(question)
-    print("\n---\nAnswer:")
-    print(response)
\ No newline at end of file
+    pipeline = RagPipeline().load()
+    while True:
+        question = input("\nAsk a question about your data (empty to quit): ")
+        if not question.strip():
+            break
+        response = pipeline.query(question)
+        print("\n---\nAnswer:")
+        print(response)
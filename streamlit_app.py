@@ -1,5 +1,5 @@
 import streamlit as st
-from app.rag_pipeline import run_rag_pipeline
+from app.rag_pipeline import RagPipeline
 from app.ui.components import init_page, render_sidebar, render_chat_messages, render_chat_input
 import warnings
 warnings.filterwarnings("ignore")
@@ -7,6 +7,13 @@ warnings.filterwarnings("ignore")
 # Initialize page with configuration and styles
 init_page()
 
+@st.cache_resource
+def get_rag_pipeline() -> RagPipeline:
+    """Load the pipeline once per server process and share it across sessions"""
+    return RagPipeline().load()
+
+pipeline = get_rag_pipeline()
+
 # Get configurations from sidebar
 error_rate = render_sidebar()
 
@@ -31,7 +38,7 @@ if send_button and question.strip():
     
     # Get RAG response with verbose output
     with st.spinner(""):
-        response = run_rag_pipeline(
+        response = pipeline.query(
             question,
             error_rate=error_rate,
             verbose=True
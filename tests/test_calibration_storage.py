@@ -0,0 +1,121 @@
+import os
+import json
+import multiprocessing
+import numpy as np
+from app.calibration.storage import (
+    LEGACY_QUESTIONS_FILE,
+    MIGRATED_SUFFIX,
+    CalibrationQuestionStorage,
+    CalibrationScoreStore
+)
+
+WORKERS = 4
+BATCHES = 25
+BATCH_SIZE = 8
+
+
+def _record(question, column_name, distance, table_name="sales"):
+    return {
+        'question': question,
+        'category': 'single_column',
+        'cosine_distance': distance,
+        'metadata': {'type': 'column', 'table_name': table_name, 'column_name': column_name},
+        'source_columns': [column_name],
+        'retrieval_mode': 'dense'
+    }
+
+def _open(storage_path):
+    # Same order as CalibrationDataCollector: questions are imported before scores
+    return CalibrationQuestionStorage(storage_path), CalibrationScoreStore(storage_path)
+
+def test_records_only_questions_file_is_migrated(tmp_path):
+    # Earlier collectors overwrote questions.json with {"records": [...]}, dropping the questions
+    records = [
+        _record("What is the total revenue?", "revenue", 0.41),
+        _record("What is the total revenue?", "amount", 0.52),
+        _record("Which region sold most?", "region", 0.33)
+    ]
+    with open(tmp_path / LEGACY_QUESTIONS_FILE, "w") as f:
+        json.dump({'records': records}, f)
+
+    questions, scores = _open(str(tmp_path))
+
+    stored = questions.get_questions()
+    assert [q['question'] for q in stored] == ["What is the total revenue?", "Which region sold most?"]
+    assert stored[0]['table_name'] == "sales"
+    ids = {q['question']: q['id'] for q in stored}
+    columns = scores.load_columns()
+    np.testing.assert_array_equal(columns['distance'], [0.41, 0.52, 0.33])
+    np.testing.assert_array_equal(columns['question_id'], [ids[r['question']] for r in records])
+    assert os.path.exists(str(tmp_path / LEGACY_QUESTIONS_FILE) + MIGRATED_SUFFIX)
+    assert not os.path.exists(tmp_path / LEGACY_QUESTIONS_FILE)
+
+def test_migrated_scores_survive_reopening_and_empty_recollection(tmp_path):
+    with open(tmp_path / LEGACY_QUESTIONS_FILE, "w") as f:
+        json.dump({'records': [_record("How many orders?", "order_id", 0.2)]}, f)
+    _open(str(tmp_path))
+
+    questions, scores = _open(str(tmp_path))
+    assert len(questions.get_questions()) == 1
+    assert len(scores) == 1
+
+    # A re-collection that scored nothing must not wipe the run
+    scores.new_run([], 'dense')
+    assert len(scores) == 1
+    assert scores.records()[0]['question'] == "How many orders?"
+
+    scores.clear()
+    assert len(scores) == 0
+    assert len(questions.get_questions()) == 1
+
+def test_questions_and_records_file_keeps_questions_and_links_scores(tmp_path):
+    with open(tmp_path / LEGACY_QUESTIONS_FILE, "w") as f:
+        json.dump({
+            'questions': [{'question': "How many orders?", 'category': 'aggregation', 'source_columns': ["order_id"]}],
+            'records': [_record("How many orders?", "order_id", 0.2), _record("Unknown question?", "status", 0.7)]
+        }, f)
+
+    questions, scores = _open(str(tmp_path))
+
+    stored = questions.get_questions()
+    assert [(q['question'], q['category']) for q in stored] == [
+        ("How many orders?", 'aggregation'),
+        ("Unknown question?", 'single_column')
+    ]
+    np.testing.assert_array_equal(scores.load_columns()['question_id'], [q['id'] for q in stored])
+
+def _append_batches(storage_path, worker):
+    scores = CalibrationScoreStore(storage_path)
+    for batch in range(BATCHES):
+        records = []
+        for i in range(BATCH_SIZE):
+            question_id = worker * 10_000 + batch * 100 + i
+            record = _record(f"q{question_id}", f"c{question_id % 7}", float(question_id), table_name=f"t{worker}")
+            record['question_id'] = question_id
+            records.append(record)
+        scores.append(records)
+
+def test_concurrent_appends_keep_rows_aligned(tmp_path):
+    storage_path = str(tmp_path)
+    CalibrationScoreStore(storage_path).new_run([], 'dense')
+
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_append_batches, args=(storage_path, w)) for w in range(WORKERS)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    assert all(worker.exitcode == 0 for worker in workers)
+
+    scores = CalibrationScoreStore(storage_path)
+    columns = scores.load_columns()
+    scored = scores.scored_columns()
+    assert len(scores) == WORKERS * BATCHES * BATCH_SIZE
+    assert all(len(values) == len(scores) for values in columns.values())
+    # Every row's columns come from the same record
+    np.testing.assert_array_equal(columns['distance'], columns['question_id'].astype(np.float64))
+    assert all(
+        scored[column_id] == (f"t{question_id // 10_000}", f"c{question_id % 7}")
+        for question_id, column_id in zip(columns['question_id'].tolist(), columns['column_id'].tolist())
+    )
+    assert len(set(columns['question_id'].tolist())) == len(scores)
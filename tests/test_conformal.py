@@ -0,0 +1,55 @@
+import math
+from fractions import Fraction
+import numpy as np
+import pytest
+from app.calibration.conformal import ConformalThresholds
+
+
+@pytest.mark.parametrize("n, error_rate", [(9, "0.1"), (19, "0.1"), (19, "0.05"), (99, "0.1"), (100, "0.2"), (1000, "0.01")])
+def test_threshold_is_kth_smallest_score(n, error_rate):
+    scores = np.random.default_rng(n).random(n)
+    # Exact arithmetic, so ranks landing on an integer are not off by one
+    k = math.ceil((n + 1) * (1 - Fraction(error_rate)))
+    thresholds = ConformalThresholds(scores)
+
+    assert thresholds.threshold(float(error_rate)) == np.sort(scores)[k - 1]
+    assert thresholds.thresholds([float(error_rate)])[0] == np.sort(scores)[k - 1]
+
+def test_threshold_off_the_grid_matches_grid_lookup():
+    scores = np.random.default_rng(0).random(50)
+    on_grid = ConformalThresholds(scores)
+    off_grid = ConformalThresholds(scores, grid_step=None)
+
+    for error_rate in np.round(np.arange(0, 1.001, 0.01), 10):
+        assert on_grid.threshold(error_rate) == off_grid.threshold(error_rate)
+
+def test_rank_beyond_calibration_set_accepts_everything():
+    thresholds = ConformalThresholds(np.arange(19, dtype=float))
+
+    # ceil(20 * 0.99) = 20 > n
+    assert thresholds.threshold(0.01) == np.inf
+    # ceil(20 * 0) = 0 < 1
+    assert thresholds.threshold(1.0) == -np.inf
+
+def test_sliding_window_matches_fresh_thresholds_on_latest_scores():
+    rng = np.random.default_rng(1)
+    window = 50
+    # Rounded, so evictions have to pick the right one among equal scores
+    arrivals = np.round(rng.random(80), 2)
+    thresholds = ConformalThresholds(arrivals, window=window)
+
+    for size in (1, 7, 49, 50, 120, 3):
+        new_scores = np.round(rng.random(size), 2)
+        thresholds.update(new_scores)
+        arrivals = np.concatenate([arrivals, new_scores])
+        fresh = ConformalThresholds(arrivals[-window:])
+
+        assert len(thresholds) == window
+        np.testing.assert_array_equal(thresholds.scores, np.sort(arrivals[-window:]))
+        np.testing.assert_array_equal(thresholds.grid_thresholds, fresh.grid_thresholds)
+
+def test_update_without_window_keeps_every_score():
+    thresholds = ConformalThresholds([0.3, 0.1])
+    thresholds.update([0.2, 0.4])
+
+    np.testing.assert_array_equal(thresholds.scores, [0.1, 0.2, 0.3, 0.4])
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+from app.data_loader import build_sqlite_table_from_csv
+
+HEADER = "id,name,score\n"
+
+
+def _rows(start, stop):
+    return "".join(f"{i},name {i},{i * 0.5}\n" for i in range(start, stop))
+
+def _count(sqlite_path, table_name="data_table"):
+    with sqlite3.connect(sqlite_path) as conn:
+        return conn.execute(f'SELECT COUNT(*) FROM "{table_name}"').fetchone()[0]
+
+def test_unchanged_csv_is_skipped(tmp_path):
+    csv_path, sqlite_path = str(tmp_path / "data.csv"), str(tmp_path / "data.sqlite")
+    with open(csv_path, "w") as f:
+        f.write(HEADER + _rows(0, 100))
+
+    assert build_sqlite_table_from_csv(csv_path, sqlite_path)['action'] == 'rebuilt'
+    state = build_sqlite_table_from_csv(csv_path, sqlite_path)
+    assert state['action'] == 'skipped'
+    assert state['row_count'] == 100
+
+    # A new mtime alone is caught by the content hash
+    os.utime(csv_path, (0, 0))
+    assert build_sqlite_table_from_csv(csv_path, sqlite_path)['action'] == 'skipped'
+    assert _count(sqlite_path) == 100
+
+def test_grown_csv_appends_only_new_rows(tmp_path):
+    csv_path, sqlite_path = str(tmp_path / "data.csv"), str(tmp_path / "data.sqlite")
+    with open(csv_path, "w") as f:
+        f.write(HEADER + _rows(0, 100))
+    build_sqlite_table_from_csv(csv_path, sqlite_path, chunksize=30)
+
+    with open(csv_path, "a") as f:
+        f.write(_rows(100, 175))
+    state = build_sqlite_table_from_csv(csv_path, sqlite_path, chunksize=30)
+
+    assert state['action'] == 'appended'
+    assert state['row_count'] == 175
+    with sqlite3.connect(sqlite_path) as conn:
+        assert [row[0] for row in conn.execute("SELECT id FROM data_table ORDER BY rowid")] == list(range(175))
+
+def test_rewritten_csv_is_rebuilt(tmp_path):
+    csv_path, sqlite_path = str(tmp_path / "data.csv"), str(tmp_path / "data.sqlite")
+    with open(csv_path, "w") as f:
+        f.write(HEADER + _rows(0, 100))
+    build_sqlite_table_from_csv(csv_path, sqlite_path)
+
+    # Longer, but the old content is no longer a prefix
+    with open(csv_path, "w") as f:
+        f.write(HEADER + _rows(1, 150))
+    state = build_sqlite_table_from_csv(csv_path, sqlite_path)
+
+    assert state['action'] == 'rebuilt'
+    assert state['row_count'] == 149
+    assert _count(sqlite_path) == 149
+
+def test_append_to_unterminated_last_line_is_rebuilt(tmp_path):
+    csv_path, sqlite_path = str(tmp_path / "data.csv"), str(tmp_path / "data.sqlite")
+    with open(csv_path, "w") as f:
+        f.write(HEADER + _rows(0, 10).rstrip("\n"))
+    build_sqlite_table_from_csv(csv_path, sqlite_path)
+
+    # The first appended bytes continue the old last row
+    with open(csv_path, "a") as f:
+        f.write("0\n" + _rows(10, 20))
+    state = build_sqlite_table_from_csv(csv_path, sqlite_path)
+
+    assert state['action'] == 'rebuilt'
+    assert _count(sqlite_path) == 20
@@ -0,0 +1,47 @@
+import faiss
+import numpy as np
+import pytest
+from app import vector_index
+from app.vector_index import build_faiss_index, filtered_search
+from benchmarks.index_recall import synthetic_vectors
+
+NUM_TABLES = 400
+ROWS_PER_TABLE = 60
+K = 10
+MIN_RECALL = 0.95
+
+
+@pytest.fixture(scope="module")
+def hnsw():
+    vectors, queries = synthetic_vectors(NUM_TABLES * ROWS_PER_TABLE, 50, 32)
+    return build_faiss_index(vectors, index_type='hnsw'), vectors, queries
+
+def _recall(index, vectors, queries, ids):
+    _, exact = faiss.knn(queries, vectors[ids], K)
+    _, found = filtered_search(index, queries, K, ids)
+    assert np.isin(found[found >= 0], ids).all()
+    hits = sum(len(np.intersect1d(ids[expected], got)) for expected, got in zip(exact, found))
+    return hits / exact.size
+
+@pytest.mark.parametrize("table", [0, 123, NUM_TABLES - 1])
+def test_table_filter_recall_on_hnsw(hnsw, table):
+    index, vectors, queries = hnsw
+    ids = np.arange(table * ROWS_PER_TABLE, (table + 1) * ROWS_PER_TABLE)
+
+    assert _recall(index, vectors, queries, ids) >= MIN_RECALL
+
+def test_table_filter_recall_through_widened_selector(hnsw, monkeypatch):
+    index, vectors, queries = hnsw
+    # Force the id-selector walk instead of the exact scan of small subsets
+    monkeypatch.setattr(vector_index, 'EXACT_FILTER_MAX_ROWS', 0)
+    ids = np.arange(7 * ROWS_PER_TABLE, 8 * ROWS_PER_TABLE)
+
+    assert _recall(index, vectors, queries, ids) >= MIN_RECALL
+
+def test_unfiltered_recall_on_hnsw(hnsw):
+    index, vectors, queries = hnsw
+    _, exact = faiss.knn(queries, vectors, K)
+    _, found = index.search(queries, K)
+
+    hits = sum(len(np.intersect1d(expected, got)) for expected, got in zip(exact, found))
+    assert hits / exact.size >= MIN_RECALL